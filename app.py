@@ -1,21 +1,75 @@
-import webview
+import sys
+
+# A warm extractor process (see ExtractorPool) needs yt-dlp only, so it is
+# dispatched before Flask is imported and before any module-level set-up
+if __name__ == '__main__' and '--extractor-worker' in sys.argv:
+    from extractor_worker import main as extractor_worker_main
+    sys.exit(extractor_worker_main(sys.argv[sys.argv.index('--extractor-worker') + 1:]))
+
 import threading
-from flask import Flask, request, render_template_string, jsonify
+from flask import Flask, request, render_template_string, jsonify, Response, send_file
 import subprocess
 import os
-import sys
 import json
 import re
 import time
+import uuid
+import queue
+import atexit
+import argparse
+import sqlite3
 from datetime import datetime
-from easygui import diropenbox
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
 import tempfile
+import io
+import hashlib
+import hmac
+import secrets
+import socket
+import ipaddress
+import gzip
+import shutil
+import glob
+import signal
+import importlib.util
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, urljoin
+
+# AES-128 HLS decryption is optional: without it ffmpeg handles encrypted streams
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
+# Thumbnail down-scaling is optional: without Pillow /thumb serves originals
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# The desktop window and folder picker are not needed with --headless
+try:
+    import webview
+except ImportError:
+    webview = None
+try:
+    from easygui import diropenbox
+except ImportError:
+    diropenbox = None
+
+# Production WSGI server; without it the Flask development server is used
+try:
+    from waitress import serve
+except ImportError:
+    serve = None
 
 app = Flask(__name__)
 
-# Global progress tracking
-download_progress = {
+# Progress shape reported for every job (and for /progress when no job exists yet)
+IDLE_PROGRESS = {
     "percent": 0,
     "downloaded": "0B",
     "total": "Unknown",
@@ -25,9 +79,118 @@ download_progress = {
     "stage": "idle",
     "filename": "",
     "error": "",
-    "mode": "unknown"
+    "mode": "unknown",
+    # Exact numbers behind the display strings above (None = unknown)
+    "downloaded_bytes": 0,
+    "total_bytes": None,
+    "speed_bps": None,
+    "eta_s": None,
+    "fragment_index": None,
+    "fragment_count": None,
+    # Advanced (ffmpeg) mode only
+    "out_time_s": None,
+    "duration_s": None,
+    "bitrate_kbps": None,
+    "encode_speed": None
 }
-download_lock = threading.Lock()
+
+# Number of downloads that may run at the same time
+MAX_CONCURRENT_DOWNLOADS = int(os.environ.get('AVD_MAX_WORKERS', '3'))
+# Server-sent progress: minimum gap between two events of one stream, and
+# how often an idle stream sends a keep-alive comment
+PROGRESS_STREAM_INTERVAL = 0.25
+PROGRESS_STREAM_KEEPALIVE = 15
+
+# Web server: listen address, port and request threads. HEADLESS is set by
+# --headless, which serves the UI without the desktop window
+SERVER_HOST = os.environ.get('AVD_HOST', '127.0.0.1')
+SERVER_PORT = int(os.environ.get('AVD_PORT', '5000'))
+SERVER_THREADS = int(os.environ.get('AVD_SERVER_THREADS', '16'))
+HEADLESS = False
+
+# Finished jobs kept around for /jobs before the oldest are forgotten
+MAX_FINISHED_JOBS = 200
+# Job states a job never leaves again
+FINISHED_STATUSES = ('completed', 'error', 'cancelled')
+# Spans recorded per job trace before further ones are dropped
+TRACE_MAX_SPANS = 500
+
+# Per-site scheduling: downloads running at once against one site, and the
+# minimum gap in seconds between two of them starting. HOST_LIMITS holds
+# per-site overrides as 'site': (max_running, spacing).
+HOST_MAX_WORKERS = int(os.environ.get('AVD_HOST_MAX_WORKERS', '2'))
+HOST_MIN_SPACING = float(os.environ.get('AVD_HOST_SPACING', '1.0'))
+HOST_LIMITS = {}
+
+# Durable record of jobs so unfinished downloads resume after a restart
+JOURNAL_FILE = 'jobs.db'
+
+# Index of finished downloads, so the same video isn't fetched twice. Each
+# download folder also gets a manifest the index can be rebuilt from.
+ARCHIVE_FILE = 'archive.db'
+ARCHIVE_MANIFEST = '.avd-archive.jsonl'
+JOURNAL_SAVE_INTERVAL = 2.0       # seconds between progress checkpoints per job
+
+# Extracted video info shared by /preview and /download
+INFO_CACHE_SIZE = 64
+INFO_CACHE_TTL = 15 * 60          # seconds; stream URLs inside the info expire
+INFO_CACHE_DIR = os.environ.get('AVD_INFO_CACHE_DIR', '')   # empty = memory only
+
+# /thumb: fetched thumbnails and their resized variants, kept on disk
+THUMB_CACHE_DIR = os.environ.get('AVD_THUMB_CACHE_DIR', 'thumbs')
+THUMB_CACHE_MAX_BYTES = int(os.environ.get('AVD_THUMB_CACHE_MB', '100')) * 1024 * 1024
+THUMB_MAX_FETCH = 10 * 1024 * 1024      # larger remote images are refused
+THUMB_WIDTHS = (80, 160, 320, 640)      # requested widths round up to one of these
+THUMB_MAX_AGE = 7 * 24 * 3600           # Cache-Control max-age for the webview
+THUMB_MAX_REDIRECTS = 3
+# /thumb only fetches URLs signed with this key, i.e. ones a preview handed out
+THUMB_SIGNING_KEY = secrets.token_bytes(32)
+
+# Warm yt-dlp extractor processes (used when the yt_dlp package is importable)
+EXTRACTOR_WORKERS = int(os.environ.get('AVD_EXTRACTOR_WORKERS', '1'))
+EXTRACTOR_TIMEOUT = 60            # seconds per extraction request
+EXTRACTOR_PING_INTERVAL = 30      # seconds between health checks of idle workers
+
+# /preview/batch: extractions run at once, and URLs accepted per request
+PREVIEW_BATCH_CONCURRENCY = int(os.environ.get('AVD_PREVIEW_CONCURRENCY', '6'))
+PREVIEW_BATCH_MAX = 500
+# Single /preview requests allowed to extract at the same time
+PREVIEW_MAX_RUNNING = int(os.environ.get('AVD_MAX_PREVIEWS', '3'))
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Native HLS downloader (advanced mode)
+HLS_CONCURRENCY = int(os.environ.get('AVD_HLS_CONCURRENCY', '8'))
+HLS_SEGMENT_RETRIES = 3
+HLS_SEGMENT_TIMEOUT = 30          # seconds per segment request
+
+# Global bandwidth limit in bytes per second (0 = unlimited); changed at
+# runtime through /bandwidth, which saves it to BANDWIDTH_FILE
+BANDWIDTH_LIMIT = int(os.environ.get('AVD_BANDWIDTH_LIMIT', '0'))
+BANDWIDTH_BURST = 1.0             # seconds of traffic the bucket may save up
+BANDWIDTH_CHUNK = 64 * 1024       # bytes read between two throttle checks
+BANDWIDTH_RECHECK = 1.0           # seconds between a yt-dlp job's checks of its share
+BANDWIDTH_GROW = 1.25             # restart yt-dlp for a bigger share only if it grows this much
+
+# Format selection policy, changed at runtime through /format_policy (saved
+# to FORMAT_POLICY_FILE): video codecs in order of preference, and caps on
+# the chosen video+audio pair (0 = no cap)
+FORMAT_CODEC_ORDER = os.environ.get('AVD_CODEC_ORDER', 'avc1,vp9,av01,hevc')
+FORMAT_MAX_BITRATE = int(os.environ.get('AVD_MAX_BITRATE', '0'))         # kbit/s
+FORMAT_MAX_FILESIZE = int(os.environ.get('AVD_MAX_FILESIZE_MB', '0')) * 1024 * 1024
+
+# Before a download starts its peak disk need is checked against the free
+# space left after the running downloads and DISK_RESERVE; a shortfall is
+# refused, only logged ('warn') or not checked at all ('off')
+DISK_PREFLIGHT = os.environ.get('AVD_DISK_PREFLIGHT', 'refuse')
+DISK_RESERVE = int(os.environ.get('AVD_DISK_RESERVE_MB', '200')) * 1024 * 1024
+MP3_BYTES_PER_SECOND = 320 * 1000 // 8    # --audio-quality 0 output at most
+
+# One pooled HTTP session for everything the app fetches itself
+http_session = requests.Session()
+http_session.headers['User-Agent'] = USER_AGENT
+for _scheme in ('http://', 'https://'):
+    http_session.mount(_scheme, HTTPAdapter(pool_connections=16, pool_maxsize=max(10, HLS_CONCURRENCY * 2)))
 
 def resource_path(relative_path):
     """Get absolute path to resource, works for dev and for PyInstaller"""
@@ -37,7 +200,27 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
+# Child processes must not flash a console window on Windows; the flag
+# does not exist (and creationflags must be 0) anywhere else
+NO_WINDOW = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+
+def find_tool(name):
+    """
+    Path of an external program ('yt-dlp', 'ffmpeg' or 'ffprobe'):
+    $AVD_YTDLP / $AVD_FFMPEG / $AVD_FFPROBE when set, else the copy
+    shipped next to the app, else the one on PATH.
+    """
+    override = os.environ.get('AVD_' + name.upper().replace('-', ''))
+    if override:
+        return override
+    bundled = resource_path(name + '.exe' if os.name == 'nt' else name)
+    if os.path.isfile(bundled):
+        return bundled
+    return shutil.which(name) or bundled
+
 CONFIG_FILE = 'save_path.txt'
+BANDWIDTH_FILE = 'bandwidth.json'
+FORMAT_POLICY_FILE = 'format_policy.json'
 LOG_FILE = 'download_log.txt'
 
 def load_folder():
@@ -50,10 +233,255 @@ def load_folder():
 
 DOWNLOAD_FOLDER = load_folder()
 
-def log_message(message):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    with open(LOG_FILE, 'a', encoding='utf-8') as f:
-        f.write(f"[{timestamp}] {message}\n")
+# Background log writer
+LOG_QUEUE_SIZE = 10000            # lines buffered before new ones are dropped
+LOG_FLUSH_INTERVAL = 0.5          # seconds between batched writes
+LOG_SAMPLE_INTERVAL = 1.0         # keep one progress line per job per second
+LOG_MAX_BYTES = int(os.environ.get('AVD_LOG_MAX_BYTES', str(5 * 1024 * 1024)))   # rotate above this
+LOG_BACKUP_COUNT = int(os.environ.get('AVD_LOG_BACKUPS', '5'))   # gzip archives kept
+LOG_TOTAL_CAP = 4 * LOG_MAX_BYTES  # live log + archives never exceed this on disk
+
+
+class LogWriter:
+    """
+    Appends log lines to a file from a background thread. Lines are queued
+    with their timestamp and written in batches, so the download read loops
+    never wait on disk.
+    """
+
+    def __init__(self, path, max_queue, flush_interval, sample_interval,
+                 max_bytes=0, backup_count=0, total_cap=0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.total_cap = total_cap
+        self.flush_interval = flush_interval
+        self.sample_interval = sample_interval
+        self.pending = queue.Queue(max_queue)
+        self.file_lock = threading.Lock()
+        self.sample_lock = threading.Lock()
+        self.last_sampled = {}      # sample_key -> time of last kept line
+        self.dropped = 0
+        self.thread = None
+        self.start_lock = threading.Lock()
+
+    def write(self, message, sample_key=None):
+        now = time.time()
+        if sample_key is not None:
+            with self.sample_lock:
+                if now - self.last_sampled.get(sample_key, 0) < self.sample_interval:
+                    return
+                self.last_sampled[sample_key] = now
+        if self.thread is None:
+            self._start()
+        timestamp = datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            self.pending.put_nowait(f"[{timestamp}] {message}\n")
+        except queue.Full:
+            self.dropped += 1
+
+    def forget(self, sample_key):
+        with self.sample_lock:
+            self.last_sampled.pop(sample_key, None)
+
+    def _start(self):
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            lines = [self.pending.get()]
+            if lines[0] is not None:
+                time.sleep(self.flush_interval)     # let a batch accumulate
+            while True:
+                try:
+                    lines.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in lines
+            self._flush([l for l in lines if l is not None])
+
+    def _flush(self, lines):
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            lines.append(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                         f"(log queue full: {dropped} lines dropped)\n")
+        if not lines:
+            return
+        with self.file_lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+                size = f.tell()
+            if self.max_bytes and size >= self.max_bytes:
+                self._rotate()
+
+    def archive_path(self, n):
+        return f"{self.path}.{n}.gz"
+
+    def _rotate(self):
+        """
+        Compress the live log into archive 1, shifting older archives up and
+        deleting those past backup_count or the total disk cap.
+        """
+        try:
+            for n in range(self.backup_count, 0, -1):
+                src = self.archive_path(n)
+                if not os.path.exists(src):
+                    continue
+                if n == self.backup_count:
+                    os.remove(src)
+                else:
+                    os.replace(src, self.archive_path(n + 1))
+
+            if self.backup_count:
+                with open(self.path, 'rb') as src, gzip.open(self.archive_path(1) + '.tmp', 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.replace(self.archive_path(1) + '.tmp', self.archive_path(1))
+            with open(self.path, 'w', encoding='utf-8'):
+                pass
+
+            if self.total_cap:
+                archives = [self.archive_path(n) for n in range(1, self.backup_count + 1)
+                            if os.path.exists(self.archive_path(n))]
+                total = sum(os.path.getsize(a) for a in archives)
+                while archives and total > self.total_cap - self.max_bytes:
+                    oldest = archives.pop()
+                    total -= os.path.getsize(oldest)
+                    os.remove(oldest)
+        except OSError as e:
+            # Never let log housekeeping take the writer thread down
+            sys.stderr.write(f"Log rotation failed: {e}\n")
+
+    def clear(self):
+        """Empty the log file and delete its archives."""
+        with self.file_lock:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                f.write('')
+            for n in range(1, self.backup_count + 1):
+                try:
+                    os.remove(self.archive_path(n))
+                except OSError:
+                    pass
+
+    def close(self):
+        """Flush everything queued so far; called at interpreter exit."""
+        if self.thread is None:
+            return
+        self.pending.put(None)
+        self.thread.join(timeout=10)
+
+
+log_writer = LogWriter(
+    LOG_FILE, LOG_QUEUE_SIZE, LOG_FLUSH_INTERVAL, LOG_SAMPLE_INTERVAL,
+    LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_TOTAL_CAP
+)
+atexit.register(log_writer.close)
+
+# Lines logged while a worker runs a job are tagged "[job:<id>]"
+_log_context = threading.local()
+
+def log_message(message, sample_key=None):
+    """
+    Queue a line for the log file. Repetitive progress lines pass a
+    sample_key (e.g. the job id) and are kept at most once per
+    LOG_SAMPLE_INTERVAL for that key.
+    """
+    job_id = getattr(_log_context, 'job_id', None)
+    if job_id:
+        message = f"[job:{job_id}] {message}"
+    log_writer.write(message, sample_key)
+
+
+# /get_log paging
+LOG_PAGE_LINES = 200
+LOG_READ_BLOCK = 64 * 1024
+LOG_LEVELS = ('info', 'warning', 'error')
+_ERROR_WORDS = re.compile(r'error|exception|failed|traceback', re.IGNORECASE)
+
+def log_line_level(line):
+    if _ERROR_WORDS.search(line):
+        return 'error'
+    if 'warning' in line.lower():
+        return 'warning'
+    return 'info'
+
+def log_line_filter(level=None, job_id=None):
+    """Build a predicate for log lines: minimum level and/or a job id."""
+    min_rank = LOG_LEVELS.index(level) if level in LOG_LEVELS else 0
+    tag = f"[job:{job_id}]" if job_id else None
+
+    def match(line):
+        if tag and tag not in line:
+            return False
+        return LOG_LEVELS.index(log_line_level(line)) >= min_rank
+    return match
+
+def read_log_before(path, before=None, limit=LOG_PAGE_LINES, match=None):
+    """
+    Return (lines, start, size): up to `limit` matching lines that end
+    before byte offset `before` (default: end of file), oldest first, and
+    the offset of the earliest returned line. The file is read backwards
+    in blocks, so the cost depends on the page, not the file size.
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        cur = size if before is None else max(0, min(before, size))
+        start = cur
+        found = []      # newest first
+        carry = b''     # partial line at the front of what has been read
+        while cur > 0 and len(found) < limit:
+            step = min(LOG_READ_BLOCK, cur)
+            cur -= step
+            f.seek(cur)
+            pieces = (f.read(step) + carry).split(b'\n')
+            carry = pieces[0]
+            offset = cur + len(carry) + 1
+            complete = []
+            for piece in pieces[1:]:
+                complete.append((offset, piece))
+                offset += len(piece) + 1
+            if cur == 0:
+                complete.insert(0, (0, carry))
+            for line_start, piece in reversed(complete):
+                if not piece.strip():
+                    continue
+                line = piece.decode('utf-8', errors='replace').rstrip('\r')
+                if match is None or match(line):
+                    found.append(line)
+                    start = line_start
+                    if len(found) >= limit:
+                        break
+            else:
+                if cur == 0:
+                    start = 0   # scanned to the top: nothing older matches
+    found.reverse()
+    return found, start, size
+
+def read_log_after(path, after, limit=LOG_PAGE_LINES, match=None):
+    """
+    Return (lines, end, size): matching complete lines from byte offset
+    `after` onwards, stopping after `limit` of them; `end` is where the
+    next call should continue.
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(after)
+        found = []
+        end = after
+        while len(found) < limit:
+            raw = f.readline()
+            if not raw.endswith(b'\n'):
+                break       # unfinished line: pick it up next time
+            end += len(raw)
+            line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+            if line.strip() and (match is None or match(line)):
+                found.append(line)
+    return found, end, size
 
 def sanitize_filename(filename):
     filename = re.sub(r'[<>:"/\\|?*]', '', filename)
@@ -70,6 +498,1090 @@ def format_filesize(bytes_val):
     else:
         return f"{bytes_val/(1024*1024*1024):.2f}GB"
 
+def format_speed(bytes_per_s):
+    if bytes_per_s is None:
+        return None
+    if bytes_per_s < 1024:
+        return f"{bytes_per_s:.0f}B/s"      # stalled or throttled; KB would round to 0
+    return f"{format_filesize(bytes_per_s)}/s"
+
+def format_eta(seconds):
+    if seconds is None:
+        return "—"
+    seconds = int(seconds)
+    h, rem = divmod(seconds, 3600)
+    m, sec = divmod(rem, 60)
+    return f"{h}:{m:02d}:{sec:02d}" if h else f"{m:02d}:{sec:02d}"
+
+# Query parameters that never change which video a URL points to
+TRACKING_PARAMS = {'si', 'feature', 'fbclid', 'gclid', 'igshid', 'ref', 'ref_src', 'pp'}
+
+def canonical_url(url):
+    """Normalise a video URL so equivalent links share one cache entry."""
+    url = url.strip()
+    if '://' not in url:
+        url = 'https://' + url
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    if host.startswith('www.') or host.startswith('m.'):
+        host = host.split('.', 1)[1]
+    path = parts.path.rstrip('/') or '/'
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k not in TRACKING_PARAMS and not k.startswith('utm_')]
+
+    # youtu.be/<id> and /shorts/<id> are the same video as /watch?v=<id>
+    if host == 'youtu.be':
+        host, query, path = 'youtube.com', [('v', path.lstrip('/'))] + query, '/watch'
+    elif host == 'youtube.com' and path.startswith('/shorts/'):
+        query, path = [('v', path.split('/')[2])] + query, '/watch'
+
+    return urlunsplit(('https', host, path, urlencode(sorted(query)), ''))
+
+
+# Sites reachable under more than one domain
+HOST_ALIASES = {'youtu.be': 'youtube.com', 'x.com': 'twitter.com', 'fb.watch': 'facebook.com'}
+
+def host_key(url):
+    """The site a URL belongs to, e.g. 'pornhub.com' for https://de.pornhub.com/view..."""
+    if '://' not in url:
+        url = 'https://' + url
+    host = (urlsplit(url).hostname or '').lower()
+    if not host or host.replace('.', '').isdigit():
+        return host
+    labels = host.split('.')
+    # Keep the extra label of domains like bbc.co.uk
+    keep = 3 if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in ('co', 'com', 'net', 'org', 'ac') else 2
+    site = '.'.join(labels[-keep:])
+    return HOST_ALIASES.get(site, site)
+
+
+class Metrics:
+    """
+    Counters and histograms kept in memory and rendered in the Prometheus
+    text format for /metrics. Gauges are not stored: their callback is
+    read at scrape time and returns a value or a {labels tuple: value} map.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = OrderedDict()   # name -> (type, help, buckets or gauge callback)
+        self.values = {}                # (name, labels) -> value, or bucket counts + [sum, count]
+
+    def counter(self, name, help_text):
+        self.families[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text, buckets):
+        self.families[name] = ('histogram', help_text, tuple(buckets))
+
+    def gauge(self, name, help_text, read):
+        self.families[name] = ('gauge', help_text, read)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self.families[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        def escape(v):
+            return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}'
+
+    def render(self):
+        with self.lock:
+            values = {k: (list(v) if isinstance(v, list) else v) for k, v in self.values.items()}
+        lines = []
+        for name, (kind, help_text, extra) in self.families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'gauge':
+                read = extra()
+                series = read.items() if isinstance(read, dict) else [((), read)]
+                for labels, value in series:
+                    lines.append(f'{name}{self._labels(labels)} {value}')
+                continue
+            for (metric, labels), value in sorted(values.items(), key=lambda kv: kv[0]):
+                if metric != name:
+                    continue
+                if kind == 'counter':
+                    lines.append(f'{name}{self._labels(labels)} {value}')
+                    continue
+                for bound, count in zip(extra, value):
+                    lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {count}')
+                lines.append(f'{name}_bucket{self._labels(labels, [("le", "+Inf")])} {value[-1]}')
+                lines.append(f'{name}_sum{self._labels(labels)} {value[-2]}')
+                lines.append(f'{name}_count{self._labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+metrics = Metrics()
+metrics.histogram('avd_process_first_output_seconds',
+                  "Time from starting yt-dlp/ffmpeg to its first line of output",
+                  (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+metrics.histogram('avd_extraction_seconds',
+                  "Video info extraction time per site, by where it ran", DURATION_BUCKETS)
+metrics.histogram('avd_stage_seconds',
+                  "Time jobs spend in each stage (queued, starting, video, audio, merging, ...)",
+                  DURATION_BUCKETS)
+metrics.counter('avd_downloaded_bytes_total', "Bytes downloaded per site")
+metrics.histogram('avd_download_throughput_bytes_per_second',
+                  "Average download speed of each completed job, per site",
+                  (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2))
+metrics.counter('avd_jobs_finished_total', "Jobs that reached a final status, per site")
+metrics.counter('avd_errors_total', "Download and extraction failures per site, by cause")
+metrics.counter('avd_hls_segment_retries_total', "HLS segment fetches retried, by segment host and HTTP status")
+
+
+class InfoCache:
+    """LRU + TTL cache of yt-dlp info dicts, optionally mirrored to disk."""
+
+    def __init__(self, max_entries, ttl, directory=''):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self.entries = OrderedDict()    # key -> (fetched_at, info)
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.info.json')
+
+    def get(self, url):
+        key = canonical_url(url)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                return entry[1]
+            self.entries.pop(key, None)
+
+        if self.directory:
+            path = self._disk_path(key)
+            try:
+                fetched = os.path.getmtime(path)
+                if now - fetched < self.ttl:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        info = json.load(f)
+                    self._remember(key, fetched, info)
+                    return info
+                os.remove(path)
+            except (OSError, ValueError):
+                pass
+        return None
+
+    def put(self, url, info):
+        key = canonical_url(url)
+        self._remember(key, time.time(), info)
+        if self.directory:
+            try:
+                path = self._disk_path(key)
+                with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(info, f)
+                os.replace(path + '.tmp', path)
+            except OSError as e:
+                log_message(f"Info cache write failed: {str(e)}")
+
+    def _remember(self, key, fetched, info):
+        with self.lock:
+            self.entries[key] = (fetched, info)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                old_key, _ = self.entries.popitem(last=False)
+                if self.directory:
+                    try:
+                        os.remove(self._disk_path(old_key))
+                    except OSError:
+                        pass
+
+    def info_file(self, url, info):
+        """
+        Return (path, is_temporary) of a JSON file holding `info`, suitable
+        for yt-dlp --load-info-json.
+        """
+        if self.directory:
+            path = self._disk_path(canonical_url(url))
+            if os.path.exists(path):
+                return path, False
+        fd, path = tempfile.mkstemp(suffix='.info.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        return path, True
+
+
+info_cache = InfoCache(INFO_CACHE_SIZE, INFO_CACHE_TTL, INFO_CACHE_DIR)
+
+
+class BandwidthLimiter:
+    """
+    One limit shared by every download. `limit` is in bytes per second
+    (0 = unlimited); when `start` and `end` ('HH:MM') are both set it only
+    applies between those times of day, e.g. office hours, and downloads
+    run at full speed outside them.
+
+    yt-dlp runs out of process and can only be given a fixed --limit-rate
+    when it starts, so each such download claim()s an equal share of the
+    limit. Shares are split again whenever downloads start or finish and
+    whenever the limit or its time window changes: a running yt-dlp job
+    polls rebalance_due() and restarts with --continue at its new share.
+    The native HLS downloader is throttled live through a token bucket
+    that runs at whatever the claims leave. A claim is only granted from
+    what the other claims leave, so they never add up past the limit.
+    """
+
+    def __init__(self, limit=0, start='', end='', clock=time.monotonic):
+        self.lock = threading.Lock()
+        self.freed = threading.Condition(self.lock)     # a claim shrank or ended, or the limit changed
+        self.clock = clock
+        self.tokens = 0.0
+        self.stamp = clock()
+        self.active = 0
+        self.claims = {}        # key -> bytes/s given to a download we can't throttle live (0 = unlimited)
+        self.pending = set()    # keys waiting in claim(), already counted in every share
+        self.streams = 0        # HLS downloads drawing on the bucket
+        self.configure(limit, start, end)
+
+    def configure(self, limit, start='', end=''):
+        for value in (start, end):
+            if value:
+                datetime.strptime(value, '%H:%M')     # ValueError for the caller
+        with self.lock:
+            self.limit = max(0, int(limit or 0))
+            self.start, self.end = start or '', end or ''
+            self.tokens = 0.0
+            self.freed.notify_all()
+
+    def settings(self):
+        with self.lock:
+            return {'limit': self.limit, 'start': self.start, 'end': self.end,
+                    'rate': self._rate(), 'active': self.active,
+                    'claimed': sum(self.claims.values()), 'downloads': len(self.claims),
+                    'streams': self.streams}
+
+    def _rate(self):
+        if not self.limit:
+            return 0
+        if self.start and self.end:
+            now = datetime.now().strftime('%H:%M')
+            inside = (self.start <= now < self.end if self.start <= self.end
+                      else now >= self.start or now < self.end)   # window past midnight
+            if not inside:
+                return 0
+        return self.limit
+
+    def _share(self, rate):
+        """Equal share of `rate` for each claiming download and HLS stream."""
+        return rate // max(1, len(self.claims.keys() | self.pending) + self.streams)
+
+    def claim(self, key, cancel=None):
+        """
+        Reserve a fixed rate for a download that can't be throttled live,
+        or take a new one for a `key` that already holds a claim: an equal
+        share of the limit, but never more than the other claims leave.
+        While they leave nothing (they are about to shrink to make room)
+        this waits; a set `cancel` event raises DownloadCancelled. Returns
+        0 when no limit applies.
+        """
+        with self.lock:
+            self.claims.pop(key, None)
+            self.pending.add(key)
+            try:
+                while True:
+                    rate = self._rate()
+                    if not rate:
+                        self.claims[key] = 0
+                        return 0
+                    grant = min(self._share(rate), rate - sum(self.claims.values()))
+                    if grant > 0:
+                        self.claims[key] = grant
+                        return grant
+                    if cancel is not None and cancel.is_set():
+                        raise DownloadCancelled()
+                    self.freed.wait(0.5)
+            finally:
+                self.pending.discard(key)
+                self.freed.notify_all()
+
+    def rebalance_due(self, key):
+        """
+        Whether the download holding `key` should claim() again: its share
+        shrank (others started, the limit went down), the limit was lifted
+        or switched on by its time window, or its share grew by at least
+        BANDWIDTH_GROW.
+        """
+        with self.lock:
+            if key not in self.claims:
+                return False
+            held, rate = self.claims[key], self._rate()
+            if not rate or not held:
+                return bool(rate) != bool(held)
+            share = self._share(rate)
+            return share < held or share >= held * BANDWIDTH_GROW
+
+    def release(self, key):
+        with self.lock:
+            if self.claims.pop(key, None) is not None:
+                self.freed.notify_all()
+
+    @contextmanager
+    def streaming(self):
+        """Mark an HLS download as drawing on the bucket while the block runs."""
+        with self.lock:
+            self.streams += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.streams -= 1
+                self.freed.notify_all()
+
+    def joined(self):
+        with self.lock:
+            self.active += 1
+
+    def left(self):
+        with self.lock:
+            self.active -= 1
+
+    def throttle(self, nbytes, cancel=None):
+        """
+        Account for `nbytes` just received, sleeping while over the part of
+        the limit no claim holds; a set `cancel` event raises DownloadCancelled
+        instead of waiting for claimed bandwidth to come free.
+        """
+        with self.lock:
+            while True:
+                limit = self._rate()
+                now = self.clock()
+                if not limit:
+                    self.tokens, self.stamp = 0.0, now
+                    return
+                rate = limit - sum(self.claims.values())
+                if rate > 0:
+                    break
+                if cancel is not None and cancel.is_set():
+                    raise DownloadCancelled()
+                self.freed.wait(0.5)
+            self.tokens = min(rate * BANDWIDTH_BURST, self.tokens + (now - self.stamp) * rate)
+            self.stamp = now
+            # Going into debt makes concurrent callers queue up behind each other
+            self.tokens -= nbytes
+            delay = -self.tokens / rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+def load_bandwidth():
+    limiter = BandwidthLimiter(BANDWIDTH_LIMIT)
+    if os.path.exists(BANDWIDTH_FILE):
+        try:
+            with open(BANDWIDTH_FILE, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            limiter.configure(saved.get('limit', 0), saved.get('start', ''), saved.get('end', ''))
+        except (OSError, ValueError):
+            pass
+    return limiter
+
+bandwidth = load_bandwidth()
+
+
+def archive_key(info):
+    """(extractor, video id) of an info dict, or None if it lacks either."""
+    extractor = (info.get('extractor_key') or info.get('extractor') or '').lower()
+    video_id = info.get('id')
+    return (extractor, str(video_id)) if extractor and video_id else None
+
+
+class DownloadArchive:
+    """
+    SQLite index of finished downloads keyed by extractor + video id (and
+    format, so an MP3 doesn't hide a missing MP4). Each entry keeps the
+    video height it was downloaded at, so a request for better quality is
+    not skipped. Entries are mirrored to a manifest in the folder of each
+    file; rebuild() reads those back. The database is opened on first use,
+    so importing app writes nothing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.created = not os.path.exists(path)
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connect(self):
+        # Called with self.lock held
+        if self.conn is not None:
+            return self.conn
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    extractor   TEXT NOT NULL,
+                    video_id    TEXT NOT NULL,
+                    format      TEXT NOT NULL,
+                    url         TEXT,
+                    title       TEXT,
+                    output_path TEXT,
+                    size        INTEGER,
+                    downloaded  REAL,
+                    height      INTEGER,
+                    PRIMARY KEY (extractor, video_id, format)
+                ) WITHOUT ROWID""")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(downloads)")]
+            if 'height' not in columns:     # archive from before heights were kept
+                conn.execute("ALTER TABLE downloads ADD COLUMN height INTEGER")
+        self.conn = conn
+        return conn
+
+    def lookup(self, key, fmt=None):
+        """Archived copies of a video whose files still exist, newest first."""
+        query = ("SELECT format, output_path, size, downloaded, height FROM downloads "
+                 "WHERE extractor = ? AND video_id = ?")
+        args = list(key)
+        if fmt:
+            query += " AND format = ?"
+            args.append(fmt)
+        with self.lock:
+            rows = self._connect().execute(query + " ORDER BY downloaded DESC", args).fetchall()
+        return [{'format': f, 'path': p, 'size': size, 'downloaded': when, 'height': height}
+                for f, p, size, when, height in rows if p and os.path.exists(p)]
+
+    def record(self, key, fmt, url, title, output_path, height=None):
+        try:
+            size = os.path.getsize(output_path)
+        except OSError:
+            size = None
+        entry = {'extractor': key[0], 'id': key[1], 'format': fmt, 'url': url, 'title': title,
+                 'file': os.path.basename(output_path), 'size': size, 'downloaded': time.time(),
+                 'height': height}
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO downloads VALUES (?,?,?,?,?,?,?,?,?)",
+                (key[0], key[1], fmt, url, title, output_path, size, entry['downloaded'], height)
+            )
+        try:
+            manifest = os.path.join(os.path.dirname(output_path), ARCHIVE_MANIFEST)
+            with open(manifest, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        except OSError as e:
+            log_message(f"Could not update {ARCHIVE_MANIFEST}: {str(e)}")
+
+    def rebuild(self, folder):
+        """Replace the index with the manifests found under `folder`."""
+        rows = {}
+        for root, _dirs, files in os.walk(folder):
+            if ARCHIVE_MANIFEST not in files:
+                continue
+            with open(os.path.join(root, ARCHIVE_MANIFEST), 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                        path = os.path.join(root, e['file'])
+                        key = (e['extractor'], e['id'], e['format'])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    if os.path.exists(path):
+                        # Later lines win, as they did when they were recorded
+                        rows[key] = key + (e.get('url'), e.get('title'), path,
+                                           e.get('size'), e.get('downloaded'), e.get('height'))
+        with self.lock, self._connect() as conn:
+            conn.execute("DELETE FROM downloads")
+            conn.executemany("INSERT INTO downloads VALUES (?,?,?,?,?,?,?,?,?)", rows.values())
+        log_message(f"Download archive rebuilt from {folder}: {len(rows)} entries")
+        return len(rows)
+
+
+download_archive = DownloadArchive(ARCHIVE_FILE)
+
+
+def thumb_signature(url):
+    return hmac.new(THUMB_SIGNING_KEY, url.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+def thumb_path(url):
+    """The local /thumb address of a thumbnail URL handed out to the UI, or None."""
+    if not url or not url.startswith(('http://', 'https://')):
+        return None
+    return '/thumb?' + urlencode({'url': url, 'sig': thumb_signature(url)})
+
+
+def public_http_url(url):
+    """True if `url` is http(s) and its host resolves to public addresses only."""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return False
+    try:
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        addresses = socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)
+    except (OSError, UnicodeError, ValueError):
+        return False
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split('%')[0])
+        if not address.is_global or address.is_multicast:
+            return False
+    return bool(addresses)
+
+
+def sniff_image(data):
+    """MIME type of an image from its first bytes, or None if it isn't one we serve."""
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:12] in (b'ftypavif', b'ftypavis'):
+        return 'image/avif'
+    return None
+
+
+class ThumbCache:
+    """
+    Disk cache of remote thumbnails and down-scaled JPEG variants of them,
+    evicted least recently used first once the directory outgrows
+    `max_bytes`. Recency is kept in the files' access times, so it
+    survives restarts. Only public http(s) addresses are fetched, and only
+    content that is one of EXTENSIONS' image types is kept.
+    """
+
+    EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp',
+                  'image/gif': '.gif', 'image/avif': '.avif'}
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.files = OrderedDict()      # name -> size, least recently used first
+        self.total = 0
+        # The directory is made by the first _store(), so importing app writes nothing
+        entries = []
+        for name in (os.listdir(directory) if os.path.isdir(directory) else []):
+            try:
+                st = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_atime, name, st.st_size))
+        for _atime, name, size in sorted(entries):
+            self.files[name] = size
+            self.total += size
+
+    def get(self, url, width=None):
+        """Path of the cached image for `url`, scaled to `width` if given and possible."""
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        original = self._find(key + '.orig') or self._fetch(url, key)
+        if not width or Image is None:
+            return original
+        name = f"{key}.w{width}.jpg"
+        try:
+            return self._find(name) or self._resize(original, name, width)
+        except OSError:
+            return original     # a format this Pillow build can't read
+
+    def _find(self, prefix):
+        # Files without a known image extension (kept by older versions) are ignored
+        with self.lock:
+            name = next((n for n in (prefix, *(prefix + e for e in self.EXTENSIONS.values()))
+                         if n in self.files and self.mime_type(n)), None)
+            if name is None:
+                return None
+            self.files.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        try:
+            os.utime(path, (time.time(), os.stat(path).st_mtime))     # keep mtime: it feeds the ETag
+        except OSError:
+            with self.lock:
+                self.total -= self.files.pop(name, 0)
+            return None
+        return path
+
+    @classmethod
+    def mime_type(cls, path):
+        extension = os.path.splitext(path)[1]
+        return next((t for t, e in cls.EXTENSIONS.items() if e == extension), None)
+
+    def _fetch(self, url, key):
+        # Redirects are followed by hand so each hop gets the address check
+        for _ in range(THUMB_MAX_REDIRECTS + 1):
+            if not public_http_url(url):
+                raise ValueError('not a public http(s) address')
+            resp = http_session.get(url, timeout=15, stream=True, allow_redirects=False)
+            if not resp.is_redirect:
+                break
+            url = urljoin(url, resp.headers['Location'])
+            resp.close()
+        else:
+            raise ValueError('too many redirects')
+        try:
+            resp.raise_for_status()
+            ctype = resp.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if not ctype.startswith('image/'):
+                raise ValueError(f'not an image ({ctype or "no content type"})')
+            data = b''
+            for chunk in resp.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > THUMB_MAX_FETCH:
+                    raise ValueError('image too large')
+        finally:
+            resp.close()
+        # The bytes decide, not the header: anything else is never stored or served
+        kind = sniff_image(data)
+        if kind is None:
+            raise ValueError(f'not a supported image (sent as {ctype})')
+        return self._store(key + '.orig' + self.EXTENSIONS[kind], data)
+
+    def _resize(self, original, name, width):
+        with Image.open(original) as img:
+            if img.width <= width:
+                return original
+            img = img.convert('RGB')
+            img.thumbnail((width, width * 4))
+            buf = io.BytesIO()
+            img.save(buf, 'JPEG', quality=82, optimize=True)
+        return self._store(name, buf.getvalue())
+
+    def _store(self, name, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        evicted = []
+        with self.lock:
+            self.total += len(data) - self.files.pop(name, 0)
+            self.files[name] = len(data)
+            while self.total > self.max_bytes and len(self.files) > 1:
+                old, size = self.files.popitem(last=False)
+                self.total -= size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except OSError:
+                pass
+        return path
+
+
+thumb_cache = ThumbCache(THUMB_CACHE_DIR, THUMB_CACHE_MAX_BYTES)
+
+
+class ExtractorUnavailable(Exception):
+    """Raised when no warm extractor process can serve a request."""
+
+
+class PreviewCancelled(Exception):
+    """Raised in a preview that a newer one from the same client replaced."""
+
+
+class PreviewTicket:
+    """
+    One running preview. The process extracting for it is attached while
+    it runs, so cancel() can kill it from another request's thread. A
+    DownloadJob offers the same cancelled/attach/detach interface and is
+    passed where a download extracts.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.process = None
+
+    def attach(self, process):
+        with self.lock:
+            self.process = process
+            cancelled = self.cancelled
+        if cancelled:
+            process.kill()
+
+    def detach(self, process=None):
+        with self.lock:
+            self.process = None
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            process = self.process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+
+class PreviewRegistry:
+    """
+    Caps how many previews extract at once and remembers each client's
+    latest one: a new preview from a client cancels the one it replaces.
+    """
+
+    def __init__(self, max_running):
+        self.slots = threading.BoundedSemaphore(max(1, max_running))
+        self.lock = threading.Lock()
+        self.current = {}       # client token -> PreviewTicket
+
+    def begin(self, client):
+        """Register a preview and wait for a free slot; raises PreviewCancelled if replaced meanwhile."""
+        ticket = PreviewTicket()
+        if client:
+            with self.lock:
+                previous, self.current[client] = self.current.get(client), ticket
+            if previous is not None:
+                previous.cancel()
+        while not self.slots.acquire(timeout=0.2):
+            if ticket.cancelled:
+                raise PreviewCancelled()
+        return ticket
+
+    def end(self, client, ticket):
+        self.slots.release()
+        with self.lock:
+            if client and self.current.get(client) is ticket:
+                del self.current[client]
+
+    def cancel(self, client):
+        with self.lock:
+            ticket = self.current.pop(client, None)
+        if ticket is not None:
+            ticket.cancel()
+        return ticket is not None
+
+
+preview_registry = PreviewRegistry(PREVIEW_MAX_RUNNING)
+
+
+def _extractor_worker_command():
+    args = ['--extractor-worker', '--user-agent', USER_AGENT]
+    if getattr(sys, 'frozen', False):
+        return [sys.executable] + args
+    return [sys.executable, os.path.abspath(__file__)] + args
+
+
+class ExtractorProcess:
+    """Client side of one warm extractor process; restarts it when it dies."""
+
+    def __init__(self, name):
+        self.name = name
+        self.proc = None
+        self.lines = None
+        self.restarts = 0
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        self.stop()
+        self.proc = subprocess.Popen(
+            _extractor_worker_command(),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, encoding='utf-8', bufsize=1,
+            creationflags=NO_WINDOW
+        )
+        # A reader thread lets request() wait on the pipe with a timeout
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read, args=(self.proc, self.lines), daemon=True).start()
+
+    @staticmethod
+    def _read(proc, lines):
+        for line in iter(proc.stdout.readline, ''):
+            lines.put(line)
+        lines.put(None)     # EOF: the process exited
+
+    def stop(self):
+        if self.proc is not None:
+            try:
+                self.proc.kill()
+                self.proc.wait(timeout=5)
+            except Exception:
+                pass
+        self.proc = None
+
+    def request(self, payload, timeout):
+        if not self.alive():
+            if self.proc is not None:
+                self.restarts += 1
+                log_message(f"Extractor {self.name} died; restarting (#{self.restarts})")
+            self.start()
+        try:
+            self.proc.stdin.write(json.dumps(payload) + '\n')
+            self.proc.stdin.flush()
+            line = self.lines.get(timeout=timeout)
+        except (OSError, ValueError, queue.Empty):
+            line = None
+        if line is None:
+            # Hung or crashed mid-request: throw the process away
+            self.stop()
+            raise ExtractorUnavailable(f"extractor {self.name} did not answer")
+        return json.loads(line)
+
+
+class ExtractorPool:
+    """Fixed set of warm extractor processes shared by all requests."""
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self.idle = queue.Queue()
+        self.enabled = importlib.util.find_spec('yt_dlp') is not None
+        self.started = False
+
+    def start(self):
+        if not self.enabled or self.started:
+            return
+        self.started = True
+        for i in range(self.size):
+            worker = ExtractorProcess(f"#{i}")
+            try:
+                worker.start()
+            except OSError as e:
+                log_message(f"Could not start extractor {worker.name}: {str(e)}")
+            self.idle.put(worker)
+        threading.Thread(target=self._health_loop, name="extractor-health", daemon=True).start()
+        log_message(f"Extractor pool started with {self.size} warm process(es)")
+
+    def call(self, payload, timeout=EXTRACTOR_TIMEOUT, wait=True, ticket=None):
+        if not self.started:
+            raise ExtractorUnavailable("extractor pool not running")
+        worker = self._take(wait, ticket)
+        attached = None
+        try:
+            if ticket is not None:
+                if ticket.cancelled:
+                    raise PreviewCancelled()    # replaced just now: the worker goes back untouched
+                if not worker.alive():
+                    worker.start()
+                attached = worker.proc
+                ticket.attach(attached)
+            resp = worker.request(payload, timeout)
+        except ExtractorUnavailable:
+            if ticket is not None and ticket.cancelled:
+                # Killed on purpose: have a warm replacement ready for the next preview
+                worker.start()
+                raise PreviewCancelled()
+            raise
+        finally:
+            if attached is not None:
+                ticket.detach(attached)
+            self.idle.put(worker)
+        if not resp.get('ok'):
+            raise RuntimeError(resp.get('error') or 'extraction failed')
+        return resp
+
+    def _take(self, wait, ticket):
+        """
+        An idle worker. A preview waiting for one checks its ticket as
+        PreviewRegistry.begin() does and gives up with PreviewCancelled
+        once it has been replaced.
+        """
+        if not wait:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                raise ExtractorUnavailable("all extractor processes busy")
+        if ticket is None:
+            return self.idle.get()
+        while True:
+            if ticket.cancelled:
+                raise PreviewCancelled()
+            try:
+                return self.idle.get(timeout=0.2)
+            except queue.Empty:
+                pass
+
+    def extract(self, url, wait=True, ticket=None):
+        return self.call({'op': 'info', 'url': url}, wait=wait, ticket=ticket)['info']
+
+    def resolve_urls(self, url, format_arg, info=None, ticket=None):
+        return self.call({'op': 'url', 'url': url, 'format': format_arg, 'info': info}, ticket=ticket)['urls']
+
+    def _health_loop(self):
+        while True:
+            time.sleep(EXTRACTOR_PING_INTERVAL)
+            # Only idle workers are checked; busy ones are proving themselves
+            for _ in range(self.idle.qsize()):
+                try:
+                    worker = self.idle.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    worker.request({'op': 'ping'}, timeout=5)
+                except (ExtractorUnavailable, ValueError):
+                    log_message(f"Extractor {worker.name} failed health check; restarting")
+                    worker.restarts += 1
+                    worker.start()
+                finally:
+                    self.idle.put(worker)
+
+
+extractor_pool = ExtractorPool(EXTRACTOR_WORKERS)
+
+
+def extract_info(url, wait=True, ticket=None):
+    """
+    Return (info, error) for a single video URL, running yt-dlp --dump-json
+    only when the info is not already cached. With wait=False a busy
+    extractor pool is not waited for; a one-off yt-dlp process runs instead.
+    A PreviewTicket (or a DownloadJob) lets another thread cancel the
+    extraction, which then raises PreviewCancelled.
+    """
+    info = info_cache.get(url)
+    if info is not None:
+        log_message(f"Info cache hit: {url}")
+        return info, None
+
+    host = host_key(url)
+    started = time.monotonic()
+    try:
+        info = extractor_pool.extract(url, wait=wait, ticket=ticket)
+        info_cache.put(url, info)
+        metrics.observe('avd_extraction_seconds', time.monotonic() - started, host=host, source='pool')
+        return info, None
+    except ExtractorUnavailable:
+        pass    # fall back to a one-off yt-dlp process below
+    except PreviewCancelled:
+        raise
+    except Exception as e:
+        log_message(f"Info extraction failed: {str(e)[:500]}")
+        metrics.inc('avd_errors_total', host=host, cause='extraction')
+        return None, 'Could not fetch video info. Check the URL or try a different link.'
+
+    cmd = [
+        find_tool('yt-dlp'),
+        '--dump-json',
+        '--no-download',
+        '--no-playlist',
+        '--user-agent', USER_AGENT,
+        '--add-header', 'Accept:*/*',
+        '--add-header', 'Accept-Language:en-US,en;q=0.9',
+        '--no-check-certificate',
+        url
+    ]
+
+    process = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        creationflags=NO_WINDOW
+    )
+    if ticket is not None:
+        ticket.attach(process)
+    try:
+        stdout, stderr = process.communicate()
+    finally:
+        if ticket is not None:
+            ticket.detach(process)
+    if ticket is not None and ticket.cancelled:
+        raise PreviewCancelled()
+
+    if process.returncode != 0:
+        log_message(f"Info extraction failed: {stderr[:500]}")
+        metrics.inc('avd_errors_total', host=host, cause='extraction')
+        return None, 'Could not fetch video info. Check the URL or try a different link.'
+
+    # yt-dlp may output multiple JSON lines for playlists; take the first
+    first_line = next((l for l in stdout.splitlines() if l.strip().startswith('{')), None)
+    if not first_line:
+        return None, 'No video metadata returned.'
+
+    info = json.loads(first_line)
+    info_cache.put(url, info)
+    metrics.observe('avd_extraction_seconds', time.monotonic() - started, host=host, source='subprocess')
+    return info, None
+
+
+def iter_playlist_entries(url):
+    """
+    Yield the entries of a playlist or channel as yt-dlp lists them. Flat
+    extraction only reads the listing pages, never the videos, and entries
+    come out one JSON line each, so callers see them while yt-dlp is still
+    paging through a long channel. Raises RuntimeError when nothing could
+    be listed.
+    """
+    cmd = [
+        find_tool('yt-dlp'),
+        '--flat-playlist',
+        '--dump-json',
+        '--yes-playlist',
+        '--user-agent', USER_AGENT,
+        '--add-header', 'Accept:*/*',
+        '--add-header', 'Accept-Language:en-US,en;q=0.9',
+        '--no-check-certificate',
+        url
+    ]
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        creationflags=NO_WINDOW,
+        bufsize=1, universal_newlines=True
+    )
+    spawned = time.monotonic()
+    count, last_error = 0, ''
+    try:
+        for line in iter(process.stdout.readline, ''):
+            if spawned:
+                metrics.observe('avd_process_first_output_seconds', time.monotonic() - spawned, tool='yt-dlp')
+                spawned = None
+            line = line.strip()
+            if not line.startswith('{'):
+                if line:
+                    log_message(f"  {line}")
+                    if 'ERROR' in line:
+                        last_error = line
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            count += 1
+            yield playlist_entry(entry, count)
+        process.wait()
+        if not count:
+            log_message(f"Playlist listing failed (exit code {process.returncode}): {last_error[:500]}")
+            raise RuntimeError('No playlist entries found. Check the URL or try a different link.')
+        log_message(f"Playlist listed: {count} entries")
+    finally:
+        # The client may stop reading half-way through a channel
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def playlist_entry(entry, position):
+    """The fields of a flat playlist entry the UI and /download/playlist use."""
+    url = entry.get('webpage_url') or entry.get('url') or ''
+    if url and not url.startswith(('http://', 'https://')) and entry.get('ie_key') == 'Youtube':
+        url = f"https://www.youtube.com/watch?v={url}"
+    thumbnails = entry.get('thumbnails') or []
+    thumbnail = entry.get('thumbnail') or (thumbnails[-1].get('url') if thumbnails else None)
+    duration = entry.get('duration')
+    return {
+        'index':     entry.get('playlist_index') or position,
+        'id':        entry.get('id') or '',
+        'url':       url,
+        'title':     entry.get('title') or entry.get('id') or url,
+        'duration':  format_eta(duration) if duration else '',
+        'uploader':  entry.get('uploader') or entry.get('channel') or '',
+        'thumbnail': thumbnail,
+        'thumb':     thumb_path(thumbnail),
+        'playlist':  entry.get('playlist_title') or entry.get('playlist') or '',
+        'count':     entry.get('playlist_count'),
+    }
+
+
 def parse_formats_from_info(info):
     """
     Parse yt-dlp JSON info dict and return organised format lists:
@@ -144,9 +1656,954 @@ def parse_formats_from_info(info):
     return video_formats, audio_formats
 
 
-def download_m3u8_advanced(url, output_path, quality='best'):
-    """Advanced m3u8 downloader using yt-dlp to get stream URL then ffmpeg."""
+# Codec families each container can hold; a pair that doesn't fit the one
+# asked for is merged into MKV, which holds them all
+CONTAINER_CODECS = {
+    'mp4':  {'video': ('avc1', 'hevc', 'av01'), 'audio': ('mp4a', 'mp3')},
+    'webm': {'video': ('vp8', 'vp9', 'av01'),   'audio': ('opus', 'vorbis')},
+}
+
+_CODEC_ALIASES = {
+    'avc': 'avc1', 'avc3': 'avc1', 'h264': 'avc1',
+    'hev1': 'hevc', 'hvc1': 'hevc', 'h265': 'hevc',
+    'vp09': 'vp9', 'vp8.0': 'vp8', 'aac': 'mp4a',
+}
+
+
+def codec_family(codec):
+    """'avc1.640028' -> 'avc1', 'vp09.00.40.08' -> 'vp9'; None for 'none' or unknown."""
+    codec = (codec or '').lower()
+    if not codec or codec == 'none':
+        return None
+    name = codec.split('.', 1)[0]
+    return _CODEC_ALIASES.get(name, name)
+
+
+class FormatPolicy:
+    """
+    Picks the exact formats to download from an extracted info dict, so
+    yt-dlp gets "137+140" instead of a fallback chain it has to evaluate
+    again. Only pairs the output container can hold are considered; when
+    the video has none, the best pair is merged into MKV instead. They are
+    ranked by height (never above the one asked for), then `codecs`
+    preference order, frame rate, direct HTTP over HLS, and bitrate.
+    `max_bitrate` (kbit/s) and `max_filesize` (bytes) cap the video+audio
+    pair; when nothing fits, the smallest pair is used.
+    """
+
+    def __init__(self, codecs=FORMAT_CODEC_ORDER, max_bitrate=0, max_filesize=0):
+        self.lock = threading.Lock()
+        self.configure(codecs, max_bitrate, max_filesize)
+
+    def configure(self, codecs, max_bitrate=0, max_filesize=0):
+        if isinstance(codecs, str):
+            codecs = codecs.split(',')
+        codecs = [codec_family(c.strip()) for c in codecs if c and c.strip()]
+        max_bitrate, max_filesize = int(max_bitrate or 0), int(max_filesize or 0)
+        if max_bitrate < 0 or max_filesize < 0:
+            raise ValueError('caps must not be negative')
+        with self.lock:
+            self.codecs = codecs
+            self.max_bitrate = max_bitrate
+            self.max_filesize = max_filesize
+
+    def settings(self):
+        with self.lock:
+            return {'codecs': list(self.codecs), 'max_bitrate': self.max_bitrate,
+                    'max_filesize': self.max_filesize}
+
+    def select(self, info, quality, container):
+        """
+        The formats to fetch for a UI quality value and container (mp4/webm):
+        {selector, video, audio, height, vcodec, acodec, filesize,
+        size_exact, bitrate, container}, or None when the info lists no
+        usable video format. `container` is what yt-dlp should merge into:
+        the one asked for, or 'mkv' when no pair fits it.
+        """
+        quality = str(quality or '')
+        if not (quality in ('', 'best', 'bestvideo+bestaudio/best') or quality.isdigit()
+                or quality.startswith(('id:', 'h:'))):
+            return None     # a raw yt-dlp format string, passed on as it is
+        with self.lock:
+            codecs, max_bitrate, max_filesize = self.codecs, self.max_bitrate, self.max_filesize
+        allowed = CONTAINER_CODECS.get(container, {'video': (), 'audio': ()})
+        duration = info.get('duration') or 0
+        formats = [f for f in info.get('formats') or [] if f.get('format_id')]
+
+        videos = [f for f in formats if codec_family(f.get('vcodec')) and f.get('height')]
+        audios = [f for f in formats if codec_family(f.get('acodec')) and not codec_family(f.get('vcodec'))]
+        if not videos:
+            return None
+
+        if quality.startswith('id:'):
+            wanted = quality.split(':')[1]
+            chosen = [f for f in videos if f['format_id'] == wanted]
+            if chosen:
+                videos = chosen     # the user picked this exact stream
+        height = _quality_height(quality)
+        if height and len(videos) > 1:
+            videos = [f for f in videos if f['height'] <= height] or [min(videos, key=lambda f: f['height'])]
+
+        def video_rank(f):
+            family = codec_family(f.get('vcodec'))
+            return (
+                f['height'],
+                -(codecs.index(family) if family in codecs else len(codecs)),
+                f.get('fps') or 0,
+                not str(f.get('protocol') or '').startswith('m3u8'),
+                f.get('tbr') or 0,
+            )
+
+        def audio_rank(f):
+            return (codec_family(f.get('acodec')) in allowed['audio'], f.get('abr') or f.get('tbr') or 0)
+
+        videos.sort(key=video_rank, reverse=True)
+        audios.sort(key=audio_rank, reverse=True)
+
+        pairs = []
+        for video in videos:
+            if codec_family(video.get('acodec')):
+                pairs.append((video, None))     # muxed: carries its own audio
+            else:
+                pairs.extend((video, audio) for audio in audios or [None])
+
+        def holds(pair):
+            video, audio = pair
+            return (codec_family(video.get('vcodec')) in allowed['video'] and
+                    codec_family((audio or video).get('acodec')) in allowed['audio'] + (None,))
+
+        # WebM can't take H.264 and MP4 has no Opus: a 720p pair the
+        # container can't hold would only fail at the merge
+        merge_container = container
+        fitting = [p for p in pairs if holds(p)]
+        if fitting:
+            pairs = fitting
+        else:
+            merge_container = 'mkv'
+            log_message(f"Format selection: no {container} streams; merging into mkv")
+
+        def totals(pair):
+            parts = [f for f in pair if f]
+            sizes = [_format_size(f, duration) for f in parts]
+            bitrate = sum(f.get('tbr') or f.get('abr') or 0 for f in parts)
+            return sum(s for s, _ in sizes), all(exact for _, exact in sizes), bitrate
+
+        def fits(pair):
+            size, _, bitrate = totals(pair)
+            return ((not max_bitrate or not bitrate or bitrate <= max_bitrate) and
+                    (not max_filesize or not size or size <= max_filesize))
+
+        pair = next((p for p in pairs if fits(p)), None)
+        if pair is None:
+            pair = min(pairs, key=lambda p: totals(p)[::2])
+            log_message("Format selection: nothing within the size/bitrate caps; using the smallest pair")
+        video, audio = pair
+        size, exact, bitrate = totals(pair)
+        vfamily = codec_family(video.get('vcodec'))
+        afamily = codec_family((audio or video).get('acodec'))
+        return {
+            'selector': f"{video['format_id']}+{audio['format_id']}" if audio else video['format_id'],
+            'video': video['format_id'],
+            'audio': audio['format_id'] if audio else None,
+            'height': video['height'],
+            'vcodec': vfamily,
+            'acodec': afamily,
+            'filesize': int(size),
+            'size_exact': exact,
+            'bitrate': round(bitrate),
+            'container': merge_container,
+        }
+
+
+def _format_size(f, duration):
+    """(bytes, exact) of one format: its filesize, else an estimate from bitrate x duration."""
+    if f.get('filesize'):
+        return f['filesize'], True
+    if f.get('filesize_approx'):
+        return f['filesize_approx'], False
+    rate = f.get('tbr') or f.get('abr') or 0
+    return int(rate * 1000 / 8 * duration), False
+
+
+def load_format_policy():
+    policy = FormatPolicy(FORMAT_CODEC_ORDER, FORMAT_MAX_BITRATE, FORMAT_MAX_FILESIZE)
+    if os.path.exists(FORMAT_POLICY_FILE):
+        try:
+            with open(FORMAT_POLICY_FILE, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            policy.configure(saved.get('codecs', FORMAT_CODEC_ORDER),
+                             saved.get('max_bitrate', 0), saved.get('max_filesize', 0))
+        except (OSError, ValueError, TypeError, AttributeError):
+            pass
+    return policy
+
+format_policy = load_format_policy()
+
+
+def estimate_disk_need(info, fmt, quality, mode):
+    """
+    Peak bytes a download takes on disk, or 0 when the sizes are unknown:
+    the fetched streams plus the merged, remuxed or converted output,
+    which exist side by side until the parts are deleted.
+    """
+    duration = info.get('duration') or 0
+    if fmt == 'mp3' and mode != 'advanced':
+        audios = [f for f in info.get('formats') or []
+                  if codec_family(f.get('acodec')) and not codec_family(f.get('vcodec'))]
+        if not audios:
+            return 0
+        best = max(audios, key=lambda f: f.get('abr') or f.get('tbr') or 0)
+        size = _format_size(best, duration)[0]
+        return size + int(duration * MP3_BYTES_PER_SECOND) if size else 0
+    plan = format_policy.select(info, quality, 'mp4' if mode == 'advanced' or fmt == 'mp4' else 'webm')
+    if not plan or not plan['filesize']:
+        return 0
+    # A single muxed stream is written in place; anything else is merged
+    merged = mode == 'advanced' or plan['audio'] is not None
+    return plan['filesize'] * (2 if merged else 1)
+
+
+def _device(path):
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+class DiskSpace:
+    """
+    Free space promised to running downloads. A job claims its estimated
+    peak need when it starts; the part it has not downloaded yet keeps
+    counting against the free space later jobs on the same disk see.
+    """
+
+    def __init__(self, reserve=DISK_RESERVE):
+        self.reserve = reserve
+        self.lock = threading.Lock()
+        self.claims = {}        # job id -> (device, bytes, job)
+
+    def outstanding(self, folder, exclude=None):
+        """Bytes the running jobs writing to `folder`'s disk are still expected to need."""
+        with self.lock:
+            return self._outstanding(_device(folder), exclude)
+
+    def _outstanding(self, device, exclude):
+        return sum(max(0, need - job.metered_total) for dev, need, job in self.claims.values()
+                   if dev == device and job is not exclude)
+
+    def check(self, folder, need, pending=0):
+        """None if `need` bytes fit next to `pending` others, else what is missing."""
+        try:
+            free = shutil.disk_usage(folder).free
+        except OSError:
+            return None     # folder not there yet: nothing to measure
+        if need + pending + self.reserve <= free:
+            return None
+        return (
+            f"Not enough disk space: needs ~{format_filesize(need) or '0B'}"
+            + (f" (+{format_filesize(pending)} for other downloads)" if pending else "")
+            + f", {format_filesize(free) or '0B'} free"
+            + (f" and {format_filesize(self.reserve)} kept spare" if self.reserve else "")
+        )
+
+    def claim(self, job, folder, need):
+        """Record `need` bytes for `job` until release(); returns check()'s verdict."""
+        device = _device(folder)
+        with self.lock:     # one claim at a time, so two jobs can't both count on the same space
+            problem = self.check(folder, need, self._outstanding(device, job))
+            self.claims[job.id] = (device, need, job)
+        return problem
+
+    def release(self, job):
+        with self.lock:
+            self.claims.pop(job.id, None)
+
+disk_space = DiskSpace()
+
+
+def preallocate(f, size):
+    """
+    Reserve `size` bytes for the open file `f` in one go, so a long download
+    is laid out contiguously instead of growing a segment at a time. The
+    caller truncates to the real length when done. Returns False where the
+    platform has no way to do it.
+    """
+    try:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(f.fileno(), 0, size)
+        elif os.name == 'nt':
+            f.truncate(size)    # NTFS allocates the clusters, unlike a sparse extend
+        else:
+            return False
+    except OSError:
+        return False
+    return True
+
+
+def parse_m3u8_duration(text):
+    """Sum the #EXTINF segment durations of a media playlist (seconds)."""
+    total = 0.0
+    for line in text.splitlines():
+        if line.startswith('#EXTINF:'):
+            try:
+                total += float(line[8:].split(',', 1)[0])
+            except ValueError:
+                pass
+    return total
+
+
+def hls_playlist_duration(m3u8_url, headers_str=''):
+    """
+    Fetch an HLS playlist and return its total duration in seconds, following
+    the first variant of a master playlist. Returns None when unknown.
+    """
+    headers = dict(
+        h.split(': ', 1) for h in headers_str.split('\r\n') if ': ' in h
+    )
+    try:
+        resp = http_session.get(m3u8_url, headers=headers, timeout=10)
+        resp.raise_for_status()
+        text = resp.text
+        if '#EXT-X-STREAM-INF' in text:
+            variant = None
+            lines = text.splitlines()
+            for i, line in enumerate(lines):
+                if line.startswith('#EXT-X-STREAM-INF'):
+                    variant = next((l.strip() for l in lines[i + 1:] if l.strip() and not l.startswith('#')), None)
+                    break
+            if not variant:
+                return None
+            resp = http_session.get(urljoin(resp.url, variant), headers=headers, timeout=10)
+            resp.raise_for_status()
+            text = resp.text
+        return parse_m3u8_duration(text) or None
+    except Exception as e:
+        log_message(f"Could not read playlist duration: {str(e)}")
+        return None
+
+
+class YtdlpProgressParser:
+    """
+    Turns yt-dlp output into job progress fields.
+
+    yt-dlp is run with --progress-template so every progress line is
+    "[avd] <format_id> <vcodec> <acodec> <status> <downloaded_bytes>
+    <total_bytes> <total_bytes_estimate> <speed> <eta> <fragment_index>
+    <fragment_count>" (space separated, "NA" when unknown), which gives
+    exact byte counts, tells us which stream is downloading, and splits
+    without any regex. Post-processor hooks arrive as
+    "[avd-pp] <status> <postprocessor>".
+
+    The unified bar maps phases as: video 0–75%, audio 75–92%, merge 93%+.
+    A single muxed or audio-only stream maps to 0–92%.
+    """
+
+    PREFIX = '[avd] '
+    PP_PREFIX = '[avd-pp] '
+    DOWNLOAD_TEMPLATE = PREFIX + ' '.join([
+        '%(info.format_id)s', '%(info.vcodec)s', '%(info.acodec)s',
+        '%(progress.status)s', '%(progress.downloaded_bytes)s',
+        '%(progress.total_bytes)s', '%(progress.total_bytes_estimate)s',
+        '%(progress.speed)s', '%(progress.eta)s',
+        '%(progress.fragment_index)s', '%(progress.fragment_count)s',
+    ])
+    POSTPROCESS_TEMPLATE = PP_PREFIX + '%(progress.status)s %(progress.postprocessor)s'
+
+    def __init__(self):
+        self.seen_video = False
+        self.last = [None] * 11     # previous line's tokens
+        self.phase = ('video', 0, 75)
+        self.total = None
+
+    def feed(self, line):
+        """Return a dict of changed progress fields for `line`, or None."""
+        if line.startswith(self.PREFIX):
+            return self._download(line[len(self.PREFIX):])
+        if line.startswith(self.PP_PREFIX):
+            return self._postprocess(line[len(self.PP_PREFIX):])
+        return None
+
+    @staticmethod
+    def _number(value):
+        if value == 'NA':
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+    def _download(self, rest):
+        parts = rest.split(' ')
+        if len(parts) != 11:
+            return None
+        last, self.last = self.last, parts
+        fields = {}
+
+        # A new stream: work out which part of the unified bar it owns
+        if parts[1] != last[1] or parts[2] != last[2]:
+            last = [None] * 11
+            # "NA" means yt-dlp doesn't know; only an explicit "none" rules a track out
+            has_video = parts[1] != 'none'
+            has_audio = parts[2] != 'none'
+            if has_video:
+                self.seen_video = True
+                self.phase = ('video', 0, 92 if has_audio else 75)
+            elif self.seen_video:
+                self.phase = ('audio', 75, 17)
+            else:
+                self.phase = ('audio', 0, 92)
+            fields['stage'] = self.phase[0]
+
+        # Only tokens that changed since the previous line are converted;
+        # an "NA" byte count keeps the last known value rather than reading as 0
+        done = self._number(parts[4])
+        done = int(done) if done is not None else None
+        if parts[4] != last[4] and done is not None:
+            fields['downloaded_bytes'] = done
+            fields['downloaded'] = format_filesize(done) or '0B'
+        if parts[5] != last[5] or parts[6] != last[6]:
+            self.total = int(self._number(parts[5]) or self._number(parts[6]) or 0) or None
+            fields['total_bytes'] = self.total
+            fields['total'] = format_filesize(self.total) or 'Unknown'
+        if parts[7] != last[7]:
+            speed = self._number(parts[7])
+            fields['speed_bps'] = speed
+            fields['speed'] = format_speed(speed) or '—'
+        if parts[8] != last[8]:
+            eta = self._number(parts[8])
+            fields['eta_s'] = int(eta) if eta is not None else None
+            fields['eta'] = format_eta(eta)
+        if parts[9] != last[9] or parts[10] != last[10]:
+            frag_index, frag_count = self._number(parts[9]), self._number(parts[10])
+            fields['fragment_index'] = int(frag_index) if frag_index else None
+            fields['fragment_count'] = int(frag_count) if frag_count else None
+
+        if parts[3] == 'finished':
+            fraction = 1.0
+        elif self.total and done is not None:
+            fraction = min(1.0, done / self.total)
+        elif parts[9] != 'NA' and parts[10] not in ('NA', '0'):
+            fraction = min(1.0, float(parts[9]) / float(parts[10]))
+        else:
+            fraction = None
+        if fraction is not None:
+            _stage, low, span = self.phase
+            fields['percent'] = int(low + fraction * span)
+        return fields
+
+    def _postprocess(self, rest):
+        status, _, name = rest.partition(' ')
+        if status != 'started':
+            return None
+        if name in ('Merger', 'FFmpegMerger'):
+            return {'stage': 'merging', 'percent': 93, 'speed': '—', 'eta': '—'}
+        return {'stage': 'processing', 'percent': 96, 'speed': '—', 'eta': '—'}
+
+
+class FfmpegProgressParser:
+    """
+    Turns ffmpeg `-progress pipe:1` output into job progress fields.
+
+    ffmpeg writes blocks of key=value lines (out_time_us, total_size,
+    bitrate, speed, ...) each closed by a `progress=continue|end` line; one
+    dict of fields is produced per block. The percentage uses the media
+    duration from ffmpeg's "Duration:" line or, failing that, the playlist.
+    """
+
+    def __init__(self, duration=None):
+        self.duration = duration        # seconds, None if unknown
+        self.block = {}
+        self.started = time.monotonic()
+
+    def feed_duration_line(self, line):
+        match = re.search(r'Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)', line)
+        if match:
+            h, m, sec = match.groups()
+            self.duration = int(h) * 3600 + int(m) * 60 + float(sec)
+
+    def feed(self, line):
+        key, sep, value = line.partition('=')
+        if not sep:
+            return None
+        if key != 'progress':
+            self.block[key] = value
+            return None
+        block, self.block = self.block, {}
+        return self._fields(block, finished=(value == 'end'))
+
+    @staticmethod
+    def _number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None     # "N/A"
+
+    def _fields(self, block, finished):
+        # "N/A" values (common in the final block) are left out so they
+        # don't overwrite the last real reading with zero
+        out_us = self._number(block.get('out_time_us') or block.get('out_time_ms'))
+        out_time = max(0.0, out_us / 1e6) if out_us is not None else None
+        size = self._number(block.get('total_size'))
+        bitrate = self._number(block.get('bitrate', '').replace('kbits/s', ''))
+        encode_speed = self._number(block.get('speed', '').rstrip('x'))
+
+        fields = {'duration_s': self.duration}
+        if out_time is not None:
+            fields['out_time_s'] = out_time
+        if bitrate is not None:
+            fields['bitrate_kbps'] = bitrate
+        if encode_speed is not None:
+            fields['encode_speed'] = encode_speed
+        if size is not None:
+            size = int(size)
+            elapsed = time.monotonic() - self.started
+            throughput = size / elapsed if elapsed > 0 else None
+            fields.update({
+                'downloaded_bytes': size,
+                'downloaded': format_filesize(size) or '0B',
+                'speed_bps': throughput,
+                'speed': format_speed(throughput) or '—',
+            })
+
+        if self.duration and out_time is not None:
+            fraction = min(1.0, out_time / self.duration)
+            fields['percent'] = 100 if finished else min(99, int(fraction * 100))
+            if out_time > 0 and size is not None:
+                estimate = size * self.duration / out_time
+                fields['total_bytes'] = int(estimate)
+                fields['total'] = f"~{format_filesize(estimate)}"
+            if encode_speed:
+                eta = (self.duration - out_time) / encode_speed
+                fields['eta_s'] = int(eta)
+                fields['eta'] = format_eta(eta)
+        elif out_time is not None:
+            fields['total'] = f"{format_eta(out_time)} so far"
+        return fields
+
+
+class HlsUnsupported(Exception):
+    """The stream needs something the native HLS downloader can't do; use ffmpeg."""
+
+
+class HlsSegmentError(Exception):
+    """A segment could not be fetched after all retries."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+_HLS_ATTR = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+def _hls_attributes(line):
+    return {k: v.strip('"') for k, v in _HLS_ATTR.findall(line.split(':', 1)[1])}
+
+def parse_hls_playlist(text, base_url):
+    """
+    Parse an m3u8 playlist. Returns a dict with:
+      variants  - master playlist entries [{url, bandwidth, height, audio, codecs}]
+      audio     - master playlist audio renditions {group_id: url}
+      segments  - media playlist entries [{url, duration, key, byterange}]
+      init      - EXT-X-MAP initialisation section {url, byterange} or None
+      endlist   - False for live playlists
+    """
+    result = {'variants': [], 'audio': {}, 'segments': [], 'init': None, 'endlist': False}
+    lines = [l.strip() for l in text.splitlines()]
+    if not lines or lines[0] != '#EXTM3U':
+        raise HlsUnsupported('not an HLS playlist')
+
+    sequence = 0
+    key = None
+    duration = None
+    byterange = None
+    next_offset = 0
+    pending_variant = None
+
+    for line in lines[1:]:
+        if not line:
+            continue
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-STREAM-INF:'):
+            attrs = _hls_attributes(line)
+            res = attrs.get('RESOLUTION', '')
+            pending_variant = {
+                'bandwidth': int(attrs.get('BANDWIDTH', 0) or 0),
+                'height': int(res.split('x')[1]) if 'x' in res else None,
+                'audio': attrs.get('AUDIO'),
+                'codecs': attrs.get('CODECS'),
+            }
+        elif line.startswith('#EXT-X-MEDIA:'):
+            attrs = _hls_attributes(line)
+            if attrs.get('TYPE') == 'AUDIO' and attrs.get('URI'):
+                group = attrs.get('GROUP-ID')
+                if group not in result['audio'] or attrs.get('DEFAULT') == 'YES':
+                    result['audio'][group] = urljoin(base_url, attrs['URI'])
+        elif line.startswith('#EXT-X-KEY:'):
+            attrs = _hls_attributes(line)
+            method = attrs.get('METHOD', 'NONE')
+            if method == 'NONE':
+                key = None
+            elif method == 'AES-128' and Cipher is not None:
+                key = {'url': urljoin(base_url, attrs['URI']), 'iv': attrs.get('IV')}
+            else:
+                raise HlsUnsupported(f'{method} encryption')
+        elif line.startswith('#EXT-X-MAP:'):
+            attrs = _hls_attributes(line)
+            init_range = None
+            if 'BYTERANGE' in attrs:
+                length, _, offset = attrs['BYTERANGE'].partition('@')
+                init_range = (int(length), int(offset or 0))
+            result['init'] = {'url': urljoin(base_url, attrs['URI']), 'byterange': init_range}
+        elif line.startswith('#EXTINF:'):
+            duration = float(line[8:].split(',', 1)[0] or 0)
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            length, _, offset = line.split(':', 1)[1].partition('@')
+            byterange = (int(length), int(offset) if offset else next_offset)
+            next_offset = byterange[0] + byterange[1]
+        elif line.startswith('#EXT-X-ENDLIST'):
+            result['endlist'] = True
+        elif not line.startswith('#'):
+            url = urljoin(base_url, line)
+            if pending_variant is not None:
+                result['variants'].append(dict(pending_variant, url=url))
+                pending_variant = None
+            else:
+                seg_key = None
+                if key:
+                    # Without an explicit IV the media sequence number is the IV
+                    iv = key['iv']
+                    iv = bytes.fromhex(iv[2:]) if iv else sequence.to_bytes(16, 'big')
+                    seg_key = (key['url'], iv)
+                result['segments'].append({
+                    'url': url, 'duration': duration or 0.0,
+                    'key': seg_key, 'byterange': byterange,
+                })
+                sequence += 1
+                duration = None
+                byterange = None
+    return result
+
+
+class HlsDownloader:
+    """
+    Downloads HLS media playlists segment by segment over a pooled
+    requests.Session, `concurrency` segments at a time, writing them to
+    the output file strictly in playlist order.
+    """
+
+    def __init__(self, session, headers=None, concurrency=HLS_CONCURRENCY, on_progress=None,
+                 limiter=None, cancel=None):
+        self.session = session
+        self.headers = headers or {}
+        self.limiter = limiter
+        self.cancel = cancel            # threading.Event that stops download() when set
+        self.concurrency = max(1, concurrency)
+        self.on_progress = on_progress
+        self.keys = {}
+        self.keys_lock = threading.Lock()
+        self.total_segments = 0
+        self.done_segments = 0
+        self.bytes_done = 0
+        self.resumed_bytes = 0          # already on disk from an earlier run
+        self.codecs = None              # CODECS of the chosen variant, if the master lists it
+        self.height = None              # and its height
+        self.started = time.monotonic()
+
+    def _get(self, url, byterange=None, stream=False):
+        headers = dict(self.headers)
+        if byterange:
+            length, offset = byterange
+            headers['Range'] = f'bytes={offset}-{offset + length - 1}'
+        resp = self.session.get(url, headers=headers, timeout=HLS_SEGMENT_TIMEOUT, stream=stream)
+        if resp.status_code >= 400:
+            resp.close()
+            raise HlsSegmentError(f'HTTP {resp.status_code} for {url}', resp.status_code)
+        return resp
+
+    def _body(self, resp):
+        if self.limiter is None:
+            return resp.content
+        chunks = []
+        for chunk in resp.iter_content(BANDWIDTH_CHUNK):
+            self.limiter.throttle(len(chunk), self.cancel)
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def load(self, url, max_height=None):
+        """
+        Fetch `url` and return [(name, media_playlist)] to download: the video
+        (or muxed) playlist, plus a separate audio rendition if the chosen
+        variant has one.
+        """
+        resp = self._get(url)
+        playlist = parse_hls_playlist(resp.text, resp.url)
+        if not playlist['variants']:
+            media = [('video', playlist)]
+        else:
+            variants = playlist['variants']
+            if max_height:
+                fitting = [v for v in variants if v['height'] and v['height'] <= max_height]
+                variants = fitting or variants
+            variant = max(variants, key=lambda v: ((v['height'] or 0), v['bandwidth']))
+            self.codecs, self.height = variant['codecs'], variant['height']
+            resp = self._get(variant['url'])
+            media = [('video', parse_hls_playlist(resp.text, resp.url))]
+            audio_url = playlist['audio'].get(variant['audio'])
+            if audio_url:
+                resp = self._get(audio_url)
+                media.append(('audio', parse_hls_playlist(resp.text, resp.url)))
+
+        for _name, p in media:
+            if not p['endlist']:
+                raise HlsUnsupported('live playlist')
+            if not p['segments']:
+                raise HlsUnsupported('empty playlist')
+        self.total_segments = sum(len(p['segments']) for _name, p in media)
+        return media
+
+    def _key(self, key_url):
+        with self.keys_lock:
+            if key_url not in self.keys:
+                self.keys[key_url] = self._get(key_url).content
+            return self.keys[key_url]
+
+    def _fetch_segment(self, segment):
+        for attempt in range(HLS_SEGMENT_RETRIES):
+            try:
+                data = self._body(self._get(segment['url'], segment['byterange'], stream=True))
+                break
+            except (requests.RequestException, HlsSegmentError) as e:
+                metrics.inc('avd_hls_segment_retries_total', host=host_key(segment['url']),
+                            status=str(getattr(e, 'status', None) or 'network'))
+                if attempt == HLS_SEGMENT_RETRIES - 1:
+                    if isinstance(e, HlsSegmentError):
+                        raise
+                    raise HlsSegmentError(str(e))
+                time.sleep(0.5 * (attempt + 1))
+        if segment['key']:
+            key_url, iv = segment['key']
+            decryptor = Cipher(algorithms.AES(self._key(key_url)), modes.CBC(iv)).decryptor()
+            data = decryptor.update(data) + decryptor.finalize()
+            data = data[:-data[-1]] if data and 1 <= data[-1] <= 16 else data   # PKCS#7
+        return data
+
+    def download(self, playlist, out_path, start_index=0, start_offset=0, checkpoint=None):
+        """
+        Fetch the segments of a media playlist into `out_path`. To resume,
+        pass the number of segments already written and the file size they
+        ended at; `checkpoint(segments, offset)` is called after each
+        segment reaches the file. When the playlist gives the stream's
+        size, the file is preallocated to it first.
+        """
+        segments = playlist['segments']
+        window = self.concurrency * 2       # segments held in memory at most
+        resuming = start_index > 0 and os.path.exists(out_path)
+        if not resuming:
+            start_index, start_offset = 0, 0
+        self.done_segments += start_index
+        self.bytes_done += start_offset
+        self.resumed_bytes += start_offset
+
+        # Not a `with` block: on cancel the pool is abandoned rather than
+        # waited for, so the caller gets its thread back at once
+        pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix='hls')
+        with open(out_path, 'r+b' if resuming else 'wb') as out:
+            if resuming:
+                out.truncate(start_offset)      # drop a half-written segment
+                out.seek(start_offset)
+            size = hls_playlist_size(playlist)
+            if size and size > start_offset:
+                preallocate(out, size)
+            if playlist['init'] and not resuming:
+                out.write(self._get(playlist['init']['url'], playlist['init']['byterange']).content)
+            futures = {}
+            next_submit = start_index
+            try:
+                for index in range(start_index, len(segments)):
+                    while next_submit < len(segments) and next_submit - index < window:
+                        futures[next_submit] = pool.submit(self._fetch_segment, segments[next_submit])
+                        next_submit += 1
+                    data = self._result(futures.pop(index))
+                    out.write(data)
+                    self.done_segments += 1
+                    self.bytes_done += len(data)
+                    if checkpoint:
+                        out.flush()
+                        checkpoint(index + 1, out.tell())
+                    if self.on_progress:
+                        self.on_progress(self)
+                out.truncate()      # decryption padding etc. leave the estimate a little long
+            finally:
+                for future in futures.values():
+                    future.cancel()
+                pool.shutdown(wait=not self.cancelled)
+
+    @property
+    def cancelled(self):
+        return self.cancel is not None and self.cancel.is_set()
+
+    def _result(self, future):
+        """Wait for a segment, giving up as soon as the download is cancelled."""
+        while True:
+            if self.cancelled:
+                raise DownloadCancelled()
+            try:
+                return future.result(timeout=0.5)
+            except FutureTimeout:
+                pass
+
+
+def hls_playlist_size(playlist):
+    """Bytes a media playlist adds up to when every part has a byte range, else None."""
+    parts = playlist['segments'] + ([playlist['init']] if playlist['init'] else [])
+    if not parts or not all(p.get('byterange') for p in parts):
+        return None
+    return sum(p['byterange'][0] for p in parts)
+
+
+def hls_audio_is_aac(codecs):
+    """
+    True/False when a CODECS attribute ("avc1.64001f,mp4a.40.2") says whether
+    the audio is AAC, None when it lists no audio or is missing. mp4a.40.* is
+    AAC; mp4a.69/6B are MP3, and ac-3, ec-3 and opus need no ADTS filter.
+    """
+    audio = [c.strip().lower() for c in (codecs or '').split(',')
+             if c.strip().lower().startswith(('mp4a', 'ac-3', 'ec-3', 'opus', 'mp3', 'flac'))]
+    if not audio:
+        return None
+    return any(c.startswith('mp4a.40') for c in audio)
+
+
+def probe_stream(path, stream, entry):
+    """
+    One field of one stream of a media file as ffprobe reports it, e.g.
+    probe_stream(path, 'a:0', 'codec_name') -> "aac"; None if unknown.
+    """
+    try:
+        result = subprocess.run(
+            [find_tool('ffprobe'), '-v', 'error', '-select_streams', stream,
+             '-show_entries', f'stream={entry}', '-of', 'csv=p=0', path],
+            capture_output=True, text=True, timeout=30, creationflags=NO_WINDOW,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() or None
+
+
+def _quality_height(quality):
+    """Pixel height from a UI quality value ("720", "h:720", "id:136:720"), or None."""
+    quality = str(quality or '')
+    tail = quality.rsplit(':', 1)[-1]
+    return int(tail) if tail.isdigit() else None
+
+
+def download_hls_native(job, m3u8_url, headers, output_path, quality):
+    """
+    Download an HLS stream with HlsDownloader, then remux the fetched
+    stream(s) into `output_path` with a single ffmpeg -c copy pass.
+    Raises HlsUnsupported when the stream should be left to ffmpeg.
+    """
+    def report(d):
+        elapsed = time.monotonic() - d.started
+        speed = (d.bytes_done - d.resumed_bytes) / elapsed if elapsed > 0 else None
+        fraction = d.done_segments / d.total_segments
+        fields = {
+            'percent': int(fraction * 92),
+            'fragment_index': d.done_segments,
+            'fragment_count': d.total_segments,
+            'downloaded_bytes': d.bytes_done,
+            'downloaded': format_filesize(d.bytes_done) or '0B',
+            'speed_bps': speed,
+            'speed': format_speed(speed) or '—',
+        }
+        job.count_bytes(d.bytes_done - d.resumed_bytes)
+        if fraction > 0:
+            estimate = d.bytes_done / fraction
+            fields['total_bytes'] = int(estimate)
+            fields['total'] = f"~{format_filesize(estimate)}"
+            if speed:
+                fields['eta_s'] = int((estimate - d.bytes_done) / speed)
+                fields['eta'] = format_eta(fields['eta_s'])
+        job.update(**fields)
+
+    downloader = HlsDownloader(http_session, headers, HLS_CONCURRENCY, report, bandwidth,
+                               job.cancel_event)
+    media = downloader.load(m3u8_url, _quality_height(quality))
+    duration = sum(s['duration'] for s in media[0][1]['segments'])
+    log_message(
+        f"Native HLS: {downloader.total_segments} segments, {duration:.1f}s, "
+        f"{HLS_CONCURRENCY} parallel"
+    )
+    job.update(status="downloading", stage="video", percent=0, duration_s=duration)
+
+    # Keep the parts next to the output so the remux doesn't cross disks; the
+    # directory is named after the job so a restarted job finds its parts
+    work_dir = os.path.join(os.path.dirname(output_path) or '.', f'.avd-hls-{job.id}')
+    os.makedirs(work_dir, exist_ok=True)
+    done = job.resume.setdefault('hls', {})
+    try:
+        parts = []
+        for name, playlist in media:
+            part = os.path.join(work_dir, name + ('.mp4' if playlist['init'] else '.ts'))
+            prev = done.get(name)
+            start, offset = 0, 0
+            if prev and prev['count'] == len(playlist['segments']):
+                start, offset = prev['segments'], prev['offset']
+                log_message(f"Resuming {name} at segment {start}/{prev['count']}")
+
+            def checkpoint(segments, pos, name=name, count=len(playlist['segments'])):
+                done[name] = {'segments': segments, 'offset': pos, 'count': count}
+
+            with job.trace.span(f'hls {name}', segments=len(playlist['segments']) - start) as span, \
+                    bandwidth.streaming():
+                before = downloader.bytes_done - downloader.resumed_bytes
+                downloader.download(playlist, part, start, offset, checkpoint)
+                span['args']['bytes'] = downloader.bytes_done - downloader.resumed_bytes - before
+            parts.append(part)
+
+        job.update(stage="merging", percent=93, speed="—", eta="—")
+        cmd = [find_tool('ffmpeg'), '-nostdin', '-loglevel', 'error']
+        for part in parts:
+            cmd += ['-i', part]
+        for i in range(len(parts)):
+            cmd += ['-map', str(i)]
+        cmd += ['-c', 'copy']
+        # ADTS AAC from .ts segments needs converting for MP4; any other audio
+        # codec (AC-3, E-AC-3, MP3, Opus) would be broken by the filter
+        aac = hls_audio_is_aac(downloader.codecs)
+        if aac is None:
+            aac = probe_stream(parts[-1], 'a:0', 'codec_name') == 'aac'
+        if aac and any(part.endswith('.ts') for part in parts):
+            cmd += ['-bsf:a', 'aac_adtstoasc']
+        cmd += ['-y', output_path]
+        job.partials.add(output_path)
+        with job.trace.span('remux', inputs=len(parts)):
+            returncode, _, stderr = job.run_process(cmd)
+        if returncode != 0:
+            log_message(f"Remux failed: {stderr[-500:]}")
+            metrics.inc('avd_errors_total', host=job.host, cause='remux')
+            return False, f"FFmpeg remux failed (exit code {returncode})"
+        job.height = downloader.height
+        return True, "Success"
+    finally:
+        # A job cancelled with keep_partial leaves its parts for a later resume
+        if not (job.cancelled and job.keep_partial):
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def download_m3u8_advanced(job, url, output_path, quality='best', info=None):
+    """
+    Advanced m3u8 downloader: yt-dlp resolves the stream URL, then the
+    native parallel HLS downloader fetches it (falling back to ffmpeg for
+    live, non-HLS or unsupported streams).
+    When `info` (a cached yt-dlp info dict) is given, the stream URL is
+    resolved from it instead of extracting the page again.
+    """
     log_message("=== ADVANCED M3U8 DOWNLOAD MODE ===")
+    info_path, info_is_temp = None, False
     
     try:
         log_message("Step 1: Getting m3u8 playlist URL...")
@@ -156,46 +2613,85 @@ def download_m3u8_advanced(url, output_path, quality='best'):
         else:
             format_arg = f'bestvideo[height<={quality}]+bestaudio/best[height<={quality}]/best'
         
-        cmd = [
-            resource_path('yt-dlp.exe'),
-            '--get-url',
-            '-f', format_arg,
-            '--no-playlist',
-            '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            '--add-header', 'Accept:*/*',
-            '--add-header', 'Accept-Language:en-US,en;q=0.9',
-            '--no-check-certificate',
-            url
-        ]
-        
-        result = subprocess.run(
-            cmd, capture_output=True, text=True, check=False,
-            creationflags=subprocess.CREATE_NO_WINDOW
-        )
-        
-        if result.returncode != 0:
-            log_message(f"ERROR: Could not get m3u8 URL: {result.stderr}")
+        resolve_span = job.trace.begin('resolve stream url', selector=format_arg)
+        m3u8_url = None
+        try:
+            m3u8_url = extractor_pool.resolve_urls(url, format_arg, info, ticket=job)[0]
+        except ExtractorUnavailable:
+            pass    # no warm extractor: use a one-off yt-dlp process
+        except PreviewCancelled:
+            job.check_cancelled()
+            raise
+        except Exception as e:
+            log_message(f"ERROR: Could not get m3u8 URL: {str(e)}")
+            metrics.inc('avd_errors_total', host=job.host, cause='resolve_url')
             return False, "Failed to get video URL. Site may require login."
-        
-        m3u8_url = result.stdout.strip().splitlines()[0]
+
+        if m3u8_url is None:
+            cmd = [
+                find_tool('yt-dlp'),
+                '--get-url',
+                '-f', format_arg,
+                '--no-playlist',
+                '--user-agent', USER_AGENT,
+                '--add-header', 'Accept:*/*',
+                '--add-header', 'Accept-Language:en-US,en;q=0.9',
+                '--no-check-certificate',
+            ]
+            if info:
+                info_path, info_is_temp = info_cache.info_file(url, info)
+                cmd += ['--load-info-json', info_path]
+            else:
+                cmd.append(url)
+
+            returncode, stdout, stderr = job.run_process(cmd)
+
+            if returncode != 0:
+                log_message(f"ERROR: Could not get m3u8 URL: {stderr}")
+                metrics.inc('avd_errors_total', host=job.host, cause='resolve_url')
+                return False, "Failed to get video URL. Site may require login."
+
+            m3u8_url = stdout.strip().splitlines()[0]
+
+        job.trace.end(resolve_span)
         log_message(f"m3u8 URL obtained: {m3u8_url[:100]}...")
         
-        log_message("Step 2: Downloading with FFmpeg in advanced mode...")
-        
-        with download_lock:
-            download_progress["status"] = "downloading"
-            download_progress["percent"] = 0
-        
-        headers_str = 'User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
         if 'xhamster' in url.lower():
-            headers_str += '\r\nReferer: https://xhamster.com/'
+            headers['Referer'] = 'https://xhamster.com/'
         elif 'pornhub' in url.lower():
-            headers_str += '\r\nReferer: https://www.pornhub.com/'
+            headers['Referer'] = 'https://www.pornhub.com/'
         elif 'xvideos' in url.lower():
-            headers_str += '\r\nReferer: https://www.xvideos.com/'
+            headers['Referer'] = 'https://www.xvideos.com/'
+        headers_str = '\r\n'.join(f'{k}: {v}' for k, v in headers.items())
+
+        log_message("Step 2: Downloading segments in parallel...")
+        try:
+            return download_hls_native(job, m3u8_url, headers, output_path, quality)
+        except HlsUnsupported as e:
+            log_message(f"Native HLS download not possible ({e}); using FFmpeg")
+        except HlsSegmentError as e:
+            log_message(f"ERROR: {str(e)}")
+            if e.status in (403, 404, 410):
+                metrics.inc('avd_errors_total', host=job.host, cause='segments_expired')
+                return False, "Segments expired (404 errors). Try downloading immediately after getting the URL."
+            metrics.inc('avd_errors_total', host=job.host, cause='segment_failed')
+            return False, f"Segment download failed: {str(e)}"
+
+        log_message("Step 2: Downloading with FFmpeg in advanced mode...")
+        
+        job.update(status="downloading", stage="video", percent=0)
+
+        # HLS playlists often make ffmpeg print "Duration: N/A"; the summed
+        # segment durations still give us a percentage
+        parser = FfmpegProgressParser(hls_playlist_duration(m3u8_url, headers_str))
+        if parser.duration:
+            log_message(f"Playlist duration: {parser.duration:.1f}s")
         
         ffmpeg_cmd = [
-            resource_path('ffmpeg.exe'),
+            find_tool('ffmpeg'),
+            '-nostats',
+            '-progress', 'pipe:1',
             '-headers', headers_str,
             '-reconnect', '1',
             '-reconnect_streamed', '1',
@@ -207,56 +2703,668 @@ def download_m3u8_advanced(url, output_path, quality='best'):
             output_path
         ]
         
+        # Machine-readable progress arrives on stdout, the human log on stderr
+        job.partials.add(output_path)
         process = subprocess.Popen(
             ffmpeg_cmd,
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
-            creationflags=subprocess.CREATE_NO_WINDOW,
-            bufsize=1, universal_newlines=True
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+            creationflags=NO_WINDOW,
+            bufsize=1, universal_newlines=True, start_new_session=True
         )
+        job.attach(process)
+        spawned = time.monotonic()
+        ffmpeg_span = job.trace.begin('ffmpeg download')
         
-        total_duration = None
-        error_404_count = 0
-        
-        for line in iter(process.stdout.readline, ''):
-            line = line.strip()
-            if line:
+        expired = threading.Event()
+
+        def read_stderr():
+            _log_context.job_id = job.id
+            error_404_count = 0
+            first = True
+            for line in iter(process.stderr.readline, ''):
+                if first:
+                    metrics.observe('avd_process_first_output_seconds', time.monotonic() - spawned, tool='ffmpeg')
+                    first = False
+                line = line.strip()
+                if not line:
+                    continue
                 log_message(f"FFmpeg: {line}")
-            
-            if '404' in line or 'Not Found' in line:
-                error_404_count += 1
-                if error_404_count >= 3:
-                    process.kill()
-                    return False, "Segments expired (404 errors). Try downloading immediately after getting the URL."
-            
-            if 'Duration:' in line and total_duration is None:
-                dur_match = re.search(r'Duration: (\d{2}):(\d{2}):(\d{2})\.\d+', line)
-                if dur_match:
-                    h, m, s = map(int, dur_match.groups())
-                    total_duration = h * 3600 + m * 60 + s
-            
-            if 'time=' in line:
-                time_match = re.search(r'time=(\d{2}):(\d{2}):(\d{2})\.\d+', line)
-                if time_match:
-                    h, m, s = map(int, time_match.groups())
-                    current_time = h * 3600 + m * 60 + s
-                    if total_duration:
-                        percent = min(100, int((current_time / total_duration) * 100))
-                        with download_lock:
-                            download_progress["percent"] = percent
-                            download_progress["downloaded"] = f"{current_time}s"
-                            download_progress["total"] = f"{total_duration}s"
+
+                if '404' in line or 'Not Found' in line:
+                    error_404_count += 1
+                    if error_404_count >= 3 and not expired.is_set():
+                        expired.set()
+                        process.kill()
+
+                if 'Duration:' in line:
+                    parser.feed_duration_line(line)
+
+        stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+        stderr_thread.start()
+
+        for line in iter(process.stdout.readline, ''):
+            fields = parser.feed(line.strip())
+            if fields:
+                if 'downloaded_bytes' in fields:
+                    job.count_bytes(fields['downloaded_bytes'])
+                job.update(**fields)
         
         process.wait()
+        job.detach(process)
+        job.trace.end(ffmpeg_span, bytes=job.metered, exit_code=process.returncode)
+        stderr_thread.join(timeout=5)
+        job.check_cancelled()
+
+        if expired.is_set():
+            metrics.inc('avd_errors_total', host=job.host, cause='segments_expired')
+            return False, "Segments expired (404 errors). Try downloading immediately after getting the URL."
         
         if process.returncode == 0 and os.path.exists(output_path):
             return True, "Success"
         else:
+            metrics.inc('avd_errors_total', host=job.host, cause='ffmpeg')
             return False, f"FFmpeg failed (exit code {process.returncode})"
-            
+
+    except DownloadCancelled:
+        raise
     except Exception as e:
         log_message(f"EXCEPTION in advanced download: {str(e)}")
+        metrics.inc('avd_errors_total', host=job.host, cause='exception')
         return False, str(e)
 
+    finally:
+        if info_is_temp:
+            try:
+                os.remove(info_path)
+            except OSError:
+                pass
+
+
+class DownloadCancelled(Exception):
+    """Raised on a job's worker thread once the job has been cancelled."""
+
+
+def kill_process_tree(process):
+    """
+    Kill a child process and everything it started (yt-dlp runs ffmpeg for
+    merges). On POSIX the child must have been started in its own session.
+    """
+    try:
+        if os.name == 'nt':
+            if process.poll() is not None:
+                return
+            subprocess.run(
+                ['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                capture_output=True, check=False,
+                creationflags=NO_WINDOW
+            )
+        else:
+            # Even after the child itself exited, what it started may still
+            # be running in its process group (and holding its stdout open)
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    if process.poll() is None:
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+
+class JobTrace:
+    """
+    Timeline of one job as spans with wall-clock start/end times: its
+    stages (opened and closed by DownloadJob.update()), the steps within
+    them and each stream or post-processor yt-dlp runs. Byte counts and
+    other details go into a span's args.
+    """
+
+    LANES = {'stage': 1, 'step': 2, 'stream': 3}    # Chrome trace thread per category
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = []
+
+    def begin(self, name, cat='step', **args):
+        span = {'name': name, 'cat': cat, 'start': time.time(), 'end': None, 'args': args}
+        with self.lock:
+            if len(self.spans) < TRACE_MAX_SPANS:
+                self.spans.append(span)
+        return span
+
+    def end(self, span, **args):
+        if span is None:
+            return
+        with self.lock:
+            if span['end'] is None:
+                span['end'] = time.time()
+                span['args'].update(args)
+
+    @contextmanager
+    def span(self, name, cat='step', **args):
+        span = self.begin(name, cat, **args)
+        try:
+            yield span
+        except BaseException as e:
+            span['args']['error'] = type(e).__name__
+            raise
+        finally:
+            self.end(span)
+
+    def close(self, **args):
+        """End every span still open, e.g. when the job finishes."""
+        with self.lock:
+            now = time.time()
+            for span in self.spans:
+                if span['end'] is None:
+                    span['end'] = now
+                    span['args'].update(args)
+
+    def export(self):
+        with self.lock:
+            spans = [dict(span, args=dict(span['args'])) for span in self.spans]
+        for span in spans:
+            end = span['end'] if span['end'] is not None else time.time()
+            span['duration'] = round(end - span['start'], 6)
+        return spans
+
+    def chrome_events(self, pid=1, label=''):
+        """The spans as Chrome trace-event "complete" events (µs timestamps)."""
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': label}}]
+        for cat, tid in self.LANES.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': cat}})
+        for span in self.export():
+            events.append({
+                'name': span['name'], 'cat': span['cat'], 'ph': 'X',
+                'ts': int(span['start'] * 1e6), 'dur': int(span['duration'] * 1e6),
+                'pid': pid, 'tid': self.LANES.get(span['cat'], 2), 'args': span['args'],
+            })
+        return events
+
+
+class DownloadJob:
+    """A single queued download and its live progress."""
+
+    def __init__(self, url, fmt, quality, mode, folder, job_id=None, created=None, group=None,
+                 force=False):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.group = group          # playlist download this job belongs to
+        self.url = url
+        self.host = host_key(url)
+        self.force = force          # download even if the archive has this video
+        self.format = fmt
+        self.quality = quality
+        self.mode = mode
+        self.folder = folder
+        self.created = created or time.time()
+        self.output_path = ''
+        self.height = None          # video height delivered, kept in the download archive
+        self.resume = {}            # downloader state needed to continue after a restart
+        self.journal = None
+        self.saved_at = 0.0
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.version = 0
+        self.progress = dict(IDLE_PROGRESS, status="queued", stage="queued", mode=mode)
+        self.cancel_event = threading.Event()
+        self.keep_partial = False   # leave partial files behind when cancelled
+        self.processes = set()      # running child processes, killed on cancel
+        self.partials = set()       # files being written, removed on cancel
+        self.stage_started = time.monotonic()
+        self.download_time = 0.0    # seconds spent in the video/audio stages
+        self.metered = 0            # last byte count seen by count_bytes()
+        self.metered_total = 0
+        self.trace = JobTrace()
+        self.stage_span = self.trace.begin('queued', 'stage')
+        self.stage_bytes = 0
+
+    def update(self, **fields):
+        with self.lock:
+            if not any(self.progress.get(k) != v for k, v in fields.items()):
+                return
+            status_changed = 'status' in fields and fields['status'] != self.progress['status']
+            old_stage = self.progress['stage']
+            self.progress.update(fields)
+            self.version += 1
+            self.changed.notify_all()
+            now = time.monotonic()
+            save = self.journal is not None and (
+                status_changed or now - self.saved_at >= JOURNAL_SAVE_INTERVAL)
+            if save:
+                self.saved_at = now
+            finished = status_changed and self.progress['status'] in FINISHED_STATUSES
+            stage_time = None
+            new_stage = self.progress['stage'] != old_stage or finished
+            if new_stage:
+                if self.stage_started is not None:
+                    stage_time = now - self.stage_started
+                    if old_stage in ('video', 'audio'):
+                        self.download_time += stage_time
+                self.stage_started = None if finished else now
+        if save:
+            self.journal.save(self)
+        if stage_time is not None:
+            metrics.observe('avd_stage_seconds', stage_time, stage=old_stage, mode=self.mode)
+        if new_stage:
+            self.trace.end(self.stage_span, bytes=self.metered_total - self.stage_bytes)
+            self.stage_bytes = self.metered_total
+            if finished:
+                self.stage_span = None
+                self.trace.close(status=self.progress['status'])
+            else:
+                self.stage_span = self.trace.begin(self.progress['stage'], 'stage')
+        if finished:
+            self._finished_metrics()
+
+    def _finished_metrics(self):
+        status = self.progress['status']
+        metrics.inc('avd_jobs_finished_total', host=self.host, status=status)
+        if status == 'completed' and self.metered_total and self.download_time > 0:
+            metrics.observe('avd_download_throughput_bytes_per_second',
+                            self.metered_total / self.download_time, host=self.host)
+
+    def count_bytes(self, downloaded):
+        """
+        Feed the downloaded-bytes counter from a running total, which may
+        start again from 0 when the next stream begins.
+        """
+        delta = downloaded - self.metered if downloaded >= self.metered else downloaded
+        self.metered = downloaded
+        if delta > 0:
+            self.metered_total += delta
+            metrics.inc('avd_downloaded_bytes_total', delta, host=self.host)
+
+    def wait_for_change(self, version, timeout):
+        """Block until the progress moves past `version`; return (version, progress copy)."""
+        with self.lock:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.version, dict(self.progress)
+
+    @property
+    def finished(self):
+        with self.lock:
+            return self.progress["status"] in FINISHED_STATUSES
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self, keep_partial=False):
+        """Stop the job and kill its processes; False if it had already finished."""
+        with self.lock:
+            if self.progress["status"] in FINISHED_STATUSES or self.cancel_event.is_set():
+                return False
+            self.keep_partial = keep_partial
+            self.cancel_event.set()
+            processes = list(self.processes)
+        for process in processes:
+            kill_process_tree(process)
+        return True
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise DownloadCancelled()
+
+    def attach(self, process):
+        with self.lock:
+            self.processes.add(process)
+        # cancel() may have run just before the process was registered
+        if self.cancel_event.is_set():
+            kill_process_tree(process)
+
+    def detach(self, process):
+        with self.lock:
+            self.processes.discard(process)
+
+    def run_process(self, cmd):
+        """subprocess.run() for a short helper command, killed if the job is cancelled."""
+        process = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+            creationflags=NO_WINDOW, start_new_session=True
+        )
+        self.attach(process)
+        try:
+            stdout, stderr = process.communicate()
+        finally:
+            self.detach(process)
+        self.check_cancelled()
+        return process.returncode, stdout, stderr
+
+    def remove_partials(self):
+        """Delete what a cancelled job left behind: .part/fragment files and HLS parts."""
+        removed = []
+        for path in self.partials:
+            stem = os.path.splitext(path)[0]
+            candidates = [path, path + '.part', path + '.ytdl']
+            candidates += glob.glob(glob.escape(path) + '.part-Frag*')
+            candidates += glob.glob(glob.escape(stem) + '.temp.*')
+            for candidate in candidates:
+                try:
+                    os.remove(candidate)
+                    removed.append(candidate)
+                except OSError:
+                    pass
+        folders = {os.path.dirname(p) or '.' for p in self.partials | {self.output_path} if p}
+        for folder in folders | {self.folder}:
+            work_dir = os.path.join(folder, f'.avd-hls-{self.id}')
+            if os.path.isdir(work_dir):
+                shutil.rmtree(work_dir, ignore_errors=True)
+                removed.append(work_dir)
+        self.resume.pop('hls', None)
+        return removed
+
+    def snapshot(self):
+        with self.lock:
+            data = dict(self.progress)
+        data.update({
+            'id': self.id,
+            'url': self.url,
+            'format': self.format,
+            'quality': self.quality,
+            'folder': self.folder,
+            'host': self.host,
+            'group': self.group,
+            'created': self.created,
+        })
+        return data
+
+
+class JobJournal:
+    """SQLite record of every job, so unfinished downloads survive a restart."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id              TEXT PRIMARY KEY,
+                    url             TEXT NOT NULL,
+                    format          TEXT,
+                    quality         TEXT,
+                    mode            TEXT,
+                    folder          TEXT,
+                    output_path     TEXT,
+                    status          TEXT,
+                    bytes_done      INTEGER,
+                    segments_done   INTEGER,
+                    segments_total  INTEGER,
+                    resume_state    TEXT,
+                    error           TEXT,
+                    created         REAL,
+                    updated         REAL
+                )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+
+    def save(self, job):
+        snap = job.snapshot()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                (job.id, job.url, job.format, job.quality, job.mode, job.folder,
+                 job.output_path, snap['status'], snap.get('downloaded_bytes') or 0,
+                 snap.get('fragment_index'), snap.get('fragment_count'),
+                 json.dumps(job.resume), snap.get('error') or '', job.created, time.time())
+            )
+
+    def unfinished(self):
+        finished = ','.join('?' * len(FINISHED_STATUSES))
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, url, format, quality, mode, folder, output_path, resume_state, created "
+                f"FROM jobs WHERE status NOT IN ({finished}) ORDER BY created",
+                FINISHED_STATUSES
+            ).fetchall()
+        return rows
+
+    def prune(self, keep):
+        finished = ','.join('?' * len(FINISHED_STATUSES))
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({finished}) AND id NOT IN ("
+                f"SELECT id FROM jobs WHERE status IN ({finished}) "
+                "ORDER BY updated DESC LIMIT ?)", FINISHED_STATUSES + FINISHED_STATUSES + (keep,)
+            )
+
+
+class HostScheduler:
+    """
+    Hands queued jobs to download workers while keeping every site within
+    its limits: at most `max_per_host` of its jobs running and no two of
+    them starting closer than `spacing` seconds apart. Sites with waiting
+    jobs take turns, so one long playlist cannot starve the other hosts.
+
+    poll() holds the whole policy and takes the current time from `clock`,
+    so it can be driven with fake jobs (anything with a `host`) and a
+    simulated clock; take() is the blocking wrapper the workers use.
+    """
+
+    def __init__(self, max_per_host, spacing, limits=None, clock=time.monotonic):
+        self.max_per_host = max(1, max_per_host)
+        self.spacing = spacing
+        self.limits = limits or {}
+        self.clock = clock
+        self.queues = OrderedDict()     # host -> waiting jobs, in turn order
+        self.running = {}               # host -> jobs started and not done
+        self.last_start = {}            # host -> clock() of its latest start
+        self.cond = threading.Condition()
+
+    def add(self, job):
+        with self.cond:
+            self.queues.setdefault(job.host, deque()).append(job)
+            self.cond.notify()
+
+    def poll(self):
+        """
+        Start the next job that is allowed to run. Returns (job, None), or
+        (None, wait) where wait is the number of seconds until a spacing
+        delay runs out, or None when only a finishing job can free a slot.
+        """
+        with self.cond:
+            now = self.clock()
+            wait = None
+            for host, jobs in self.queues.items():
+                max_running, spacing = self.limits.get(host, (self.max_per_host, self.spacing))
+                if self.running.get(host, 0) >= max_running:
+                    continue
+                ready_at = self.last_start.get(host, now - spacing) + spacing
+                if ready_at > now:
+                    wait = ready_at - now if wait is None else min(wait, ready_at - now)
+                    continue
+                job = jobs.popleft()
+                # The host has had its turn: to the back of the line
+                if jobs:
+                    self.queues.move_to_end(host)
+                else:
+                    del self.queues[host]
+                self.running[host] = self.running.get(host, 0) + 1
+                self.last_start[host] = now
+                return job, None
+            return None, wait
+
+    def take(self):
+        """Block until a job may start, then return it."""
+        with self.cond:
+            while True:
+                job, wait = self.poll()
+                if job is not None:
+                    return job
+                self.cond.wait(wait)
+
+    def remove(self, job):
+        """Withdraw a job that has not started yet; False if it already has."""
+        with self.cond:
+            jobs = self.queues.get(job.host)
+            if not jobs or job not in jobs:
+                return False
+            jobs.remove(job)
+            if not jobs:
+                del self.queues[job.host]
+            return True
+
+    def done(self, job):
+        with self.cond:
+            self.running[job.host] -= 1
+            if not self.running[job.host]:
+                del self.running[job.host]
+            self.cond.notify_all()
+
+    def waiting(self):
+        with self.cond:
+            return sum(len(jobs) for jobs in self.queues.values())
+
+    def running_by_host(self):
+        with self.cond:
+            return dict(self.running)
+
+
+class JobManager:
+    """Runs download jobs on a fixed pool of worker threads."""
+
+    def __init__(self, max_workers, journal=None):
+        self.max_workers = max(1, max_workers)
+        self.journal = journal
+        self.jobs = {}
+        self.order = []
+        self.lock = threading.Lock()
+        self.scheduler = HostScheduler(HOST_MAX_WORKERS, HOST_MIN_SPACING, HOST_LIMITS)
+        self.workers = []
+
+    def start(self):
+        for i in range(self.max_workers):
+            t = threading.Thread(target=self._worker, name=f"download-worker-{i}", daemon=True)
+            t.start()
+            self.workers.append(t)
+
+    def submit(self, url, fmt, quality, mode, folder, group=None, force=False):
+        job = DownloadJob(url, fmt, quality, mode, folder, group=group, force=force)
+        self._enqueue(job)
+        log_message(f"Job {job.id} queued for {job.host} ({self.scheduler.waiting() - 1} already waiting)")
+        return job
+
+    def _enqueue(self, job):
+        with self.lock:
+            self.jobs[job.id] = job
+            self.order.append(job.id)
+            self._prune()
+        if self.journal:
+            job.journal = self.journal
+            self.journal.save(job)
+        self.scheduler.add(job)
+
+    def resume_unfinished(self):
+        """Queue again every job the journal says never finished."""
+        if not self.journal:
+            return []
+        resumed = []
+        for (job_id, url, fmt, quality, mode, folder,
+             output_path, resume_state, created) in self.journal.unfinished():
+            job = DownloadJob(url, fmt, quality, mode, folder, job_id=job_id, created=created)
+            job.output_path = output_path or ''
+            job.resume = json.loads(resume_state or '{}')
+            job.progress['resumed'] = True
+            self._enqueue(job)
+            resumed.append(job)
+        if resumed:
+            log_message(f"Resuming {len(resumed)} unfinished job(s): {', '.join(j.id for j in resumed)}")
+        self.journal.prune(MAX_FINISHED_JOBS)
+        return resumed
+
+    def cancel(self, job, keep_partial=False):
+        """
+        Cancel a job. A queued job is withdrawn and finished on the spot; a
+        running one has its processes killed and is wrapped up by its worker.
+        """
+        if not job.cancel(keep_partial):
+            return False
+        if self.scheduler.remove(job):
+            self._finish_cancelled(job)
+        log_message(f"Job {job.id} cancelled" + (" (keeping partial files)" if job.keep_partial else ""))
+        return True
+
+    def retry(self, job):
+        """Queue a cancelled or failed job again; its partial files are picked up if kept."""
+        if job.progress['status'] not in ('cancelled', 'error'):
+            return False
+        job.cancel_event.clear()
+        job.keep_partial = False
+        job.partials.clear()
+        job.update(status="queued", stage="queued", error="", resumed=True)
+        self.scheduler.add(job)
+        log_message(f"Job {job.id} queued again")
+        return True
+
+    def _finish_cancelled(self, job):
+        if not job.keep_partial:
+            for path in job.remove_partials():
+                log_message(f"Removed partial file {path}")
+        job.update(status="cancelled", stage="cancelled", speed="—", eta="—", speed_bps=None)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def latest(self):
+        with self.lock:
+            return self.jobs[self.order[-1]] if self.order else None
+
+    def list(self):
+        with self.lock:
+            jobs = [self.jobs[j] for j in self.order]
+        return [job.snapshot() for job in jobs]
+
+    def group(self, group_id):
+        with self.lock:
+            return [self.jobs[j] for j in self.order if self.jobs[j].group == group_id]
+
+    def queued(self):
+        with self.lock:
+            return [self.jobs[j] for j in self.order if self.jobs[j].progress['status'] == 'queued']
+
+    def _prune(self):
+        # Forget the oldest finished jobs once the history grows too long,
+        # but keep every item of a playlist that is still downloading so its
+        # aggregate progress stays complete
+        active_groups = {self.jobs[j].group for j in self.order
+                         if self.jobs[j].group and not self.jobs[j].finished}
+        finished = [j for j in self.order
+                    if self.jobs[j].finished and self.jobs[j].group not in active_groups]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            self.order.remove(job_id)
+            del self.jobs[job_id]
+
+    def _worker(self):
+        while True:
+            job = self.scheduler.take()
+            _log_context.job_id = job.id
+            bandwidth.joined()
+            try:
+                run_download_job(job)
+            except Exception as e:
+                log_message(f"Job {job.id} crashed: {str(e)}")
+                job.update(status="error", error=str(e))
+            finally:
+                if job.cancelled:
+                    self._finish_cancelled(job)
+                disk_space.release(job)
+                bandwidth.release(job.id)
+                bandwidth.left()
+                _log_context.job_id = None
+                log_writer.forget(job.id)
+                self.scheduler.done(job)
+
+
+# The journal is opened at start-up (see __main__), so importing app writes nothing
+job_manager = JobManager(MAX_CONCURRENT_DOWNLOADS)
+
+metrics.gauge('avd_queue_depth', "Jobs waiting for a download worker", job_manager.scheduler.waiting)
+metrics.gauge('avd_workers', "Download workers", lambda: job_manager.max_workers)
+metrics.gauge('avd_active_workers', "Download workers busy with a job",
+              lambda: sum(job_manager.scheduler.running_by_host().values()))
+metrics.gauge('avd_jobs_running', "Running jobs per site",
+              lambda: {(('host', host),): n for host, n in job_manager.scheduler.running_by_host().items()})
+
 
 HTML = """
 <!DOCTYPE html>
@@ -434,6 +3542,42 @@ HTML = """
         }
         #preview-meta { color: var(--muted); font-size: 0.72rem; }
 
+        /* ─── Playlist entries ────────────────────── */
+        #playlist {
+            background: var(--surface);
+            border: 1px solid var(--border);
+            border-radius: 10px;
+            padding: 8px 10px;
+            display: none;
+            flex-direction: column;
+            margin-bottom: 9px;
+            flex-shrink: 0;
+            animation: fadeIn .25s ease;
+        }
+        #playlist.show { display: flex; }
+        .playlist-head {
+            display: flex; align-items: center; gap: 8px;
+            font-size: 0.78rem; font-weight: 600;
+            padding-bottom: 6px;
+            border-bottom: 1px solid var(--border);
+        }
+        #playlist-title { flex: 1; min-width: 0; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
+        #playlist-count { color: var(--muted); font-weight: 400; font-size: 0.72rem; white-space: nowrap; }
+        #playlist-items { max-height: 150px; overflow-y: auto; padding-top: 4px; }
+        .playlist-item {
+            display: flex; align-items: center; gap: 8px;
+            font-size: 0.74rem; padding: 3px 0; cursor: pointer;
+            color: var(--text); font-weight: 400;
+            text-transform: none; letter-spacing: normal; margin-bottom: 0;
+        }
+        .playlist-item .pl-index { color: var(--muted); width: 28px; text-align: right; flex-shrink: 0; }
+        .playlist-item .pl-title { flex: 1; min-width: 0; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
+        .playlist-item .pl-duration { color: var(--muted); flex-shrink: 0; }
+        .playlist-item .pl-thumb {
+            width: 48px; height: 27px; object-fit: cover;
+            border-radius: 4px; background: var(--card); flex-shrink: 0;
+        }
+
         /* ─── Format + Quality row ────────────────── */
         .options-row {
             display: grid;
@@ -453,6 +3597,13 @@ HTML = """
             border-radius: 8px;
         }
         #quality-skeleton.show { display: block; }
+        #format-plan {
+            font-size: 0.7rem;
+            color: var(--muted);
+            margin-top: 4px;
+        }
+        #format-plan:empty { display: none; }
+        #format-plan.warn { color: var(--yellow); }
 
         /* ─── Advanced toggle ─────────────────────── */
         .toggle-row {
@@ -516,6 +3667,22 @@ HTML = """
         }
         #choose-folder:hover { background: var(--border); }
 
+        /* ─── Speed limit row ─────────────────────── */
+        .limit-row {
+            display: flex; align-items: center; gap: 6px;
+            flex-shrink: 0;
+        }
+        .limit-row input {
+            min-width: 0; padding: 6px 8px;
+            border-radius: 8px; border: 1px solid var(--border);
+            background: var(--surface); color: var(--text);
+            font-size: 0.78rem; color-scheme: dark;
+        }
+        .limit-row input:focus { outline: none; border-color: var(--accent); }
+        #bwLimit { width: 90px; }
+        .limit-row input[type="time"] { flex: 1; }
+        .limit-unit { color: var(--muted); font-size: 0.72rem; white-space: nowrap; }
+
         /* ─── Download button ─────────────────────── */
         #download-btn {
             width: 100%; padding: 10px; border: none; border-radius: 8px;
@@ -607,6 +3774,25 @@ HTML = """
             color: var(--accent2);
             font-variant-numeric: tabular-nums;
         }
+        .progress-actions {
+            display: flex;
+            align-items: center;
+            gap: 8px;
+        }
+        #cancel-btn {
+            background: none;
+            border: 1px solid var(--border);
+            border-radius: 4px;
+            color: var(--muted);
+            font-size: 0.7rem;
+            line-height: 1;
+            padding: 2px 6px;
+            cursor: pointer;
+        }
+        #cancel-btn:hover {
+            color: var(--red);
+            border-color: var(--red-bd);
+        }
         .progress-stats {
             display: flex;
             gap: 14px;
@@ -701,6 +3887,11 @@ HTML = """
             display: flex; justify-content: space-between; align-items: center;
         }
         .log-header h2 { font-size: 0.95rem; color: var(--accent2); }
+        .log-header-actions { display: flex; align-items: center; gap: 8px; }
+        .log-level {
+            width: auto; padding: 4px 26px 4px 8px;
+            font-size: 0.72rem; border-radius: 6px;
+        }
         .log-close {
             background: transparent; border: none; color: var(--muted);
             font-size: 1.3rem; cursor: pointer; width: 28px; height: 28px;
@@ -725,6 +3916,20 @@ HTML = """
         .log-clear:hover { background: #3d1117; }
         .log-refresh { background: var(--accent);  color: white; border: none; }
         .log-refresh:hover { background: var(--accent-h); }
+
+        /* ─── Batch import ────────────────────────── */
+        .batch-fab { bottom: 60px; }
+        .batch-body { font-family: inherit; color: var(--text); }
+        #batchText {
+            width: 100%; height: 90px; resize: vertical;
+            padding: 8px 10px; border-radius: 8px;
+            border: 1px solid var(--border); background: var(--surface);
+            color: var(--text); font-size: 0.78rem; font-family: inherit;
+        }
+        #batchText:focus { outline: none; border-color: var(--accent); }
+        #batchFile { margin: 6px 0 8px; font-size: 0.72rem; color: var(--muted); }
+        #batchStatus { color: var(--muted); font-size: 0.72rem; }
+        .playlist-item.failed .pl-title { color: var(--red); }
     </style>
 </head>
 <body>
@@ -768,6 +3973,16 @@ HTML = """
         </div>
     </div>
 
+    <!-- Playlist entries (playlist and channel URLs) -->
+    <div id="playlist">
+        <div class="playlist-head">
+            <input type="checkbox" id="playlist-all" checked onchange="selectAllEntries(this.checked)">
+            <span id="playlist-title">Playlist</span>
+            <span id="playlist-count"></span>
+        </div>
+        <div id="playlist-items"></div>
+    </div>
+
     <!-- Format + Quality -->
     <div class="options-row">
         <div class="option-group field">
@@ -788,6 +4003,7 @@ HTML = """
                 <option value="480">480p</option>
                 <option value="360">360p</option>
             </select>
+            <div id="format-plan"></div>
         </div>
     </div>
 
@@ -813,6 +4029,18 @@ HTML = """
         </div>
     </div>
 
+    <!-- Speed limit: shared by all downloads, optionally only during set hours -->
+    <div class="field">
+        <label>Speed Limit</label>
+        <div class="limit-row">
+            <input type="number" id="bwLimit" min="0" step="0.5" placeholder="Unlimited" onchange="saveBandwidth()">
+            <span class="limit-unit">MB/s</span>
+            <input type="time" id="bwStart" onchange="saveBandwidth()" title="Limit only from this time…">
+            <span class="limit-unit">to</span>
+            <input type="time" id="bwEnd" onchange="saveBandwidth()" title="…until this time (leave both empty for all day)">
+        </div>
+    </div>
+
     <!-- Download button (label set by JS via BTN_LABEL constant) -->
     <button id="download-btn" onclick="startDownload()">Download</button>
 
@@ -827,7 +4055,10 @@ HTML = """
                     <span class="spinner" id="prog-spinner"></span>
                     <span id="prog-stage">Initializing…</span>
                 </div>
-                <span id="progress-pct">0%</span>
+                <div class="progress-actions">
+                    <span id="progress-pct">0%</span>
+                    <button id="cancel-btn" title="Cancel download" style="display:none" onclick="cancelDownload()">✕</button>
+                </div>
             </div>
             <div class="progress-stats" id="progress-stats" style="display:none">
                 <div class="stat">
@@ -853,6 +4084,9 @@ HTML = """
     <!-- Status -->
     <div id="status">Ready</div>
 
+    <!-- Batch import FAB -->
+    <button class="log-fab batch-fab" onclick="openBatchModal()" title="Import a list of URLs">📄</button>
+
     <!-- Log FAB -->
     <button class="log-fab" onclick="openLogModal()" title="View Download Logs">📋</button>
 
@@ -861,7 +4095,14 @@ HTML = """
         <div class="log-content">
             <div class="log-header">
                 <h2>📋 Download Log</h2>
-                <button class="log-close" onclick="closeLogModal()">×</button>
+                <div class="log-header-actions">
+                    <select id="logLevel" class="log-level" onchange="loadLogTail()">
+                        <option value="">All lines</option>
+                        <option value="warning">Warnings</option>
+                        <option value="error">Errors</option>
+                    </select>
+                    <button class="log-close" onclick="closeLogModal()">×</button>
+                </div>
             </div>
             <div class="log-body" id="logBody"><pre>Loading…</pre></div>
             <div class="log-footer">
@@ -871,13 +4112,35 @@ HTML = """
         </div>
     </div>
 
+    <!-- Batch import modal -->
+    <div class="log-modal" id="batchModal">
+        <div class="log-content">
+            <div class="log-header">
+                <h2>📄 Import URLs</h2>
+                <div class="log-header-actions">
+                    <span id="batchStatus"></span>
+                    <button class="log-close" onclick="closeBatchModal()">×</button>
+                </div>
+            </div>
+            <div class="log-body batch-body">
+                <textarea id="batchText" placeholder="Paste links, one per line…" spellcheck="false"></textarea>
+                <input type="file" id="batchFile" accept=".txt,text/plain">
+                <div id="batchRows"></div>
+            </div>
+            <div class="log-footer">
+                <button class="log-clear"   onclick="previewBatch()">🔍 Preview</button>
+                <button class="log-refresh" onclick="downloadBatch()">⬇ Download selected</button>
+            </div>
+        </div>
+    </div>
+
     <script>
     // ── State ─────────────────────────────────────────────────────────────────
     let currentFolder  = {{ folder_json | safe }};
     let isDownloading  = false;
     let useAdvanced    = false;
-    let progressInterval = null;
     let cachedFormats  = { video: [], audio: [] };
+    let archived       = { url: '', copies: [] };   // earlier downloads of the previewed video
 
     // ── DOM refs ──────────────────────────────────────────────────────────────
     const urlInput      = document.getElementById('url');
@@ -888,6 +4151,8 @@ HTML = """
     const qualitySkel   = document.getElementById('quality-skeleton');
     const previewSkel   = document.getElementById('preview-skeleton');
     const previewCard   = document.getElementById('preview');
+    const playlistBox   = document.getElementById('playlist');
+    const playlistItems = document.getElementById('playlist-items');
     const progContainer = document.getElementById('progress-container');
     const progFill      = document.getElementById('progress-fill');
     const progStage     = document.getElementById('prog-stage');
@@ -897,6 +4162,7 @@ HTML = """
     const statTotal     = document.getElementById('stat-total');
     const statSpeed     = document.getElementById('stat-speed');
     const statEta       = document.getElementById('stat-eta');
+    const cancelBtn     = document.getElementById('cancel-btn');
 
     // Button label constant — SVG icon + text, no spinner ever in the button
     const BTN_LABEL = `<svg style="vertical-align:middle;margin-right:6px" width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2.5" stroke-linecap="round" stroke-linejoin="round"><path d="M21 15v4a2 2 0 0 1-2 2H5a2 2 0 0 1-2-2v-4"/><polyline points="7 10 12 15 17 10"/><line x1="12" y1="15" x2="12" y2="3"/></svg>Download`;
@@ -915,9 +4181,12 @@ HTML = """
 
     function clearUrl() {
         urlInput.value = '';
+        clearTimeout(previewTimer);
+        cancelPreview();
         previewCard.classList.remove('show');
-        previewSkel.classList.remove('show');
+        hidePreviewSkeleton();
         document.getElementById('preview-thumb').src = '';
+        clearPlaylist();
         cachedFormats = { video: [], audio: [] };
         resetQualityToDefaults();
         resetToggle();
@@ -1035,17 +4304,28 @@ HTML = """
         toggle.classList.toggle('active', useAdvanced);
         // Save manual preference separately so auto-detect doesn't stomp it
         localStorage.setItem('use_advanced_manual', useAdvanced ? 'true' : 'false');
+        updateFormatPlan();
     }
 
     // ── Folder ────────────────────────────────────────────────────────────────
-    function chooseFolder() {
-        fetch('/choose_folder', { method: 'POST' })
+    function chooseFolder(folder) {
+        fetch('/choose_folder', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(folder ? { folder } : {})
+        })
             .then(r => r.json())
             .then(data => {
                 if (data.path) {
                     currentFolder = data.path;
                     document.getElementById('folder-path').textContent = data.path;
                     showStatus('Save folder updated.', 'success');
+                } else if (data.picker === false && !folder) {
+                    // Headless server: there is no dialog to open, so ask for a path
+                    const path = prompt('Save folder on the server:', currentFolder || '');
+                    if (path) chooseFolder(path);
+                } else if (data.message) {
+                    showStatus('✕ ' + data.message, 'error');
                 }
             })
             .catch(() => showStatus('Error selecting folder.', 'error'));
@@ -1057,8 +4337,59 @@ HTML = """
         formatSel.value = localStorage.getItem('yt_format') || 'mp4';
         onFormatChange(false);
         onUrlInput();  // will call applyToggleForUrl if URL already in box
+        resumeJobPanel();
+        loadBandwidth();
     });
 
+    // ── Speed limit ───────────────────────────────────────────────────────────
+    const MB = 1024 * 1024;
+
+    function loadBandwidth() {
+        fetch('/bandwidth')
+        .then(r => r.json())
+        .then(data => {
+            document.getElementById('bwLimit').value = data.limit ? +(data.limit / MB).toFixed(2) : '';
+            document.getElementById('bwStart').value = data.start || '';
+            document.getElementById('bwEnd').value   = data.end   || '';
+        })
+        .catch(() => {});
+    }
+
+    function saveBandwidth() {
+        const mbps = parseFloat(document.getElementById('bwLimit').value) || 0;
+        fetch('/bandwidth', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                limit: Math.round(mbps * MB),
+                start: document.getElementById('bwStart').value,
+                end:   document.getElementById('bwEnd').value
+            })
+        })
+        .then(r => r.json())
+        .then(data => {
+            if (data.error) { showStatus('✕ ' + data.error, 'error'); return; }
+            showStatus(data.limit ? `Speed limit set to ${+(data.limit / MB).toFixed(2)} MB/s; running downloads adjust within a few seconds.`
+                                  : 'Speed limit removed; running downloads speed up within a few seconds.', 'success');
+        })
+        .catch(() => showStatus('Error saving speed limit.', 'error'));
+    }
+
+    // Jobs interrupted by a restart are queued again by the server; follow
+    // the most recent unfinished one so its progress shows up straight away
+    function resumeJobPanel() {
+        fetch('/jobs')
+        .then(r => r.json())
+        .then(data => {
+            const open = (data.jobs || []).filter(j => !['completed','failed','error','cancelled'].includes(j.status));
+            if (!open.length || currentJobId) return;
+            currentJobId = open[open.length - 1].id;
+            progContainer.classList.add('show');
+            watchJob(currentJobId);
+        })
+        .catch(() => {});
+    }
+
     // ── Format change ─────────────────────────────────────────────────────────
     function onFormatChange(repopulate = true) {
         const fmt = formatSel.value;
@@ -1069,6 +4400,7 @@ HTML = """
             qualityGroup.classList.remove('hidden');
             if (repopulate) populateQualityDropdown(fmt);
         }
+        updateFormatPlan();
     }
 
     function populateQualityDropdown(fmt) {
@@ -1102,6 +4434,7 @@ HTML = """
             const match = Array.from(qualitySel.options).find(o => o.textContent === savedLabel);
             if (match) qualitySel.value = match.value;
         }
+        updateFormatPlan();
     }
 
     function resetQualityToDefaults() {
@@ -1111,16 +4444,65 @@ HTML = """
             <option value="h:720">720p</option>
             <option value="h:480">480p</option>
             <option value="h:360">360p</option>`;
+        updateFormatPlan();
+    }
+
+    // ── Format plan ───────────────────────────────────────────────────────────
+    // The exact streams the server would pick for the previewed video and
+    // their final size, before anything is downloaded
+    const formatPlan = document.getElementById('format-plan');
+    let planSeq = 0;
+    function updateFormatPlan() {
+        const url = urlInput.value.trim();
+        const seq = ++planSeq;
+        formatPlan.textContent = '';
+        formatPlan.classList.remove('warn');
+        if (!url || formatSel.value === 'mp3' || !previewCard.classList.contains('show')) return;
+        fetch('/format_plan', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ url, format: formatSel.value, quality: qualitySel.value,
+                                   mode: useAdvanced ? 'advanced' : 'standard' })
+        })
+        .then(r => r.json())
+        .then(data => {
+            const p = data.plan;
+            if (seq !== planSeq || !(p || data.disk)) return;
+            const mismatch = p && p.container !== formatSel.value;
+            formatPlan.textContent = [
+                p ? `${p.height}p ${p.vcodec}` + (p.acodec ? ` + ${p.acodec}` : '') : '',
+                p && p.size ? (p.size_exact ? '' : '~') + p.size : '',
+                mismatch ? `⚠ no ${formatSel.value.toUpperCase()} streams, saved as ${p.container.toUpperCase()}` : '',
+                data.disk ? '⚠ ' + data.disk : '',
+            ].filter(Boolean).join(' · ');
+            formatPlan.classList.toggle('warn', !!(data.disk || mismatch));
+            formatPlan.title = p ? 'Formats ' + p.selector : '';
+        })
+        .catch(() => {});
     }
 
     qualitySel.addEventListener('change', () => {
         // Save by label so it survives across different videos
         const sel = qualitySel.options[qualitySel.selectedIndex];
         if (sel) localStorage.setItem('yt_quality_label', sel.textContent);
+        updateFormatPlan();
     });
 
     // ── Preview fetch ─────────────────────────────────────────────────────────
+    // The server kills this page's previous extraction when a new preview
+    // starts; previewSeq drops any answer that is no longer the latest
+    const CLIENT_ID = Math.random().toString(36).slice(2) + Date.now().toString(36);
     let previewTimer = null;
+    let previewSeq = 0;
+
+    function cancelPreview() {
+        previewSeq++;
+        fetch('/preview/cancel', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ client: CLIENT_ID })
+        }).catch(() => {});
+    }
     function triggerPreview() {
         clearTimeout(previewTimer);
         previewTimer = setTimeout(fetchPreview, 300);
@@ -1132,80 +4514,259 @@ HTML = """
         // Quality skeleton
         qualitySkel.classList.add('show');
         qualitySel.style.display = 'none';
+        updateFormatPlan();     // card hidden: clears the old video's plan
+    }
+
+    function hidePreviewSkeleton() {
+        previewSkel.classList.remove('show');
+        qualitySkel.classList.remove('show');
+        qualitySel.style.display = '';
+    }
+
+    function fetchPreview() {
+        const url = urlInput.value.trim();
+        if (!url) { previewCard.classList.remove('show'); return; }
+        if (isPlaylistUrl(url)) { loadPlaylist(url); return; }
+        clearPlaylist();
+
+        showPreviewSkeleton();
+        showStatus('<span class="spinner"></span>Fetching video info…', 'loading');
+        const seq = ++previewSeq;
+
+        fetch('/preview', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ url, client: CLIENT_ID })
+        })
+        .then(r => r.json())
+        .then(data => {
+            if (seq !== previewSeq || data.cancelled) return;
+            hidePreviewSkeleton();
+            if (data.error) { showStatus('⚠ ' + data.error, 'warn'); return; }
+
+            document.getElementById('preview-title').textContent = data.title || '';
+            archived = { url, copies: data.archived || [] };
+            const done = archived.copies.map(c => c.format.toUpperCase() + (c.height ? ' ' + c.height + 'p' : ''));
+            document.getElementById('preview-meta').textContent =
+                [data.duration, data.uploader, done.length ? '✓ Downloaded (' + done.join(', ') + ')' : '']
+                    .filter(Boolean).join(' · ');
+
+            const thumb = document.getElementById('preview-thumb');
+            if (data.thumb) { thumb.src = thumbUrl(data.thumb, 160); thumb.style.display = 'block'; }
+            else                { thumb.style.display = 'none'; }
+            previewCard.classList.add('show');
+
+            cachedFormats = { video: data.video_formats || [], audio: data.audio_formats || [] };
+            if (formatSel.value !== 'mp3') populateQualityDropdown(formatSel.value);
+
+            showStatus('✓ Ready — select quality and hit Download', 'success');
+        })
+        .catch(() => {
+            if (seq !== previewSeq) return;
+            hidePreviewSkeleton();
+            showStatus('⚠ Could not fetch video info. You can still try downloading.', 'warn');
+        });
+    }
+
+    // ── Download ──────────────────────────────────────────────────────────────
+    // Downloads run as server-side jobs; the panel follows the most recent one
+    let currentJobId = null;
+
+    // ── Playlist mode ─────────────────────────────────────────────────────────
+    // Entries are streamed by /playlist as NDJSON and listed as they arrive
+    let playlistState = null;   // { url, title, entries } while a playlist is shown
+
+    function isPlaylistUrl(url) {
+        let u;
+        try { u = new URL(url.startsWith('http') ? url : 'https://' + url); }
+        catch { return false; }
+        if (u.searchParams.has('list') && !u.searchParams.has('v')) return true;
+        return /^\\/(playlist\\b|channel\\/|c\\/|user\\/|@[^/]+\\/?((videos|shorts|streams)\\/?)?$)|\\/sets\\//.test(u.pathname);
+    }
+
+    function clearPlaylist() {
+        playlistState = null;
+        playlistBox.classList.remove('show');
+        playlistItems.innerHTML = '';
+        document.getElementById('playlist-all').checked = true;
+    }
+
+    function loadPlaylist(url) {
+        clearPlaylist();
+        previewCard.classList.remove('show');
+        resetQualityToDefaults();   // items differ, so offer height-based choices
+        const state = playlistState = { url, title: '', entries: [] };
+        showPreviewSkeleton();
+        showStatus('<span class="spinner"></span>Listing playlist…', 'loading');
+
+        fetch('/playlist', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ url })
+        })
+        .then(r => streamNdjson(r, msg => {
+            if (playlistState !== state) return false;
+            onPlaylistLine(state, msg);
+        }))
+        .catch(() => {
+            if (playlistState !== state) return;
+            hidePreviewSkeleton();
+            showStatus('✕ Connection error.', 'error');
+        });
+    }
+
+    // Feed each line of an NDJSON response to onMessage as it arrives;
+    // onMessage returning false stops reading
+    function streamNdjson(response, onMessage) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        const pump = () => reader.read().then(({ done, value }) => {
+            buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+            const lines = buffered.split('\\n');
+            buffered = lines.pop();
+            for (const line of lines) {
+                if (line && onMessage(JSON.parse(line)) === false) { reader.cancel(); return; }
+            }
+            if (!done) return pump();
+        });
+        return pump();
+    }
+
+    function onPlaylistLine(state, msg) {
+        if (msg.entry) {
+            if (!state.entries.length) {
+                hidePreviewSkeleton();
+                playlistBox.classList.add('show');
+            }
+            addPlaylistEntry(state, msg.entry);
+        } else if (msg.done !== undefined) {
+            showStatus(`✓ ${msg.done} items — pick the ones to download`, 'success');
+        } else if (msg.error) {
+            hidePreviewSkeleton();
+            showStatus('⚠ ' + msg.error, 'warn');
+        }
+    }
+
+    // Thumbnails go through the local /thumb cache, scaled to the size shown;
+    // the server hands out each thumbnail's signed /thumb address
+    function thumbUrl(path, width) {
+        return path + '&w=' + width;
+    }
+
+    function rowThumb(row, path) {
+        const img = row.querySelector('.pl-thumb');
+        if (path) img.src = thumbUrl(path, 80);
+        else     img.style.visibility = 'hidden';
+    }
+
+    function addPlaylistEntry(state, entry) {
+        state.entries.push(entry);
+        if (!state.title && entry.playlist) {
+            state.title = entry.playlist;
+            document.getElementById('playlist-title').textContent = entry.playlist;
+        }
+        const row = document.createElement('label');
+        row.className = 'playlist-item';
+        row.innerHTML = '<input type="checkbox" checked><span class="pl-index"></span>'
+                      + '<img class="pl-thumb" loading="lazy" alt="">'
+                      + '<span class="pl-title"></span><span class="pl-duration"></span>';
+        rowThumb(row, entry.thumb);
+        const box = row.querySelector('input');
+        box.value = entry.url;
+        box.checked = document.getElementById('playlist-all').checked;
+        box.addEventListener('change', updatePlaylistCount);
+        row.querySelector('.pl-index').textContent = entry.index;
+        row.querySelector('.pl-title').textContent = entry.title;
+        row.querySelector('.pl-title').title = entry.title;
+        row.querySelector('.pl-duration').textContent = entry.duration || '';
+        playlistItems.appendChild(row);
+        updatePlaylistCount();
+    }
+
+    function selectedEntries() {
+        return Array.from(playlistItems.querySelectorAll('input:checked')).map(b => b.value);
     }
 
-    function hidePreviewSkeleton() {
-        previewSkel.classList.remove('show');
-        qualitySkel.classList.remove('show');
-        qualitySel.style.display = '';
+    function selectAllEntries(checked) {
+        playlistItems.querySelectorAll('input').forEach(b => { b.checked = checked; });
+        updatePlaylistCount();
     }
 
-    function fetchPreview() {
+    function updatePlaylistCount() {
+        const total = playlistState ? playlistState.entries.length : 0;
+        document.getElementById('playlist-count').textContent =
+            `${selectedEntries().length} of ${total} selected`;
+    }
+
+    function startDownload() {
+        if (isDownloading) return;
         const url = urlInput.value.trim();
-        if (!url) { previewCard.classList.remove('show'); return; }
+        if (!url) { showStatus('Please paste a video URL first.', 'error'); return; }
+        if (playlistState && playlistState.url === url) { startPlaylistDownload(); return; }
 
-        showPreviewSkeleton();
-        showStatus('<span class="spinner"></span>Fetching video info…', 'loading');
+        // The server skips videos it already has unless asked to download again
+        const fmt = useAdvanced ? 'mp4' : formatSel.value;
+        // (a copy below the chosen quality is downloaded again without asking)
+        const wanted = parseInt(qualitySel.value.split(':').pop(), 10);
+        const copy = archived.url === url && archived.copies.find(c =>
+            c.format === fmt && (fmt === 'mp3' || !wanted || (c.height || 0) >= wanted));
+        if (copy && !confirm(`Already downloaded:\n${copy.path}\n\nDownload it again?`)) return;
 
-        fetch('/preview', {
+        isDownloading = true;
+        const btn = document.getElementById('download-btn');
+        btn.disabled = true;
+        showQueuedPanel();
+
+        fetch('/download', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ url })
+            body: JSON.stringify({
+                url,
+                format:  formatSel.value,
+                quality: qualitySel.value,
+                mode:    useAdvanced ? 'advanced' : 'standard',
+                force:   !!copy
+            })
         })
         .then(r => r.json())
         .then(data => {
-            hidePreviewSkeleton();
-            if (data.error) { showStatus('⚠ ' + data.error, 'warn'); return; }
-
-            document.getElementById('preview-title').textContent = data.title || '';
-            document.getElementById('preview-meta').textContent =
-                [data.duration, data.uploader].filter(Boolean).join(' · ');
-
-            const thumb = document.getElementById('preview-thumb');
-            if (data.thumbnail) { thumb.src = data.thumbnail; thumb.style.display = 'block'; }
-            else                { thumb.style.display = 'none'; }
-            previewCard.classList.add('show');
-
-            cachedFormats = { video: data.video_formats || [], audio: data.audio_formats || [] };
-            if (formatSel.value !== 'mp3') populateQualityDropdown(formatSel.value);
-
-            showStatus('✓ Ready — select quality and hit Download', 'success');
+            if (data.error) {
+                setProgressDone(false);
+                showStatus('✕ ' + data.error, 'error');
+                return;
+            }
+            currentJobId = data.job_id;
+            watchJob(data.job_id);
+            if (data.warning) showStatus('⚠ ' + data.warning, 'warn');
         })
         .catch(() => {
-            hidePreviewSkeleton();
-            showStatus('⚠ Could not fetch video info. You can still try downloading.', 'warn');
+            setProgressDone(false);
+            showStatus('✕ Connection error.', 'error');
+        })
+        .finally(() => {
+            // The job runs on the server; the button is free for the next URL
+            isDownloading = false;
+            btn.disabled = false;
+            btn.innerHTML = BTN_LABEL;
         });
     }
 
-    // ── Download ──────────────────────────────────────────────────────────────
-    function startDownload() {
-        if (isDownloading) return;
-        const url = urlInput.value.trim();
-        if (!url) { showStatus('Please paste a video URL first.', 'error'); return; }
+    function startPlaylistDownload() {
+        const urls = selectedEntries();
+        if (!urls.length) { showStatus('Select at least one playlist item.', 'error'); return; }
 
         isDownloading = true;
         const btn = document.getElementById('download-btn');
         btn.disabled = true;
+        showQueuedPanel();
 
-        // Reset and show the progress panel — it's the only download indicator
-        progFill.style.background = '';
-        progFill.style.backgroundSize = '';
-        progFill.style.animation = '';
-        progFill.style.width = '';
-        progFill.classList.add('indeterminate');
-        progPct.textContent = '0%';
-        progStage.textContent = 'Preparing…';
-        progStats.style.display = 'none';
-        document.getElementById('prog-spinner').style.display = '';
-        progContainer.classList.add('show');
-        // Status bar: quiet message only — the progress panel is the visual indicator
-        showStatus('Download in progress…', 'loading');
-
-        fetch('/download', {
+        fetch('/download/playlist', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
-                url,
+                urls,
+                title:   playlistState.title,
                 format:  formatSel.value,
                 quality: qualitySel.value,
                 mode:    useAdvanced ? 'advanced' : 'standard'
@@ -1213,17 +4774,15 @@ HTML = """
         })
         .then(r => r.json())
         .then(data => {
-            clearInterval(progressInterval);
             if (data.error) {
                 setProgressDone(false);
                 showStatus('✕ ' + data.error, 'error');
-            } else {
-                setProgressDone(true);
-                showStatus('✓ Download complete!', 'success');
+                return;
             }
+            currentJobId = data.group_id;
+            watchPlaylist(data.group_id);
         })
         .catch(() => {
-            clearInterval(progressInterval);
             setProgressDone(false);
             showStatus('✕ Connection error.', 'error');
         })
@@ -1231,60 +4790,159 @@ HTML = """
             isDownloading = false;
             btn.disabled = false;
             btn.innerHTML = BTN_LABEL;
-            setTimeout(() => progContainer.classList.remove('show'), 6000);
         });
+    }
+
+    // Reset and show the progress panel — it's the only download indicator
+    function showQueuedPanel() {
+        progFill.style.background = '';
+        progFill.style.backgroundSize = '';
+        progFill.style.animation = '';
+        progFill.style.width = '';
+        progFill.classList.add('indeterminate');
+        progPct.textContent = '0%';
+        progStage.textContent = 'Queued…';
+        progStats.style.display = 'none';
+        document.getElementById('prog-spinner').style.display = '';
+        setCancelTarget(null);
+        progContainer.classList.add('show');
+        // Status bar: quiet message only — the progress panel is the visual indicator
+        showStatus('Download in progress…', 'loading');
+    }
 
-        // Poll progress
-        progressInterval = setInterval(() => {
-            fetch('/progress').then(r => r.json()).then(p => {
-                const pct = Math.min(100, p.percent || 0);
+    // Progress is pushed by the server (SSE): a full snapshot first, then
+    // only the fields that changed
+    let progressSource = null;
 
-                // Switch from indeterminate to real fill once we have data
-                if (pct > 0 || p.stage === 'video' || p.stage === 'audio' || p.stage === 'merging') {
-                    progFill.classList.remove('indeterminate');
-                    progFill.style.width = pct + '%';
-                    progPct.textContent = pct + '%';
-                }
+    // The ✕ in the progress panel cancels whatever the panel is following
+    let cancelUrl = null;
 
-                // Stage label + bar color
-                const stageLabels = {
-                    'starting': 'Preparing…',
-                    'video':    '⬇ Downloading video',
-                    'audio':    '🎵 Downloading audio',
-                    'merging':  '⚙ Merging streams',
-                    'idle':     'Starting…',
-                };
-                progStage.textContent = stageLabels[p.stage] || 'Downloading…';
-                updateBarColor(p.stage);
-
-                // Show stats only during actual download phases (not merging)
-                if ((p.stage === 'video' || p.stage === 'audio') && p.total && p.total !== '—' && p.total !== 'Unknown') {
-                    progStats.style.display = 'flex';
-                    statDown.textContent  = p.downloaded || '—';
-                    statTotal.textContent = p.total      || '—';
-                    statSpeed.textContent = p.speed      || '—';
-                    statEta.textContent   = p.eta        || '—';
-                } else if (p.stage === 'merging') {
-                    progStats.style.display = 'flex';
-                    statDown.textContent  = '—';
-                    statTotal.textContent = '—';
-                    statSpeed.textContent = '—';
-                    statEta.textContent   = '—';
-                }
+    function setCancelTarget(url) {
+        cancelUrl = url;
+        cancelBtn.style.display = url ? '' : 'none';
+    }
+
+    function cancelDownload() {
+        if (!cancelUrl) return;
+        const url = cancelUrl;
+        setCancelTarget(null);
+        progStage.textContent = 'Cancelling…';
+        fetch(url, { method: 'POST' }).catch(() => {});
+    }
+
+    function watchJob(jobId) {
+        if (progressSource) progressSource.close();
+        setCancelTarget('/jobs/' + jobId + '/cancel');
+        const p = {};
+        progressSource = new EventSource('/progress/stream/' + jobId);
+        const source = progressSource;
+        source.onmessage = e => {
+            if (jobId !== currentJobId) { source.close(); return; }
+            Object.assign(p, JSON.parse(e.data));
+            renderProgress(p);
+            if (['completed','failed','error','cancelled'].includes(p.status)) source.close();
+        };
+    }
+
+    // A playlist download reports its items as one aggregate
+    function watchPlaylist(groupId) {
+        if (progressSource) progressSource.close();
+        setCancelTarget('/playlist/cancel/' + groupId);
+        progressSource = new EventSource('/playlist/progress/' + groupId);
+        const source = progressSource;
+        source.onmessage = e => {
+            if (groupId !== currentJobId) { source.close(); return; }
+            const g = JSON.parse(e.data);
+            if (g.status === 'completed') {
+                source.close();
+                setProgressDone(g.failed === 0 && !g.cancelled, g.cancelled ? '✕ Cancelled' : null);
+                const cancelled = g.cancelled ? `, ${g.cancelled} cancelled` : '';
+                showStatus(g.failed || g.cancelled
+                    ? `⚠ ${g.completed} downloaded, ${g.failed} failed${cancelled}` + (g.failed ? ' — check the log' : '')
+                    : `✓ Playlist complete: ${g.completed} downloaded`,
+                    g.failed || g.cancelled ? 'warn' : 'success');
+                setTimeout(() => { if (currentJobId === groupId) progContainer.classList.remove('show'); }, 6000);
+                return;
+            }
+            if (g.percent > 0 || g.active) {
+                progFill.classList.remove('indeterminate');
+                progFill.style.width = g.percent + '%';
+                progPct.textContent = g.percent + '%';
+            }
+            progStage.textContent = `⬇ Playlist: ${g.completed + g.failed + g.cancelled}/${g.total} done`
+                                  + (g.active ? ` · ${g.active} downloading` : '');
+            updateBarColor('video');
+            progStats.style.display = 'flex';
+            statDown.textContent  = g.completed;
+            statTotal.textContent = g.total;
+            statSpeed.textContent = g.speed || '—';
+            statEta.textContent   = '—';
+        };
+    }
 
-                if (['completed','failed','error'].includes(p.status))
-                    clearInterval(progressInterval);
-            }).catch(() => {});
-        }, 700);
+    function renderProgress(p) {
+        if (p.status === 'cancelled') {
+            setProgressDone(false, '✕ Cancelled');
+            showStatus('Download cancelled.', 'warn');
+            setTimeout(() => { if (currentJobId === p.id) progContainer.classList.remove('show'); }, 6000);
+            return;
+        }
+        if (p.status === 'completed' || p.status === 'error' || p.status === 'failed') {
+            const ok = p.status === 'completed';
+            setProgressDone(ok);
+            showStatus(ok ? (p.skipped ? '✓ ' + (p.skip_reason || 'Already downloaded') + ' — skipped.' : '✓ Download complete!')
+                          : '✕ ' + (p.error || 'Download failed.'),
+                       ok ? 'success' : 'error');
+            setTimeout(() => { if (currentJobId === p.id) progContainer.classList.remove('show'); }, 6000);
+            return;
+        }
+
+        const pct = Math.min(100, p.percent || 0);
+
+        // Switch from indeterminate to real fill once we have data
+        if (pct > 0 || ['video', 'audio', 'merging', 'processing'].includes(p.stage)) {
+            progFill.classList.remove('indeterminate');
+            progFill.style.width = pct + '%';
+            progPct.textContent = pct + '%';
+        }
+
+        // Stage label + bar color
+        const stageLabels = {
+            'queued':   'Queued…',
+            'starting': 'Preparing…',
+            'video':    '⬇ Downloading video',
+            'audio':    '🎵 Downloading audio',
+            'merging':  '⚙ Merging streams',
+            'processing': '⚙ Post-processing',
+            'idle':     'Starting…',
+        };
+        progStage.textContent = stageLabels[p.stage] || 'Downloading…';
+        updateBarColor(p.stage);
+
+        // Show stats only during actual download phases (not merging)
+        if ((p.stage === 'video' || p.stage === 'audio') && p.total && p.total !== '—' && p.total !== 'Unknown') {
+            progStats.style.display = 'flex';
+            statDown.textContent  = p.downloaded || '—';
+            statTotal.textContent = p.total      || '—';
+            statSpeed.textContent = p.speed      || '—';
+            statEta.textContent   = p.eta        || '—';
+        } else if (p.stage === 'merging' || p.stage === 'processing') {
+            progStats.style.display = 'flex';
+            statDown.textContent  = '—';
+            statTotal.textContent = '—';
+            statSpeed.textContent = '—';
+            statEta.textContent   = '—';
+        }
     }
 
-    function setProgressDone(success) {
+    function setProgressDone(success, label) {
         progFill.classList.remove('indeterminate');
         progFill.style.animation = 'none';
         progFill.style.width = '100%';
         progPct.textContent = '100%';
-        progStage.textContent = success ? '✓ Complete!' : '✕ Failed';
+        progStage.textContent = label || (success ? '✓ Complete!' : '✕ Failed');
         document.getElementById('prog-spinner').style.display = 'none';
+        setCancelTarget(null);
         if (success) progFill.style.background = 'linear-gradient(90deg, #16a34a, #22c55e, #4ade80)';
         else         progFill.style.background = 'linear-gradient(90deg, #dc2626, #ef4444, #f87171)';
         progStats.style.display = 'none';
@@ -1292,7 +4950,7 @@ HTML = """
 
     // Update bar tint per phase
     function updateBarColor(stage) {
-        if (stage === 'merging') {
+        if (stage === 'merging' || stage === 'processing') {
             progFill.style.background = 'linear-gradient(90deg, #7c3aed, #a78bfa, #7c3aed)';
             progFill.style.backgroundSize = '200% 100%';
         } else if (stage === 'audio') {
@@ -1312,24 +4970,158 @@ HTML = """
     }
 
     // ── Log modal ─────────────────────────────────────────────────────────────
-    function openLogModal()  { document.getElementById('logModal').classList.add('show'); refreshLog(); }
+    // The modal shows a window [logStart, logEnd) of the log file: scrolling
+    // to the top loads older pages, Refresh appends what was written since
+    const logBody = document.getElementById('logBody');
+    let logStart = 0, logEnd = 0, logMore = false, logLoading = false;
+
+    function logQuery(extra) {
+        const level = document.getElementById('logLevel').value;
+        return '/get_log?limit=200' + (level ? '&level=' + level : '') + extra;
+    }
+    function logText(lines) { return lines.length ? lines.join('\\n') + '\\n' : ''; }
+
+    // ── Batch import ──────────────────────────────────────────────────────────
+    // /preview/batch streams one NDJSON line per URL as its preview finishes
+    let batchRun = 0;
+    const batchRows = document.getElementById('batchRows');
+
+    function openBatchModal()  { document.getElementById('batchModal').classList.add('show'); }
+    function closeBatchModal() { batchRun++; document.getElementById('batchModal').classList.remove('show'); }
+    function setBatchStatus(text) { document.getElementById('batchStatus').textContent = text; }
+
+    function previewBatch() {
+        const file = document.getElementById('batchFile').files[0];
+        const run = ++batchRun;
+        let init;
+        if (file) {
+            const form = new FormData();
+            form.append('file', file);
+            init = { method: 'POST', body: form };
+        } else {
+            init = {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ text: document.getElementById('batchText').value })
+            };
+        }
+        batchRows.innerHTML = '';
+        setBatchStatus('Fetching…');
+
+        fetch('/preview/batch', init)
+        .then(r => (r.headers.get('Content-Type') || '').includes('ndjson')
+            ? streamNdjson(r, msg => {
+                if (run !== batchRun) return false;
+                onBatchLine(msg);
+            })
+            : r.json().then(data => setBatchStatus('⚠ ' + (data.error || 'Preview failed'))))
+        .catch(() => { if (run === batchRun) setBatchStatus('✕ Connection error.'); });
+    }
+
+    function onBatchLine(msg) {
+        if (msg.done !== undefined) {
+            setBatchStatus(`✓ ${msg.done - msg.failed} ready` + (msg.failed ? `, ${msg.failed} failed` : ''));
+            return;
+        }
+        const row = document.createElement('label');
+        row.className = 'playlist-item' + (msg.error ? ' failed' : '');
+        row.dataset.index = msg.index;
+        row.innerHTML = '<input type="checkbox"><span class="pl-index"></span>'
+                      + '<img class="pl-thumb" loading="lazy" alt="">'
+                      + '<span class="pl-title"></span><span class="pl-duration"></span>';
+        rowThumb(row, msg.thumb);
+        const box = row.querySelector('input');
+        box.value = msg.url;
+        box.checked = !msg.error;
+        row.querySelector('.pl-index').textContent = msg.index + 1;
+        row.querySelector('.pl-title').textContent = msg.error ? msg.url : msg.title || msg.url;
+        row.querySelector('.pl-title').title = msg.error || msg.url;
+        row.querySelector('.pl-duration').textContent = msg.error ? '⚠' : msg.duration || '';
+        // Results arrive in completion order; keep the list in input order
+        const next = Array.from(batchRows.children).find(r => +r.dataset.index > msg.index);
+        batchRows.insertBefore(row, next || null);
+        setBatchStatus(`${batchRows.children.length} checked…`);
+    }
+
+    function downloadBatch() {
+        const urls = Array.from(batchRows.querySelectorAll('input:checked')).map(b => b.value);
+        if (!urls.length) { setBatchStatus('Nothing selected'); return; }
+        closeBatchModal();
+        showQueuedPanel();
+        fetch('/download/playlist', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                urls,
+                format:  formatSel.value,
+                quality: qualitySel.value,
+                mode:    useAdvanced ? 'advanced' : 'standard'
+            })
+        })
+        .then(r => r.json())
+        .then(data => {
+            if (data.error) {
+                setProgressDone(false);
+                showStatus('✕ ' + data.error, 'error');
+                return;
+            }
+            currentJobId = data.group_id;
+            watchPlaylist(data.group_id);
+        })
+        .catch(() => {
+            setProgressDone(false);
+            showStatus('✕ Connection error.', 'error');
+        });
+    }
+
+    function openLogModal()  { document.getElementById('logModal').classList.add('show'); loadLogTail(); }
     function closeLogModal() { document.getElementById('logModal').classList.remove('show'); }
-    function refreshLog() {
-        fetch('/get_log').then(r => r.json()).then(data => {
-            const b = document.getElementById('logBody');
-            b.innerHTML = '<pre>' + (data.log || 'No logs yet.') + '</pre>';
-            b.scrollTop = b.scrollHeight;
-        }).catch(() => {
-            document.getElementById('logBody').innerHTML = '<pre>Error loading log.</pre>';
+
+    function showLogTail(data) {
+        const pre = document.createElement('pre');
+        pre.textContent = logText(data.lines) || 'No logs yet.';
+        logBody.replaceChildren(pre);
+        logStart = data.start; logEnd = data.end; logMore = data.more;
+        logBody.scrollTop = logBody.scrollHeight;
+    }
+    function loadLogTail() {
+        fetch(logQuery('')).then(r => r.json()).then(showLogTail).catch(() => {
+            logBody.innerHTML = '<pre>Error loading log.</pre>';
         });
     }
+    function refreshLog() {
+        if (!logEnd) { loadLogTail(); return; }
+        fetch(logQuery('&after=' + logEnd)).then(r => r.json()).then(data => {
+            if (data.reset) { showLogTail(data); return; }
+            const atBottom = logBody.scrollTop + logBody.clientHeight >= logBody.scrollHeight - 20;
+            logBody.firstChild.append(logText(data.lines));
+            logEnd = data.end;
+            if (atBottom) logBody.scrollTop = logBody.scrollHeight;
+            if (data.more) refreshLog();
+        }).catch(() => {});
+    }
+    function loadOlderLog() {
+        if (!logMore || logLoading) return;
+        logLoading = true;
+        fetch(logQuery('&before=' + logStart)).then(r => r.json()).then(data => {
+            const oldHeight = logBody.scrollHeight;
+            logBody.firstChild.prepend(logText(data.lines));
+            logBody.scrollTop += logBody.scrollHeight - oldHeight;   // keep the view still
+            logStart = data.start; logMore = data.more;
+        }).catch(() => {}).finally(() => { logLoading = false; });
+    }
+    logBody.addEventListener('scroll', () => { if (logBody.scrollTop < 60) loadOlderLog(); });
+
     function clearLog() {
         if (confirm('Clear all logs?'))
-            fetch('/clear_log', { method: 'POST' }).then(() => refreshLog());
+            fetch('/clear_log', { method: 'POST' }).then(() => loadLogTail());
     }
     document.getElementById('logModal').addEventListener('click', e => {
         if (e.target.id === 'logModal') closeLogModal();
     });
+    document.getElementById('batchModal').addEventListener('click', e => {
+        if (e.target.id === 'batchModal') closeBatchModal();
+    });
     </script>
 </body>
 </html>
@@ -1344,89 +5136,206 @@ def home():
         folder_json=json.dumps(DOWNLOAD_FOLDER)
     )
 
+def preview_fields(info):
+    """The part of an extracted info dict the preview card shows."""
+    video_formats, audio_formats = parse_formats_from_info(info)
+
+    thumbnail = (
+        info.get('thumbnail') or
+        (info.get('thumbnails', [{}])[-1].get('url') if info.get('thumbnails') else None)
+    )
+
+    duration_str = info.get('duration_string', '')
+    uploader = info.get('uploader') or info.get('channel') or ''
+    key = archive_key(info)
+    archived = download_archive.lookup(key) if key else []
+
+    log_message(
+        f"Preview OK: '{info.get('title','?')}' | "
+        f"{len(video_formats)} video formats, {len(audio_formats)} audio formats"
+    )
+
+    return {
+        'title':         info.get('title', ''),
+        'duration':      duration_str,
+        'uploader':      uploader,
+        'thumbnail':     thumbnail,
+        'thumb':         thumb_path(thumbnail),
+        'archived':      archived,
+        'video_formats': [
+            {'format_id': f['format_id'], 'label': f['label'], 'height': f['height'],
+             'ext': f['ext'], 'vcodec': f['vcodec'], 'acodec': f['acodec']}
+            for f in video_formats
+        ],
+        'audio_formats': [
+            {'format_id': f['format_id'], 'label': f['label'], 'ext': f['ext']}
+            for f in audio_formats
+        ],
+    }
+
+
 @app.route('/preview', methods=['POST'])
 def preview():
+    """
+    Preview one URL. A "client" token in the request ties previews from one
+    page together: a newer preview kills the extraction of the older one,
+    which then answers {"cancelled": true}.
+    """
+    client = None
+    ticket = None
     try:
         url = request.json.get('url')
+        client = request.json.get('client')
         if not url:
             return jsonify({'error': 'No URL provided'})
 
         log_message(f"Preview request for: {url}")
 
-        cmd = [
-            resource_path('yt-dlp.exe'),
-            '--dump-json',
-            '--no-download',
-            '--no-playlist',
-            '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            '--add-header', 'Accept:*/*',
-            '--add-header', 'Accept-Language:en-US,en;q=0.9',
-            '--no-check-certificate',
-            url
-        ]
+        ticket = preview_registry.begin(client)
+        info, error = extract_info(url, ticket=ticket)
+        if error:
+            return jsonify({'error': error})
 
-        result = subprocess.run(
-            cmd, capture_output=True, text=True, check=False,
-            creationflags=subprocess.CREATE_NO_WINDOW
-        )
+        return jsonify(preview_fields(info))
 
-        if result.returncode != 0:
-            log_message(f"Preview failed: {result.stderr[:500]}")
-            return jsonify({'error': 'Could not fetch video info. Check the URL or try a different link.'})
+    except PreviewCancelled:
+        log_message(f"Preview cancelled (superseded): {url}")
+        return jsonify({'error': 'Preview cancelled', 'cancelled': True})
 
-        # yt-dlp may output multiple JSON lines for playlists; take the first
-        stdout = result.stdout.strip()
-        first_line = next((l for l in stdout.splitlines() if l.strip().startswith('{')), None)
-        if not first_line:
-            return jsonify({'error': 'No video metadata returned.'})
+    except Exception as e:
+        log_message(f"Preview exception: {str(e)}")
+        return jsonify({'error': f'Preview error: {str(e)}'})
 
-        info = json.loads(first_line)
+    finally:
+        if ticket is not None:
+            preview_registry.end(client, ticket)
 
-        video_formats, audio_formats = parse_formats_from_info(info)
 
-        thumbnail = (
-            info.get('thumbnail') or
-            (info.get('thumbnails', [{}])[-1].get('url') if info.get('thumbnails') else None)
-        )
+@app.route('/preview/cancel', methods=['POST'])
+def preview_cancel():
+    """Stop the running preview of a client, e.g. when its URL box is cleared."""
+    client = (request.json or {}).get('client')
+    return jsonify({'cancelled': bool(client) and preview_registry.cancel(client)})
 
-        duration_str = info.get('duration_string', '')
-        uploader = info.get('uploader') or info.get('channel') or ''
 
-        log_message(
-            f"Preview OK: '{info.get('title','?')}' | "
-            f"{len(video_formats)} video formats, {len(audio_formats)} audio formats"
-        )
+def batch_urls(text):
+    """The distinct http(s) URLs of a pasted list or text file, in order."""
+    seen, urls = set(), []
+    for line in text.splitlines():
+        for url in line.replace(',', ' ').split():
+            if url.startswith(('http://', 'https://')) and url not in seen:
+                seen.add(url)
+                urls.append(url)
+    return urls
 
-        return jsonify({
-            'title':         info.get('title', ''),
-            'duration':      duration_str,
-            'uploader':      uploader,
-            'thumbnail':     thumbnail,
-            'video_formats': [
-                {'format_id': f['format_id'], 'label': f['label'], 'height': f['height'],
-                 'ext': f['ext'], 'vcodec': f['vcodec'], 'acodec': f['acodec']}
-                for f in video_formats
-            ],
-            'audio_formats': [
-                {'format_id': f['format_id'], 'label': f['label'], 'ext': f['ext']}
-                for f in audio_formats
-            ],
-        })
 
-    except Exception as e:
-        log_message(f"Preview exception: {str(e)}")
-        return jsonify({'error': f'Preview error: {str(e)}'})
+@app.route('/preview/batch', methods=['POST'])
+def preview_batch():
+    """
+    Preview many URLs at once. Accepts JSON {"urls": [...]} or {"text": ...},
+    or an uploaded text file in the "file" form field. Results are streamed
+    as NDJSON in completion order, one {"index", "url", ...} line per URL,
+    followed by a {"done", "failed"} summary line.
+    """
+    if 'file' in request.files:
+        text = request.files['file'].read().decode('utf-8', 'replace')
+    else:
+        data = request.get_json(silent=True) or {}
+        listed, text = data.get('urls') or [], data.get('text') or ''
+        if (not isinstance(listed, list) or not all(isinstance(u, str) for u in listed)
+                or not isinstance(text, str)):
+            return jsonify({'error': 'Invalid request ("urls" is a list of strings, "text" a string)'}), 400
+        text = '\n'.join(listed) or text
+
+    urls = batch_urls(text)
+    if not urls:
+        return jsonify({'error': 'No URLs found'})
+    if len(urls) > PREVIEW_BATCH_MAX:
+        return jsonify({'error': f'Too many URLs ({len(urls)}); the limit is {PREVIEW_BATCH_MAX}'})
+
+    log_message(f"Batch preview: {len(urls)} URLs, {PREVIEW_BATCH_CONCURRENCY} at a time")
+
+    def one(index, url):
+        # Use a warm extractor when one is free, a one-off process otherwise,
+        # so the batch is not serialised behind the pool
+        try:
+            info, error = extract_info(url, wait=False)
+            if not error:
+                return dict(preview_fields(info), index=index, url=url)
+        except Exception as e:
+            log_message(f"Preview exception: {str(e)}")
+            error = f'Preview error: {str(e)}'
+        return {'index': index, 'url': url, 'error': error}
+
+    def lines():
+        failed = 0
+        pool = ThreadPoolExecutor(PREVIEW_BATCH_CONCURRENCY, thread_name_prefix='preview')
+        futures = [pool.submit(one, i, url) for i, url in enumerate(urls)]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                failed += 'error' in result
+                yield json.dumps(result) + '\n'
+            yield json.dumps({'done': len(urls), 'failed': failed}) + '\n'
+        finally:
+            # Stops queued extractions when the client goes away mid-batch
+            # (by hand: shutdown(cancel_futures=True) needs Python 3.9)
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    return Response(lines(), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+@app.route('/thumb', methods=['GET'])
+def thumb():
+    """
+    Serve a remote thumbnail through the disk cache: /thumb?url=...&sig=...&w=160,
+    as handed out by thumb_path() in previews; unsigned URLs are refused.
+    Responses carry an ETag and a long max-age, so repeats cost nothing.
+    """
+    url = request.args.get('url', '')
+    if not url.startswith(('http://', 'https://')):
+        return jsonify({'error': 'Invalid thumbnail URL'}), 400
+    if not hmac.compare_digest(request.args.get('sig', ''), thumb_signature(url)):
+        return jsonify({'error': 'Unknown thumbnail'}), 403
+    width = request.args.get('w', type=int)
+    if width:
+        width = next((w for w in THUMB_WIDTHS if w >= width), THUMB_WIDTHS[-1])
+    try:
+        path = thumb_cache.get(url, width)
+    except (requests.RequestException, ValueError, OSError) as e:
+        log_message(f"Thumbnail fetch failed: {url[:200]} ({str(e)[:200]})", sample_key='thumb')
+        return jsonify({'error': 'Thumbnail unavailable'}), 502
+    return send_file(path, mimetype=ThumbCache.mime_type(path),
+                     conditional=True, etag=True, max_age=THUMB_MAX_AGE)
 
 
 @app.route('/choose_folder', methods=['POST'])
 def choose_folder():
+    """
+    Change the save folder with the native picker, or to the `folder` sent
+    in the request body — the only way when the server runs headless.
+    """
     global DOWNLOAD_FOLDER
+    data = request.get_json(silent=True) or {}
     try:
-        new_folder = diropenbox(
-            msg="Select folder to save videos",
-            title="Choose Save Location",
-            default=DOWNLOAD_FOLDER
-        )
+        if data.get('folder'):
+            new_folder = os.path.abspath(os.path.expanduser(data['folder']))
+            if not os.path.isdir(new_folder):
+                return jsonify({'path': None, 'message': f'Not a folder: {new_folder}'})
+        elif HEADLESS or diropenbox is None:
+            return jsonify({'path': None, 'picker': False,
+                            'message': 'No folder picker on this server; send a folder path instead'})
+        else:
+            new_folder = diropenbox(
+                msg="Select folder to save videos",
+                title="Choose Save Location",
+                default=DOWNLOAD_FOLDER
+            )
         if new_folder:
             DOWNLOAD_FOLDER = new_folder
             with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
@@ -1441,7 +5350,6 @@ def choose_folder():
 
 @app.route('/download', methods=['POST'])
 def download():
-    global DOWNLOAD_FOLDER
     data = request.json
     url     = data.get('url', '').strip()
     fmt     = data.get('format', 'mp4')
@@ -1451,175 +5359,353 @@ def download():
     if not url:
         return jsonify({'error': 'No URL provided'})
 
-    with download_lock:
-        download_progress.update({
-            "mode": mode, "status": "starting", "stage": "starting",
-            "percent": 0, "downloaded": "—", "total": "—",
-            "speed": "—", "eta": "—", "error": ""
-        })
+    job = job_manager.submit(url, fmt, quality, mode, DOWNLOAD_FOLDER, force=bool(data.get('force')))
+    return jsonify({'status': 'queued', 'job_id': job.id, 'folder': job.folder,
+                    'warning': disk_warning(url, fmt, quality, mode, job.folder, exclude=job)})
+
+
+@app.route('/playlist', methods=['POST'])
+def playlist():
+    """
+    List a playlist or channel as NDJSON: one {"entry": ...} line per item
+    as soon as yt-dlp reports it, then a final {"done": count} or
+    {"error": message} line.
+    """
+    url = (request.json or {}).get('url', '').strip()
+    if not url:
+        return jsonify({'error': 'No URL provided'})
+
+    log_message(f"Playlist request for: {url}")
+
+    def lines():
+        count = 0
+        try:
+            for entry in iter_playlist_entries(url):
+                count += 1
+                yield json.dumps({'entry': entry}) + '\n'
+            yield json.dumps({'done': count}) + '\n'
+        except Exception as e:
+            yield json.dumps({'error': str(e)}) + '\n'
+
+    return Response(lines(), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+@app.route('/download/playlist', methods=['POST'])
+def download_playlist():
+    """Queue the selected playlist items as one group of jobs."""
+    data = request.json or {}
+    urls    = [u.strip() for u in data.get('urls', []) if u and u.strip()]
+    fmt     = data.get('format', 'mp4')
+    quality = data.get('quality', 'bestvideo+bestaudio/best')
+    mode    = data.get('mode', 'standard')
+    title   = sanitize_filename(data.get('title') or '').strip(' .')
+
+    if not urls:
+        return jsonify({'error': 'No playlist items selected'})
+
+    # Items of a named playlist go to their own sub-folder
+    folder = os.path.join(DOWNLOAD_FOLDER, title) if title else DOWNLOAD_FOLDER
+    os.makedirs(folder, exist_ok=True)
+
+    group = uuid.uuid4().hex[:12]
+    log_message(f"Playlist [{group}]: {len(urls)} items into {folder}")
+    jobs = [job_manager.submit(u, fmt, quality, mode, folder, group=group) for u in urls]
+    return jsonify({
+        'status': 'queued', 'group_id': group, 'folder': folder,
+        'job_ids': [job.id for job in jobs],
+    })
+
+
+def run_download_job(job):
+    """Execute one download job on a worker thread, reporting into job.progress."""
+    url, fmt, quality, mode = job.url, job.format, job.quality, job.mode
+    if job.cancelled:
+        return      # cancelled while being handed to this worker
+
+    job.update(
+        mode=mode, status="starting", stage="starting",
+        percent=0, downloaded="—", total="—",
+        speed="—", eta="—", error=""
+    )
 
-    log_message(f"Download: url={url}")
+    log_message(f"Download [{job.id}]: url={url}" + (" (resumed)" if job.progress.get('resumed') else ""))
     log_message(f"  format={fmt}, quality={quality}, mode={mode}")
 
-    try:
-        # Resolve video title for the output filename
-        info_result = subprocess.run(
-            [resource_path('yt-dlp.exe'),
-             '--dump-json', '--no-download', '--no-playlist',
-             '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-             '--no-check-certificate', url],
-            capture_output=True, text=True, check=False,
-            creationflags=subprocess.CREATE_NO_WINDOW
-        )
+    info_path, info_is_temp = None, False
 
-        if info_result.returncode == 0:
+    try:
+        # Resolve video title for the output filename; the info is usually
+        # already cached by /preview and is handed to yt-dlp below so it
+        # doesn't have to extract the page again
+        # The job is the extraction's ticket, so a cancel kills the extractor
+        # (or stops the wait for one) instead of sitting it out
+        with job.trace.span('title lookup', url=url) as span:
             try:
-                first = next(
-                    (l for l in info_result.stdout.splitlines() if l.strip().startswith('{')),
-                    '{}'
-                )
-                info = json.loads(first)
-                title = sanitize_filename(info.get('title', 'video'))
-            except Exception:
-                title = 'video'
-        else:
-            title = 'video'
+                info, _ = extract_info(url, ticket=job)
+            except PreviewCancelled:
+                job.check_cancelled()
+                raise
+            span['args']['found'] = info is not None
+        job.check_cancelled()
+        title = sanitize_filename(info.get('title') or 'video') if info else 'video'
 
         log_message(f"Title: {title}")
+        job.update(filename=title)
+
+        key = archive_key(info) if info else None
+        with job.trace.span('archive lookup'):
+            copies = download_archive.lookup(key, 'mp4' if mode == 'advanced' else fmt) if key else []
+            wanted = archive_wanted_height(info, fmt, quality, mode) if copies else None
+            copy = archive_match(copies, wanted)
+        if copy and not job.force:
+            at = f" at {copy['height']}p" if copy['height'] else ""
+            reason = f"Already downloaded{at}: {copy['path']}"
+            log_message(f"{reason} — skipping")
+            job.output_path = copy['path']
+            job.update(status="completed", percent=100, skipped=True, skip_reason=reason)
+            return
+        if copies and not job.force:
+            log_message(f"Archived copy is below {wanted}p ({copies[0]['height'] or 'unknown'}p); downloading again")
+
+        # Find out now, not at merge time an hour from now, whether the disk
+        # can hold the streams and the merged output next to the other jobs
+        if DISK_PREFLIGHT != 'off':
+            with job.trace.span('disk preflight') as span:
+                need = estimate_disk_need(info, fmt, quality, mode) if info else 0
+                problem = disk_space.claim(job, job.folder, need)
+                span['args'].update(need=need, ok=problem is None)
+            if problem and DISK_PREFLIGHT == 'refuse':
+                log_message(f"ERROR: {problem}")
+                metrics.inc('avd_errors_total', host=job.host, cause='disk_space')
+                job.update(status="error", error=problem)
+                return
+            if problem:
+                log_message(f"WARNING: {problem}")
 
         # ── Advanced (m3u8) mode ──────────────────────────────────────────────
         if mode == 'advanced':
-            output_path = os.path.join(DOWNLOAD_FOLDER, f'{title}.mp4')
-            success, error_msg = download_m3u8_advanced(url, output_path, quality)
+            output_path = job.output_path or os.path.join(job.folder, f'{title}.mp4')
+            job.output_path = output_path
+            success, error_msg = download_m3u8_advanced(job, url, output_path, quality, info)
+            job.check_cancelled()
             if success:
-                with download_lock:
-                    download_progress["status"] = "completed"
-                    download_progress["percent"] = 100
-                return jsonify({'status': 'ok', 'folder': DOWNLOAD_FOLDER})
+                archive_download(job, info, 'mp4')
+                job.update(status="completed", percent=100)
             else:
-                with download_lock:
-                    download_progress["status"] = "error"
-                return jsonify({'error': error_msg, 'folder': DOWNLOAD_FOLDER})
+                job.update(status="error", error=error_msg)
+            return
 
         # ── Standard yt-dlp mode ──────────────────────────────────────────────
-        output_template = os.path.join(DOWNLOAD_FOLDER, '%(title)s.%(ext)s')
+        output_template = os.path.join(job.folder, '%(title)s.%(ext)s')
 
         cmd = [
-            resource_path('yt-dlp.exe'),
+            find_tool('yt-dlp'),
             '--no-playlist',
+            '--continue',               # pick up .part files left by an interrupted run
             '--newline',
+            '--progress-template', 'download:' + YtdlpProgressParser.DOWNLOAD_TEMPLATE,
+            '--progress-template', 'postprocess:' + YtdlpProgressParser.POSTPROCESS_TEMPLATE,
             '-o', output_template,
-            '--ffmpeg-location', resource_path('ffmpeg.exe'),
-            '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            '--ffmpeg-location', find_tool('ffmpeg'),
+            '--user-agent', USER_AGENT,
             '--add-header', 'Accept:*/*',
             '--add-header', 'Accept-Language:en-US,en;q=0.9',
             '--no-check-certificate',
         ]
 
-        if fmt == 'mp3':
-            cmd += ['--extract-audio', '--audio-format', 'mp3', '--audio-quality', '0', url]
-            log_message("Format string: mp3 audio extraction")
-
-        elif fmt == 'mp4':
-            fstr = _build_format_string(quality, 'mp4')
-            cmd += ['-f', fstr, '--merge-output-format', 'mp4', url]
-            log_message(f"Format string: {fstr}")
-
-        else:  # webm
-            fstr = _build_format_string(quality, 'webm')
-            cmd += ['-f', fstr, '--merge-output-format', 'webm', url]
-            log_message(f"Format string: {fstr}")
+        with job.trace.span('format selection', format=fmt, quality=quality) as span:
+            if fmt == 'mp3':
+                cmd += ['--extract-audio', '--audio-format', 'mp3', '--audio-quality', '0']
+                log_message("Format string: mp3 audio extraction")
+
+            else:  # mp4 / webm
+                container = 'mp4' if fmt == 'mp4' else 'webm'
+                # With the info at hand the exact format IDs are picked here;
+                # without it yt-dlp gets a fallback chain to resolve itself
+                choice = format_policy.select(info, quality, container) if info else None
+                if choice:
+                    fstr = choice['selector']
+                    job.height = choice['height']
+                    log_message(
+                        f"Format selection: {fstr} ({choice['height']}p {choice['vcodec']}"
+                        f"+{choice['acodec'] or 'no audio'}, "
+                        f"{'' if choice['size_exact'] else '~'}{format_filesize(choice['filesize']) or '? size'}"
+                        f"{', merged into ' + choice['container'] if choice['container'] != container else ''})"
+                    )
+                    span['args'].update(choice)
+                    container = choice['container']
+                else:
+                    fstr = _build_format_string(quality, container)
+                    log_message(f"Format string: {fstr}")
+                    span['args']['selector'] = fstr
+                cmd += ['-f', fstr, '--merge-output-format', container]
+
+        if info:
+            info_path, info_is_temp = info_cache.info_file(url, info)
+            source = ['--load-info-json', info_path]
+        else:
+            source = [url]
 
-        log_message(f"ffmpeg path: {resource_path('ffmpeg.exe')}")
+        log_message(f"ffmpeg path: {find_tool('ffmpeg')}")
         log_message(f"yt-dlp cmd: {' '.join(cmd[:12])}…")
 
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
-            creationflags=subprocess.CREATE_NO_WINDOW,
-            bufsize=1, universal_newlines=True
-        )
-
-        with download_lock:
-            download_progress["status"] = "downloading"
-            download_progress["stage"] = "video"
-
-        # Track which stream we're on so we can map to a unified 0-100% bar.
-        # Phases: video dl (0–75%), audio dl (75–92%), merging (92–100%)
-        # If only one stream (muxed / audio-only), it maps 0–100% directly.
-        stream_index   = 0   # 0 = video/only, 1 = audio
-        last_dest_line = ''
-
-        for line in iter(process.stdout.readline, ''):
-            line = line.strip()
-            if line:
-                log_message(f"  {line}")
-
-            # Detect when yt-dlp switches to downloading the second stream
-            if '[download] Destination:' in line:
-                if last_dest_line:          # second Destination = audio stream
-                    stream_index = 1
-                    with download_lock:
-                        download_progress["stage"]     = "audio"
-                        download_progress["speed"]     = "—"
-                        download_progress["eta"]       = "—"
-                        download_progress["downloaded"] = "—"
-                        download_progress["total"]     = "—"
-                last_dest_line = line
-
-            # Merging / ffmpeg encode phase
-            if '[Merger]' in line or 'Merging formats' in line or 'ffmpeg' in line.lower() and 'merging' in line.lower():
-                with download_lock:
-                    download_progress["stage"]   = "merging"
-                    download_progress["percent"] = 93
-                    download_progress["speed"]   = "—"
-                    download_progress["eta"]     = "—"
-
-            if '[download]' in line and '%' in line:
-                pct  = re.search(r'(\d+\.?\d*)%', line)
-                size = re.search(r'(\d+\.?\d*\s*[KMGTiB]+)\s+of\s+~?\s*(\d+\.?\d*\s*[KMGTiB]+)', line)
-                spd  = re.search(r'at\s+(\S+/s)', line)
-                eta  = re.search(r'ETA\s+(\d{2}:\d{2})', line)
-
-                if pct:
-                    raw = float(pct.group(1))
-                    # Map raw 0-100 into the unified bar range for each phase
-                    if stream_index == 0:
-                        unified = int(raw * 0.75)          # video:  0 → 75
-                    else:
-                        unified = int(75 + raw * 0.17)     # audio: 75 → 92
-
-                    with download_lock:
-                        download_progress["percent"] = unified
-                        if size:
-                            download_progress["downloaded"] = size.group(1).strip()
-                            download_progress["total"]      = size.group(2).strip()
-                        if spd:  download_progress["speed"] = spd.group(1)
-                        if eta:  download_progress["eta"]   = eta.group(1)
-
-        process.wait()
+        # yt-dlp can't be throttled from here once it runs, so it gets a
+        # --limit-rate share of the global limit. When the share changes
+        # (other downloads start or finish, the limit or its time window
+        # changes) yt-dlp is stopped and run again with --continue at the
+        # new rate; during post-processing it needs no share at all.
+        rate = bandwidth.claim(job.id, job.cancel_event)
+
+        job.update(status="downloading", stage="video")
+
+        parser = YtdlpProgressParser()
+        stream_span = pp_span = None
+
+        while True:
+            if rate:
+                log_message(f"Rate limit: {format_speed(rate)}")
+            # Its own session, so a cancel can kill yt-dlp together with its ffmpeg
+            process = subprocess.Popen(
+                cmd + (['--limit-rate', str(rate)] if rate else []) + source,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                creationflags=NO_WINDOW,
+                bufsize=1, universal_newlines=True, start_new_session=True
+            )
+            job.attach(process)
+            spawned = time.monotonic()
+            rebalance = False
+            checked = spawned
+
+            for line in iter(process.stdout.readline, ''):
+                if spawned:
+                    metrics.observe('avd_process_first_output_seconds', time.monotonic() - spawned, tool='yt-dlp')
+                    spawned = None
+                line = line.strip()
+                if not line:
+                    continue
+                is_progress = line.startswith(YtdlpProgressParser.PREFIX)
+                log_message(f"  {line}", sample_key=job.id if is_progress else None)
+
+                if line.startswith(('[download] Destination: ', '[ExtractAudio] Destination: ')):
+                    job.output_path = line.split('Destination: ', 1)[1]
+                    job.partials.add(job.output_path)
+                elif line.startswith('[Merger] Merging formats into "'):
+                    job.output_path = line[len('[Merger] Merging formats into "'):].rstrip('"')
+                    job.partials.add(job.output_path)
+                elif line.startswith('[download] ') and line.endswith(' has already been downloaded'):
+                    job.output_path = line[len('[download] '):-len(' has already been downloaded')]
+
+                if line.startswith(YtdlpProgressParser.PP_PREFIX):
+                    status, _, name = line[len(YtdlpProgressParser.PP_PREFIX):].partition(' ')
+                    if status == 'started':
+                        job.trace.end(stream_span, bytes=job.metered)
+                        stream_span = None
+                        pp_span = job.trace.begin(name, 'stream')
+                        bandwidth.release(job.id)   # merging and converting use no network
+                    elif status == 'finished':
+                        job.trace.end(pp_span)
+                        pp_span = None
+
+                fields = parser.feed(line)
+                if fields:
+                    if fields.get('stage') in ('video', 'audio'):   # yt-dlp moved on to another stream
+                        job.trace.end(stream_span, bytes=job.metered)
+                        stream_span = job.trace.begin(f"stream {parser.last[0]}", 'stream',
+                                                      format_id=parser.last[0], kind=fields['stage'])
+                    # Counted after the update so a new stream's bytes land in its own stage
+                    job.update(**fields)
+                    if 'downloaded_bytes' in fields:
+                        job.count_bytes(fields['downloaded_bytes'])
+
+                    # Checked on download progress only, never in the middle of a merge
+                    now = time.monotonic()
+                    if is_progress and now - checked >= BANDWIDTH_RECHECK:
+                        checked = now
+                        if bandwidth.rebalance_due(job.id):
+                            rebalance = True
+                            kill_process_tree(process)
+                            break
+
+            process.wait()
+            process.stdout.close()
+            job.detach(process)
+            job.check_cancelled()
+            if not rebalance:
+                break
+            log_message("Bandwidth share changed; restarting yt-dlp with --continue")
+            rate = bandwidth.claim(job.id, job.cancel_event)
+
+        job.trace.end(stream_span, bytes=job.metered)
+        job.trace.end(pp_span)
+        job.check_cancelled()
 
         if process.returncode == 0:
-            log_message("Download completed successfully.")
-            with download_lock:
-                download_progress["status"] = "completed"
-                download_progress["percent"] = 100
-            return jsonify({'status': 'ok', 'folder': DOWNLOAD_FOLDER})
+            log_message(f"Download [{job.id}] completed successfully.")
+            archive_download(job, info, fmt)
+            job.update(status="completed", percent=100)
         else:
             log_message(f"yt-dlp exited with code {process.returncode}")
-            with download_lock:
-                download_progress["status"] = "error"
-            return jsonify({
-                'error': 'Download failed. Check the log for details. Try enabling Advanced mode for streaming sites.',
-                'folder': DOWNLOAD_FOLDER
-            })
+            metrics.inc('avd_errors_total', host=job.host, cause='ytdlp')
+            job.update(
+                status="error",
+                error='Download failed. Check the log for details. Try enabling Advanced mode for streaming sites.'
+            )
+
+    except DownloadCancelled:
+        log_message(f"Download [{job.id}] cancelled")
 
     except Exception as e:
         log_message(f"Download exception: {str(e)}")
-        with download_lock:
-            download_progress["status"] = "error"
-            download_progress["error"] = str(e)
-        return jsonify({'error': str(e), 'folder': DOWNLOAD_FOLDER})
+        metrics.inc('avd_errors_total', host=job.host, cause='exception')
+        job.update(status="error", error=str(e))
+
+    finally:
+        if info_is_temp:
+            try:
+                os.remove(info_path)
+            except OSError:
+                pass
+
+
+def archive_download(job, info, fmt):
+    """Add a finished job's file to the download archive."""
+    key = archive_key(info) if info else None
+    if key and job.output_path and os.path.exists(job.output_path):
+        height = None
+        if fmt != 'mp3':
+            height = job.height
+            if not height:
+                probed = probe_stream(job.output_path, 'v:0', 'height')
+                height = int(probed) if probed and probed.isdigit() else None
+        download_archive.record(key, fmt, job.url, info.get('title'), job.output_path, height)
+
+
+def archive_wanted_height(info, fmt, quality, mode):
+    """
+    Video height a download of `quality` would get, as far as `info` tells:
+    0 for audio, None when it can't be told (any archived copy will do).
+    """
+    if fmt == 'mp3':
+        return 0
+    if info and mode != 'advanced':
+        choice = format_policy.select(info, quality, 'mp4' if fmt == 'mp4' else 'webm')
+        if choice and choice['height']:
+            return choice['height']
+    cap = _quality_height(quality)
+    heights = [f['height'] for f in (info or {}).get('formats') or []
+               if f.get('height') and (not cap or f['height'] <= cap)]
+    return max(heights) if heights else cap
+
+
+def archive_match(copies, wanted):
+    """The first archived copy at least `wanted` pixels high (see above), or None."""
+    for copy in copies:
+        if not wanted or (copy['height'] or 0) >= wanted:
+            return copy
+    return None
 
 
 def _build_format_string(quality: str, container: str) -> str:
@@ -1672,41 +5758,381 @@ def _build_format_string(quality: str, container: str) -> str:
     return quality
 
 
+@app.route('/bandwidth', methods=['GET', 'POST'])
+def bandwidth_settings():
+    """
+    Read or change the global bandwidth limit. POST {"limit": bytes/s,
+    "start": "HH:MM", "end": "HH:MM"}; start/end are optional and confine
+    the limit to that time window. Running downloads follow within a few
+    seconds: HLS streams at once, yt-dlp by restarting at its new share.
+    """
+    if request.method == 'POST':
+        data = request.json or {}
+        try:
+            bandwidth.configure(data.get('limit', 0), data.get('start', ''), data.get('end', ''))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid limit or time (use bytes per second and HH:MM)'}), 400
+        settings = bandwidth.settings()
+        with open(BANDWIDTH_FILE, 'w', encoding='utf-8') as f:
+            json.dump({k: settings[k] for k in ('limit', 'start', 'end')}, f)
+        log_message(
+            f"Bandwidth limit set to {format_speed(settings['limit']) if settings['limit'] else 'unlimited'}"
+            + (f" between {settings['start']} and {settings['end']}" if settings['start'] and settings['end'] else "")
+        )
+    return jsonify(bandwidth.settings())
+
+@app.route('/format_policy', methods=['GET', 'POST'])
+def format_policy_settings():
+    """
+    Read or change how formats are picked. POST {"codecs": ["avc1", "vp9"],
+    "max_bitrate": kbit/s, "max_filesize": bytes}; caps of 0 are off.
+    Applies to downloads that start afterwards.
+    """
+    if request.method == 'POST':
+        data = request.json or {}
+        try:
+            format_policy.configure(data.get('codecs', FORMAT_CODEC_ORDER),
+                                    data.get('max_bitrate', 0), data.get('max_filesize', 0))
+        except (TypeError, ValueError, AttributeError):
+            return jsonify({'error': 'Invalid policy (codecs is a list, caps are whole numbers)'}), 400
+        settings = format_policy.settings()
+        with open(FORMAT_POLICY_FILE, 'w', encoding='utf-8') as f:
+            json.dump(settings, f)
+        log_message(
+            f"Format policy: codecs {', '.join(settings['codecs']) or 'any'}"
+            + (f", max {settings['max_bitrate']} kbit/s" if settings['max_bitrate'] else "")
+            + (f", max {format_filesize(settings['max_filesize'])}" if settings['max_filesize'] else "")
+        )
+    return jsonify(format_policy.settings())
+
+def disk_warning(url, fmt, quality, mode, folder, exclude=None):
+    """
+    What the disk preflight would say about downloading `url` into `folder`
+    behind the running and queued jobs, or None. Jobs whose info isn't
+    cached count as size unknown.
+    """
+    if DISK_PREFLIGHT == 'off':
+        return None
+    info = info_cache.get(url)
+    need = estimate_disk_need(info, fmt, quality, mode) if info else 0
+    device = _device(folder)
+    pending = disk_space.outstanding(folder)
+    for job in job_manager.queued():
+        queued_info = info_cache.get(job.url) if job is not exclude and _device(job.folder) == device else None
+        if queued_info:
+            pending += estimate_disk_need(queued_info, job.format, job.quality, job.mode)
+    return disk_space.check(folder, need, pending)
+
+@app.route('/format_plan', methods=['POST'])
+def format_plan():
+    """
+    The exact formats (and final size) a download of a previewed URL would
+    fetch: POST {"url", "format", "quality", "mode"}. Only the cached info
+    is used; {"plan": null} means yt-dlp would choose at download time.
+    A plan whose "container" differs from the format asked for has no
+    streams that format can hold and would be saved as MKV.
+    "disk" is the disk-space warning the download would get, if any.
+    """
+    data = request.json or {}
+    url = (data.get('url') or '').strip()
+    fmt = data.get('format', 'mp4')
+    quality = data.get('quality', 'best')
+    info = info_cache.get(url) if url else None
+    if info is None:
+        return jsonify({'plan': None, 'disk': None})
+    plan = None
+    if fmt != 'mp3':
+        plan = format_policy.select(info, quality, 'mp4' if fmt == 'mp4' else 'webm')
+    if plan:
+        plan['size'] = format_filesize(plan['filesize'])
+    disk = disk_warning(url, fmt, quality, data.get('mode', 'standard'), DOWNLOAD_FOLDER)
+    return jsonify({'plan': plan, 'disk': disk})
+
+@app.route('/archive/rebuild', methods=['POST'])
+def rebuild_archive():
+    """Rebuild the download archive from the manifests under DOWNLOAD_FOLDER."""
+    try:
+        return jsonify({'entries': download_archive.rebuild(DOWNLOAD_FOLDER), 'folder': DOWNLOAD_FOLDER})
+    except (OSError, sqlite3.Error) as e:
+        log_message(f"Archive rebuild failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/progress', methods=['GET'])
 def progress():
-    with download_lock:
-        return jsonify(download_progress)
+    # Kept for older front ends: reports the most recently queued job
+    job = job_manager.latest()
+    return jsonify(job.snapshot() if job else IDLE_PROGRESS)
+
+@app.route('/progress/stream/<job_id>', methods=['GET'])
+def progress_stream(job_id):
+    """
+    Server-Sent Events feed of one job's progress. The first event carries the
+    full snapshot; later events carry only the fields that changed, at most
+    one every PROGRESS_STREAM_INTERVAL seconds so line bursts are coalesced.
+    """
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+
+    def events():
+        version, sent = job.version, job.snapshot()
+        yield f"id: {version}\ndata: {json.dumps(sent)}\n\n"
+        while sent.get('status') not in FINISHED_STATUSES:
+            last_sent = time.monotonic()
+            new_version, current = job.wait_for_change(version, PROGRESS_STREAM_KEEPALIVE)
+            if new_version == version:
+                yield ": keep-alive\n\n"
+                continue
+            # Let the burst of updates that woke us settle into one event
+            delay = PROGRESS_STREAM_INTERVAL - (time.monotonic() - last_sent)
+            if delay > 0 and current.get('status') not in FINISHED_STATUSES:
+                time.sleep(delay)
+                new_version, current = job.wait_for_change(new_version, 0)
+            patch = {k: v for k, v in current.items() if sent.get(k) != v}
+            version = new_version
+            sent.update(patch)
+            if patch:
+                yield f"id: {version}\ndata: {json.dumps(patch)}\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+def group_progress(jobs):
+    """Aggregate progress of the items of one playlist download."""
+    snaps = [job.snapshot() for job in jobs]
+    total = len(snaps)
+    done = sum(1 for p in snaps if p['status'] == 'completed')
+    failed = sum(1 for p in snaps if p['status'] == 'error')
+    cancelled = sum(1 for p in snaps if p['status'] == 'cancelled')
+    running = [p for p in snaps if p['status'] not in ('queued',) + FINISHED_STATUSES]
+    speed = sum(p.get('speed_bps') or 0 for p in running)
+    percent = sum(100 if p['status'] in FINISHED_STATUSES else min(100, p.get('percent') or 0)
+                  for p in snaps) // max(1, total)
+    return {
+        'status':     'completed' if done + failed + cancelled == total else 'downloading',
+        'total':      total,
+        'completed':  done,
+        'failed':     failed,
+        'cancelled':  cancelled,
+        'active':     len(running),
+        'queued':     total - done - failed - cancelled - len(running),
+        'percent':    percent,
+        'downloaded_bytes': sum(p.get('downloaded_bytes') or 0 for p in snaps),
+        'speed_bps':  speed,
+        'speed':      format_speed(speed) if running else '—',
+        'current':    [p.get('filename') or p['url'] for p in running],
+        'failures':   [{'url': p['url'], 'error': p.get('error', '')}
+                       for p in snaps if p['status'] == 'error'],
+    }
+
+@app.route('/playlist/progress/<group_id>', methods=['GET'])
+def playlist_progress(group_id):
+    """
+    Server-Sent Events feed of a playlist download's aggregate progress,
+    sent whenever it changes and at most every PROGRESS_STREAM_INTERVAL.
+    """
+    jobs = job_manager.group(group_id)
+    if not jobs:
+        return jsonify({'error': 'Unknown playlist download'}), 404
+
+    def events():
+        sent, quiet = None, 0.0
+        while True:
+            current = group_progress(jobs)
+            if current != sent:
+                sent, quiet = current, 0.0
+                yield f"data: {json.dumps(current)}\n\n"
+                if current['status'] == 'completed':
+                    return
+            elif quiet >= PROGRESS_STREAM_KEEPALIVE:
+                quiet = 0.0
+                yield ": keep-alive\n\n"
+            time.sleep(PROGRESS_STREAM_INTERVAL)
+            quiet += PROGRESS_STREAM_INTERVAL
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({'jobs': job_manager.list()})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.snapshot())
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """
+    Stop a job: a queued one never starts, a running one has its yt-dlp/
+    ffmpeg processes killed. Partial files are deleted unless keep_partial
+    is set, in which case /jobs/<id>/retry continues where it stopped.
+    """
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    data = request.get_json(silent=True) or {}
+    keep = data.get('keep_partial', request.args.get('keep_partial', False))
+    keep = str(keep).lower() in ('1', 'true', 'yes', 'on')
+    if not job_manager.cancel(job, keep_partial=keep):
+        return jsonify({'error': 'Job already finished', 'job': job.snapshot()}), 409
+    return jsonify(job.snapshot())
+
+@app.route('/jobs/<job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    if not job_manager.retry(job):
+        return jsonify({'error': 'Only cancelled or failed jobs can be retried', 'job': job.snapshot()}), 409
+    return jsonify(job.snapshot())
+
+@app.route('/playlist/cancel/<group_id>', methods=['POST'])
+def cancel_playlist(group_id):
+    """Cancel every unfinished item of a playlist download."""
+    jobs = job_manager.group(group_id)
+    if not jobs:
+        return jsonify({'error': 'Unknown playlist download'}), 404
+    cancelled = [job.id for job in jobs if job_manager.cancel(job)]
+    return jsonify({'cancelled': cancelled, 'progress': group_progress(jobs)})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Counters, histograms and gauges in the Prometheus text format."""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/jobs/trace', methods=['GET'])
+def all_job_traces():
+    """Every known job in one Chrome trace-event file, one process per job."""
+    with job_manager.lock:
+        jobs = [job_manager.jobs[j] for j in job_manager.order]
+    events = []
+    for pid, job in enumerate(jobs, 1):
+        label = f"{job.progress.get('filename') or job.url} [{job.id}]"
+        events += job.trace.chrome_events(pid=pid, label=label)
+    resp = jsonify({'traceEvents': events, 'displayTimeUnit': 'ms'})
+    resp.headers['Content-Disposition'] = 'attachment; filename=trace-jobs.json'
+    return resp
+
+@app.route('/jobs/<job_id>/trace', methods=['GET'])
+def job_trace(job_id):
+    """
+    The job's timeline as a list of spans, or with ?format=chrome as a
+    Chrome trace-event file for chrome://tracing or ui.perfetto.dev.
+    """
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    if request.args.get('format') == 'chrome':
+        label = f"{job.progress.get('filename') or job.url} [{job.id}]"
+        resp = jsonify({'traceEvents': job.trace.chrome_events(label=label), 'displayTimeUnit': 'ms'})
+        resp.headers['Content-Disposition'] = f'attachment; filename=trace-{job.id}.json'
+        return resp
+    return jsonify({'id': job.id, 'url': job.url, 'status': job.progress['status'],
+                    'spans': job.trace.export()})
 
 @app.route('/get_log', methods=['GET'])
 def get_log():
+    """
+    Page through the log without reading all of it.
+
+    Query parameters:
+      before=<byte offset>  lines ending before this offset (default: the end)
+      after=<byte offset>   lines written since this offset (for live refresh)
+      limit=<n>             maximum lines returned (default 200)
+      level=info|warning|error   minimum level
+      job=<job id>          only lines tagged with this job
+
+    Returns {lines, start, end, size, more}; pass `start` back as `before`
+    to load older lines and `end` back as `after` to load newer ones.
+    """
     try:
-        if os.path.exists(LOG_FILE):
-            with open(LOG_FILE, 'r', encoding='utf-8') as f:
-                content = f.read()
-            return jsonify({'log': content})
-        return jsonify({'log': ''})
+        if not os.path.exists(LOG_FILE):
+            return jsonify({'lines': [], 'start': 0, 'end': 0, 'size': 0, 'more': False})
+
+        limit = max(1, min(int(request.args.get('limit', LOG_PAGE_LINES)), 5000))
+        match = log_line_filter(request.args.get('level'), request.args.get('job'))
+        before = request.args.get('before', type=int)
+        after = request.args.get('after', type=int)
+
+        if after is not None and after <= os.path.getsize(LOG_FILE):
+            lines, end, size = read_log_after(LOG_FILE, after, limit, match)
+            return jsonify({'lines': lines, 'start': after, 'end': end, 'size': size,
+                            'more': end < size})
+
+        # No offset, or the log was rotated/cleared under the client: the tail
+        lines, start, size = read_log_before(LOG_FILE, before, limit, match)
+        end = size if before is None else min(before, size)
+        return jsonify({'lines': lines, 'start': start, 'end': end, 'size': size,
+                        'more': start > 0, 'reset': after is not None})
     except Exception as e:
-        return jsonify({'log': f'Error reading log: {str(e)}'})
+        return jsonify({'lines': [f'Error reading log: {str(e)}'], 'start': 0, 'end': 0,
+                        'size': 0, 'more': False})
 
 @app.route('/clear_log', methods=['POST'])
 def clear_log():
     try:
-        with open(LOG_FILE, 'w', encoding='utf-8') as f:
-            f.write('')
+        log_writer.clear()
         log_message("Log cleared.")
         return jsonify({'status': 'ok'})
     except Exception as e:
         return jsonify({'error': str(e)})
 
-def start_flask():
-    app.run(port=5000, debug=False, use_reloader=False, threaded=True)
+def start_flask(host=SERVER_HOST, port=SERVER_PORT, threads=SERVER_THREADS):
+    if serve is None:
+        log_message("waitress is not installed; using the Flask development server")
+        app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
+    else:
+        # Every open progress stream holds one of these threads
+        serve(app, host=host, port=port, threads=threads, ident='AnyVideoDownloader')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Any Video Downloader")
+    parser.add_argument('--headless', action='store_true',
+                        help="serve the web UI without opening a window")
+    parser.add_argument('--host', default=SERVER_HOST,
+                        help=f"address to listen on (default {SERVER_HOST}, $AVD_HOST)")
+    parser.add_argument('--port', type=int, default=SERVER_PORT,
+                        help=f"port to listen on (default {SERVER_PORT}, $AVD_PORT)")
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS,
+                        help=f"web server threads (default {SERVER_THREADS}, $AVD_SERVER_THREADS)")
+    parser.add_argument('--workers', type=int, default=MAX_CONCURRENT_DOWNLOADS,
+                        help=f"downloads running at once (default {MAX_CONCURRENT_DOWNLOADS}, $AVD_MAX_WORKERS)")
+    return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    log_message("=== Application Started ===")
-    threading.Thread(target=start_flask, daemon=True).start()
+    args = parse_args()
+    if not args.headless and webview is None:
+        print("pywebview is not installed; running headless", file=sys.stderr)
+        args.headless = True
+    HEADLESS = args.headless
+    job_manager.max_workers = max(1, args.workers)
+
+    log_message("=== Application Started ===" + (" (headless)" if HEADLESS else ""))
+    log_message(f"yt-dlp: {find_tool('yt-dlp')}, ffmpeg: {find_tool('ffmpeg')}")
+    extractor_pool.start()
+    if download_archive.created:
+        threading.Thread(target=download_archive.rebuild, args=(DOWNLOAD_FOLDER,), daemon=True).start()
+    job_manager.journal = JobJournal(JOURNAL_FILE)
+    job_manager.resume_unfinished()
+    job_manager.start()
+
+    if HEADLESS:
+        log_message(f"Serving on http://{args.host}:{args.port}")
+        start_flask(args.host, args.port, args.threads)
+        sys.exit(0)
+
+    threading.Thread(target=start_flask, args=(args.host, args.port, args.threads), daemon=True).start()
     webview.create_window(
         "Any Video Downloader",
-        "http://127.0.0.1:5000",
+        f"http://{'127.0.0.1' if args.host in ('0.0.0.0', '::', '') else args.host}:{args.port}",
         width=500,
         height=800,
         resizable=True,
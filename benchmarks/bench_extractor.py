@@ -0,0 +1,100 @@
+"""
+Per-request extraction latency: one-off yt-dlp process vs. warm extractor pool.
+
+Runs entirely offline against the stub yt_dlp package in benchmarks/stubs,
+which simulates the extractor import cost and per-request network time:
+
+    python benchmarks/bench_extractor.py --requests 20
+    STUB_IMPORT_DELAY=0.8 python benchmarks/bench_extractor.py
+
+The "before" numbers spawn `python -m yt_dlp --dump-json` per request, the
+way app.py did with yt-dlp.exe; "after" sends the same requests to an
+ExtractorPool started from app.py.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+STUBS = os.path.join(HERE, 'stubs')
+
+# Both the one-off processes and the warm workers must import the stub
+os.environ['PYTHONPATH'] = os.pathsep.join(
+    p for p in (STUBS, os.environ.get('PYTHONPATH')) if p
+)
+sys.path[:0] = [STUBS, ROOT]
+
+
+def summarise(samples):
+    samples = sorted(samples)
+    return {
+        'requests': len(samples),
+        'mean_ms': round(statistics.mean(samples) * 1000, 1),
+        'p50_ms': round(samples[len(samples) // 2] * 1000, 1),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1),
+    }
+
+
+def bench_spawn(urls):
+    samples = []
+    for url in urls:
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-m', 'yt_dlp', '--dump-json', '--no-playlist', url],
+            capture_output=True, text=True, check=True
+        )
+        json.loads(result.stdout)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_pool(urls, workers):
+    import app
+
+    pool = app.ExtractorPool(workers)
+    pool.enabled = True
+    start = time.perf_counter()
+    pool.start()
+    pool.call({'op': 'ping'})       # wait until the worker has imported yt_dlp
+    warmup = time.perf_counter() - start
+
+    samples = []
+    for url in urls:
+        start = time.perf_counter()
+        pool.extract(url)
+        samples.append(time.perf_counter() - start)
+
+    while not pool.idle.empty():
+        pool.idle.get_nowait().stop()
+    return samples, warmup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    urls = [f'https://example.com/watch?v=bench{i}' for i in range(args.requests)]
+    before = summarise(bench_spawn(urls))
+    samples, warmup = bench_pool(urls, args.workers)
+    after = summarise(samples)
+    after['warmup_ms'] = round(warmup * 1000, 1)
+
+    print(json.dumps({
+        'benchmark': 'extractor',
+        'import_delay_s': float(os.environ.get('STUB_IMPORT_DELAY', '0.4')),
+        'extract_delay_s': float(os.environ.get('STUB_EXTRACT_DELAY', '0.05')),
+        'spawn_per_request': before,
+        'warm_pool': after,
+        'speedup_mean': round(before['mean_ms'] / after['mean_ms'], 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Cost per line of yt-dlp progress parsing: the old regex scraper vs.
+YtdlpProgressParser reading --progress-template output.
+
+Both parsers are fed a synthetic recording of the same download (a
+video stream followed by an audio stream, with the usual non-progress
+chatter in between), in the output format each of them expects:
+
+    python benchmarks/bench_progress_parser.py --lines 20000
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, 'stubs'), os.path.dirname(HERE)]
+
+
+def _streams(lines):
+    video = int(lines * 0.8)
+    return [('137', 'avc1.640028', 'none', 250_000_000, video),
+            ('140', 'none', 'mp4a.40.2', 8_000_000, lines - video)]
+
+
+def record_legacy(lines):
+    out = []
+    for fid, _v, _a, total, n in _streams(lines):
+        out.append(f'[download] Destination: Video.f{fid}.mp4')
+        for i in range(n):
+            done = total * (i + 1) / n
+            out.append(f'[download]  {done * 100 / total:5.1f}% of {total / 1048576:.2f}MiB '
+                       f'at  {3.2 + i % 7 * 0.1:.2f}MiB/s ETA {(n - i) // 60:02d}:{(n - i) % 60:02d}')
+    out.append('[Merger] Merging formats into "Video.mp4"')
+    return out
+
+
+def record_template(lines):
+    out = []
+    for fid, vcodec, acodec, total, n in _streams(lines):
+        out.append(f'[download] Destination: Video.f{fid}.mp4')
+        for i in range(n):
+            done = total * (i + 1) // n
+            status = 'finished' if i == n - 1 else 'downloading'
+            out.append(f'[avd] {fid} {vcodec} {acodec} {status} {done} {total} NA '
+                       f'{3_300_000.0 + i % 7 * 100_000} {n - i} NA NA')
+    out.append('[avd-pp] started Merger')
+    return out
+
+
+def legacy_parse(lines):
+    """The read loop app.py used before --progress-template."""
+    stream_index = 0
+    last_dest_line = ''
+    state = {}
+    for line in lines:
+        if '[download] Destination:' in line:
+            if last_dest_line:
+                stream_index = 1
+                state.update(stage='audio', speed='—', eta='—', downloaded='—', total='—')
+            last_dest_line = line
+        if '[Merger]' in line or 'Merging formats' in line or 'ffmpeg' in line.lower() and 'merging' in line.lower():
+            state.update(stage='merging', percent=93, speed='—', eta='—')
+        if '[download]' in line and '%' in line:
+            pct = re.search(r'(\d+\.?\d*)%', line)
+            size = re.search(r'(\d+\.?\d*\s*[KMGTiB]+)\s+of\s+~?\s*(\d+\.?\d*\s*[KMGTiB]+)', line)
+            spd = re.search(r'at\s+(\S+/s)', line)
+            eta = re.search(r'ETA\s+(\d{2}:\d{2})', line)
+            if pct:
+                raw = float(pct.group(1))
+                unified = int(raw * 0.75) if stream_index == 0 else int(75 + raw * 0.17)
+                state['percent'] = unified
+                if size:
+                    state['downloaded'] = size.group(1).strip()
+                    state['total'] = size.group(2).strip()
+                if spd:
+                    state['speed'] = spd.group(1)
+                if eta:
+                    state['eta'] = eta.group(1)
+    return state
+
+
+def template_parse(lines):
+    from app import YtdlpProgressParser
+
+    parser = YtdlpProgressParser()
+    state = {}
+    for line in lines:
+        fields = parser.feed(line)
+        if fields:
+            state.update(fields)
+    return state
+
+
+def measure(parse, lines, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        state = parse(lines)
+        best = min(best, time.perf_counter() - start)
+    return best, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--lines', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    legacy_lines = record_legacy(args.lines)
+    template_lines = record_template(args.lines)
+    legacy_time, legacy_state = measure(legacy_parse, legacy_lines, args.repeat)
+    template_time, template_state = measure(template_parse, template_lines, args.repeat)
+
+    print(json.dumps({
+        'benchmark': 'progress_parser',
+        'lines': args.lines,
+        'legacy_regex': {
+            'us_per_line': round(legacy_time / len(legacy_lines) * 1e6, 2),
+            'final_state': legacy_state,
+        },
+        'progress_template': {
+            'us_per_line': round(template_time / len(template_lines) * 1e6, 2),
+            'final_state': template_state,
+        },
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+Offline end-to-end benchmarks of app.py, printed as one JSON document.
+
+The app runs in-process against the stub yt-dlp/ffmpeg executables in
+benchmarks/stubs/bin (POSIX only: they are scripts) and a local media
+server (benchmarks/media_server.py), so no network or real binaries are
+involved:
+
+    python benchmarks/bench_suite.py
+    python benchmarks/bench_suite.py --scenarios download,scaling --bandwidth 8000000
+    python benchmarks/bench_suite.py --output new.json --baseline old.json
+
+Scenarios:
+    preview     /preview latency via the warm extractor pool, a one-off
+                yt-dlp process and the info cache
+    download    /download end to end in standard and advanced (HLS) mode,
+                with the time spent in each stage
+    progress    progress-parse cost per line (see bench_progress_parser.py)
+    scaling     aggregate throughput of 1, 2, 4, ... jobs running at once
+
+With --baseline, every number also present in an earlier result file is
+listed under "comparison" with its change in percent.
+"""
+import argparse
+import atexit
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+STUBS = os.path.join(HERE, 'stubs')
+BIN = os.path.join(STUBS, 'bin')
+SCENARIOS = ('preview', 'download', 'progress', 'scaling')
+
+sys.path[:0] = [HERE, STUBS, ROOT]
+
+from bench_extractor import summarise                     # noqa: E402
+from media_server import start_media_server               # noqa: E402
+
+
+def configure_environment(args, media_url):
+    """Settings read by app.py at import and by the stubs in every child process."""
+    os.environ.update({
+        'PYTHONPATH': os.pathsep.join(p for p in (STUBS, os.environ.get('PYTHONPATH')) if p),
+        'AVD_YTDLP': os.path.join(BIN, 'yt-dlp'),
+        'AVD_FFMPEG': os.path.join(BIN, 'ffmpeg'),
+        'AVD_MAX_WORKERS': str(args.max_jobs),
+        'AVD_HOST_MAX_WORKERS': str(args.max_jobs),
+        'AVD_HOST_SPACING': '0',
+        'STUB_MEDIA_URL': media_url,
+        'STUB_IMPORT_DELAY': str(args.import_delay),
+        'STUB_EXTRACT_DELAY': str(args.extract_delay),
+        'STUB_VIDEO_BYTES': str(int(args.video_mb * 1024 * 1024)),
+        'STUB_AUDIO_BYTES': str(int(args.audio_mb * 1024 * 1024)),
+        'STUB_HLS_SEGMENTS': str(args.hls_segments),
+    })
+
+
+class Bench:
+    """The app under test plus a source of never-seen video URLs."""
+
+    def __init__(self, app, media):
+        self.app = app
+        self.media = media
+        self.client = app.app.test_client()
+        self.serial = 0
+
+    def new_url(self):
+        self.serial += 1
+        return f'https://bench.example/watch?v=b{os.getpid()}x{self.serial}'
+
+    def preview(self, url):
+        start = time.perf_counter()
+        data = self.client.post('/preview', json={'url': url}).get_json()
+        if data.get('error'):
+            raise RuntimeError(data['error'])
+        return time.perf_counter() - start
+
+    def submit(self, mode):
+        data = self.client.post('/download', json={
+            'url': self.new_url(), 'format': 'mp4', 'quality': 'best', 'mode': mode,
+        }).get_json()
+        return self.app.job_manager.get(data['job_id'])
+
+    @staticmethod
+    def wait(jobs, timeout):
+        deadline = time.monotonic() + timeout
+        while not all(job.finished for job in jobs):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'jobs still running after {timeout}s')
+            time.sleep(0.01)
+
+
+def job_bytes(job):
+    return os.path.getsize(job.output_path) if job.output_path and os.path.exists(job.output_path) else 0
+
+
+def stage_times(job):
+    times = {}
+    for span in job.trace.export():
+        if span['cat'] == 'stage':
+            times[span['name']] = round(times.get(span['name'], 0) + span['duration'], 4)
+    return times
+
+
+def bench_preview(bench, args):
+    pool = bench.app.extractor_pool
+    warm = summarise([bench.preview(bench.new_url()) for _ in range(args.requests)])
+
+    pool.started = False        # extract_info() falls back to a one-off yt-dlp process
+    try:
+        spawn = summarise([bench.preview(bench.new_url()) for _ in range(args.requests)])
+    finally:
+        pool.started = True
+
+    url = bench.new_url()
+    bench.preview(url)
+    cached = summarise([bench.preview(url) for _ in range(args.requests)])
+    return {'warm_pool': warm, 'one_off_process': spawn, 'info_cache': cached}
+
+
+def bench_download(bench, args):
+    results = {}
+    for mode in ('standard', 'advanced'):
+        runs = []
+        for _ in range(args.repeat):
+            bench.media.reset_stats()
+            start = time.perf_counter()
+            job = bench.submit(mode)
+            bench.wait([job], args.timeout)
+            elapsed = time.perf_counter() - start
+            size = job_bytes(job)
+            runs.append({
+                'status': job.progress['status'],
+                'seconds': round(elapsed, 3),
+                'bytes': size,
+                'mb_per_s': round(size / elapsed / 1024 ** 2, 2),
+                'stages_s': stage_times(job),
+                'server': bench.media.reset_stats(),
+            })
+        median = sorted(runs, key=lambda r: r['seconds'])[len(runs) // 2]
+        results[mode] = dict(median, runs=len(runs),
+                             failed=sum(1 for r in runs if r['status'] != 'completed'))
+    return results
+
+
+def bench_progress(bench, args):
+    import bench_progress_parser as parser_bench
+
+    lines = parser_bench.record_template(args.lines)
+    seconds, _ = parser_bench.measure(parser_bench.template_parse, lines, args.repeat)
+    legacy = parser_bench.record_legacy(args.lines)
+    legacy_seconds, _ = parser_bench.measure(parser_bench.legacy_parse, legacy, args.repeat)
+    return {
+        'lines': len(lines),
+        'us_per_line': round(seconds / len(lines) * 1e6, 2),
+        'legacy_regex_us_per_line': round(legacy_seconds / len(legacy) * 1e6, 2),
+    }
+
+
+def bench_scaling(bench, args):
+    levels, n = [], 1
+    while n <= args.max_jobs:
+        levels.append(n)
+        n *= 2
+    results = {}
+    for count in levels:
+        bench.media.reset_stats()
+        start = time.perf_counter()
+        jobs = [bench.submit('standard') for _ in range(count)]
+        bench.wait(jobs, args.timeout)
+        elapsed = time.perf_counter() - start
+        total = sum(job_bytes(job) for job in jobs)
+        results[str(count)] = {
+            'seconds': round(elapsed, 3),
+            'aggregate_mb_per_s': round(total / elapsed / 1024 ** 2, 2),
+            'mean_job_seconds': round(statistics.mean(
+                sum(stage_times(job).values()) for job in jobs), 3),
+            'failed': sum(1 for job in jobs if job.progress['status'] != 'completed'),
+            'server': bench.media.reset_stats(),
+        }
+    base = results['1']['aggregate_mb_per_s'] or 1
+    for result in results.values():
+        result['speedup'] = round(result['aggregate_mb_per_s'] / base, 2)
+    return results
+
+
+def flatten(data, prefix=''):
+    flat = {}
+    for key, value in data.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(results, baseline):
+    old = flatten(baseline.get('results', {}))
+    changes = {}
+    for name, value in flatten(results).items():
+        if old.get(name):
+            changes[name] = {'baseline': old[name], 'current': value,
+                             'change_pct': round((value - old[name]) / old[name] * 100, 1)}
+    return changes
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument('--requests', type=int, default=10, help="previews per variant")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per download mode / parse measurement")
+    parser.add_argument('--lines', type=int, default=10000, help="progress lines to parse")
+    parser.add_argument('--max-jobs', type=int, default=4, help="largest concurrent job count")
+    parser.add_argument('--video-mb', type=float, default=20)
+    parser.add_argument('--audio-mb', type=float, default=2)
+    parser.add_argument('--hls-segments', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.0, help="media server delay per request (s)")
+    parser.add_argument('--bandwidth', type=int, default=0, help="media server bytes/s per connection")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of media requests failing")
+    parser.add_argument('--import-delay', type=float, default=0.4, help="stub yt-dlp start-up cost (s)")
+    parser.add_argument('--extract-delay', type=float, default=0.05, help="stub extraction time (s)")
+    parser.add_argument('--timeout', type=float, default=300, help="give up on a job after this long")
+    parser.add_argument('--output', help="also write the results to this file")
+    parser.add_argument('--baseline', help="earlier result file to compare against")
+    args = parser.parse_args()
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    media = start_media_server(latency=args.latency, bandwidth=args.bandwidth,
+                               error_rate=args.error_rate)
+    configure_environment(args, media.base_url)
+
+    # app.py keeps its journal, archive, log and thumbnails in the working
+    # directory; registered before app.py's own atexit hooks, the clean-up
+    # runs after its log writer has flushed
+    output = os.path.abspath(args.output) if args.output else None
+    work = tempfile.mkdtemp(prefix='avd-bench-')
+    atexit.register(shutil.rmtree, work, True)
+    os.chdir(work)
+    import app
+
+    app.DOWNLOAD_FOLDER = os.path.join(work, 'downloads')
+    os.makedirs(app.DOWNLOAD_FOLDER)
+    app.extractor_pool.start()
+    app.extractor_pool.call({'op': 'ping'})     # wait for the workers to import yt_dlp
+    app.job_manager.start()
+    bench = Bench(app, media)
+
+    results = {}
+    for name in scenarios:
+        results[name] = globals()[f'bench_{name}'](bench, args)
+
+    report = {
+        'benchmark': 'suite',
+        'started': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'results': results,
+    }
+    if baseline is not None:
+        report['comparison'] = compare(results, baseline)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Local HTTP server with synthetic media for the offline benchmarks.
+
+    /bytes/<size>/<name>                    <size> bytes of filler (an "MP4" stream)
+    /hls/<count>x<size>/<id>/index.m3u8     media playlist of <count> segments
+    /hls/<count>x<size>/<id>/seg<i>.ts      one <size>-byte segment
+
+/bytes answers Range requests ("bytes=N-") with the rest of the body.
+Every response can be slowed down and broken on purpose: `latency` seconds
+before it starts, at most `bandwidth` bytes/s per connection, and a
+`error_rate` chance of answering 503 instead (seeded, so runs repeat).
+
+    python benchmarks/media_server.py --port 8800 --latency 0.02 --bandwidth 4000000
+"""
+import argparse
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNK = 64 * 1024
+FILLER = bytes(range(256)) * (CHUNK // 256)
+SEGMENT_SECONDS = 4.0
+
+_BYTES = re.compile(r'^/bytes/(\d+)/[^/]+$')
+_HLS = re.compile(r'^/hls/(\d+)x(\d+)/([^/]+)/(index\.m3u8|seg(\d+)\.ts)$')
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.count('requests')
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and server.roll() < server.error_rate:
+            server.count('errors')
+            return self._send_error(503)
+
+        path = self.path.split('?', 1)[0]
+        match = _BYTES.match(path)
+        if match:
+            return self._send_body(int(match.group(1)), 'video/mp4')
+        match = _HLS.match(path)
+        if match:
+            count, size = int(match.group(1)), int(match.group(2))
+            if match.group(4) == 'index.m3u8':
+                return self._send_playlist(count)
+            if int(match.group(5)) >= count:
+                return self._send_error(404)
+            return self._send_body(size, 'video/mp2t')
+        self._send_error(404)
+
+    def _send_error(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_playlist(self, count):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{int(SEGMENT_SECONDS)}',
+                 '#EXT-X-MEDIA-SEQUENCE:0']
+        for i in range(count):
+            lines += [f'#EXTINF:{SEGMENT_SECONDS:.3f},', f'seg{i}.ts']
+        lines.append('#EXT-X-ENDLIST')
+        body = ('\n'.join(lines) + '\n').encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.apple.mpegurl')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_body(self, size, content_type):
+        first = 0
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if match and int(match.group(1)) < size:
+            first = int(match.group(1))
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {first}-{size - 1}/{size}')
+        else:
+            self.send_response(200)
+        size -= first
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        bandwidth = self.server.bandwidth
+        started = time.monotonic()
+        sent = 0
+        try:
+            while sent < size:
+                chunk = FILLER[:min(CHUNK, size - sent)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if bandwidth:
+                    ahead = sent / bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.server.count('bytes', sent)
+
+
+class MediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, bandwidth=0, error_rate=0.0, seed=0):
+        super().__init__(address, MediaHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'bytes': 0}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def roll(self):
+        with self.lock:
+            return self.random.random()
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def reset_stats(self):
+        with self.lock:
+            stats, self.stats = self.stats, {'requests': 0, 'errors': 0, 'bytes': 0}
+        return stats
+
+
+def start_media_server(**options):
+    """Serve on a free local port from a daemon thread; returns the server."""
+    server = MediaServer(**options)
+    threading.Thread(target=server.serve_forever, name='media-server', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before each response")
+    parser.add_argument('--bandwidth', type=int, default=0, help="bytes/s per connection (0 = unlimited)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with 503")
+    args = parser.parse_args()
+    server = MediaServer(('127.0.0.1', args.port), args.latency, args.bandwidth, args.error_rate)
+    print(f'Serving synthetic media on {server.base_url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
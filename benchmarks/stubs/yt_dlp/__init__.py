@@ -0,0 +1,88 @@
+"""
+Stand-in for the yt_dlp package used by the offline benchmarks.
+
+Importing it sleeps for STUB_IMPORT_DELAY seconds (the cost of loading
+yt-dlp's extractor modules) and every extraction sleeps for
+STUB_EXTRACT_DELAY seconds (the network round trips of a real site).
+Format URLs point at STUB_MEDIA_URL, normally a benchmarks/media_server.py
+instance, with STUB_VIDEO_BYTES / STUB_AUDIO_BYTES sized streams and an
+HLS rendition of STUB_HLS_SEGMENTS segments.
+"""
+import json
+import os
+import sys
+import time
+
+IMPORT_DELAY = float(os.environ.get('STUB_IMPORT_DELAY', '0.4'))
+EXTRACT_DELAY = float(os.environ.get('STUB_EXTRACT_DELAY', '0.05'))
+MEDIA_URL = os.environ.get('STUB_MEDIA_URL', 'http://127.0.0.1')
+VIDEO_BYTES = int(os.environ.get('STUB_VIDEO_BYTES', '60000000'))
+AUDIO_BYTES = int(os.environ.get('STUB_AUDIO_BYTES', '2000000'))
+HLS_SEGMENTS = int(os.environ.get('STUB_HLS_SEGMENTS', '30'))
+
+time.sleep(IMPORT_DELAY)
+
+
+def fake_info(url):
+    video_id = url.rstrip('/').rsplit('/', 1)[-1].split('=')[-1] or 'stub'
+    muxed_bytes = VIDEO_BYTES * 3 // 8
+    segment_bytes = max(1, (VIDEO_BYTES + AUDIO_BYTES) // HLS_SEGMENTS)
+    return {
+        'id': video_id,
+        'extractor': 'stub',
+        'extractor_key': 'Stub',
+        'webpage_url': url,
+        'title': f'Stub video {video_id}',
+        'duration': 120,
+        'duration_string': '2:00',
+        'uploader': 'stub',
+        'thumbnail': 'http://127.0.0.1/thumb.jpg',
+        'formats': [
+            {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none',
+             'height': 1080, 'width': 1920, 'tbr': 4000, 'filesize': VIDEO_BYTES,
+             'url': f'{MEDIA_URL}/bytes/{VIDEO_BYTES}/{video_id}-1080.mp4'},
+            {'format_id': '22', 'ext': 'mp4', 'vcodec': 'avc1.64001F', 'acodec': 'mp4a.40.2',
+             'height': 720, 'width': 1280, 'tbr': 1500, 'filesize': muxed_bytes,
+             'url': f'{MEDIA_URL}/bytes/{muxed_bytes}/{video_id}-720.mp4'},
+            {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2',
+             'abr': 128, 'filesize': AUDIO_BYTES,
+             'url': f'{MEDIA_URL}/bytes/{AUDIO_BYTES}/{video_id}-audio.m4a'},
+            {'format_id': 'hls-1080', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'mp4a.40.2',
+             'height': 1080, 'width': 1920, 'tbr': 4200, 'protocol': 'm3u8_native',
+             'url': f'{MEDIA_URL}/hls/{HLS_SEGMENTS}x{segment_bytes}/{video_id}/index.m3u8'},
+        ],
+    }
+
+
+class YoutubeDL:
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=False):
+        time.sleep(EXTRACT_DELAY)
+        return self.process_ie_result(fake_info(url), download=download)
+
+    def process_ie_result(self, info, download=False):
+        best = max(info['formats'], key=lambda f: f.get('tbr') or 0)
+        return dict(info, url=best['url'], format_id=best['format_id'])
+
+    @staticmethod
+    def sanitize_info(info):
+        return info
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    url = argv[-1]
+    info = YoutubeDL().extract_info(url, download=False)
+    if '--get-url' in argv:
+        print(info['url'])
+    else:
+        print(json.dumps(info))
+    return 0
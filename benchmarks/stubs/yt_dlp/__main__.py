@@ -0,0 +1,5 @@
+import sys
+
+from yt_dlp import main
+
+sys.exit(main())
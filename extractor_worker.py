@@ -0,0 +1,83 @@
+"""
+Warm extractor process for app.py's ExtractorPool.
+
+app.py hands control to main() before it imports Flask or sets anything
+up (`app.py --extractor-worker --user-agent UA`), so a worker loads
+yt-dlp and nothing else: no web app, no SQLite handles, no caches.
+"""
+import argparse
+import json
+import sys
+
+
+def main(argv=None):
+    """
+    Read one JSON request per line on stdin and answer with one JSON line
+    on stdout, keeping yt-dlp and its extractors imported between requests:
+      {"op": "ping"}
+      {"op": "info", "url": ...}                      -> {"ok": true, "info": {...}}
+      {"op": "url",  "url": ..., "format": ..., "info": {...}?}
+                                                      -> {"ok": true, "urls": [...]}
+    """
+    parser = argparse.ArgumentParser(prog='app.py --extractor-worker')
+    parser.add_argument('--user-agent', default='')
+    args = parser.parse_args(argv)
+
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr     # anything yt-dlp prints must not corrupt the protocol
+    sys.stdin.reconfigure(encoding='utf-8')
+    protocol_out.reconfigure(encoding='utf-8')
+
+    import yt_dlp
+
+    class _QuietLogger:
+        def debug(self, msg): pass
+        def info(self, msg): pass
+        def warning(self, msg): pass
+        def error(self, msg): pass
+
+    base_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'noplaylist': True,
+        'skip_download': True,
+        'nocheckcertificate': True,
+        'logger': _QuietLogger(),
+        'http_headers': {
+            'User-Agent': args.user_agent,
+            'Accept': '*/*',
+            'Accept-Language': 'en-US,en;q=0.9',
+        },
+    }
+    ydl = yt_dlp.YoutubeDL(base_opts)
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            req = json.loads(line)
+            op = req.get('op')
+            if op == 'ping':
+                resp = {'ok': True}
+            elif op == 'info':
+                info = ydl.extract_info(req['url'], download=False)
+                resp = {'ok': True, 'info': ydl.sanitize_info(info)}
+            elif op == 'url':
+                with yt_dlp.YoutubeDL(dict(base_opts, format=req.get('format') or 'best')) as y:
+                    if req.get('info'):
+                        result = y.process_ie_result(req['info'], download=False)
+                    else:
+                        result = y.extract_info(req['url'], download=False)
+                streams = result.get('requested_formats') or [result]
+                resp = {'ok': True, 'urls': [f['url'] for f in streams if f.get('url')]}
+            else:
+                resp = {'ok': False, 'error': f'Unknown op: {op}'}
+        except Exception as e:
+            resp = {'ok': False, 'error': str(e)}
+        protocol_out.write(json.dumps(resp) + '\n')
+        protocol_out.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """app.py as a module, logging into a temporary directory."""
+    sys.path.insert(0, ROOT)
+    import app
+    app.log_writer.path = str(tmp_path_factory.mktemp('app') / app.LOG_FILE)     # relative to the cwd otherwise
+    return app
+
+
+class FakeClock:
+    """A clock() that only moves when a test advances it."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
@@ -0,0 +1,127 @@
+"""BandwidthLimiter: yt-dlp claims and the HLS bucket together stay within the limit."""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def sleeps(app, monkeypatch):
+    slept = []
+    monkeypatch.setattr(app.time, 'sleep', slept.append)
+    return slept
+
+
+def cancelled():
+    event = threading.Event()
+    event.set()
+    return event
+
+
+def claim_in_thread(limiter, key):
+    granted = []
+    thread = threading.Thread(target=lambda: granted.append(limiter.claim(key)))
+    thread.start()
+    return thread, granted
+
+
+def wait_until(predicate):
+    deadline = time.monotonic() + 5
+    while not predicate():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_lone_claim_gets_the_whole_limit(app):
+    limiter = app.BandwidthLimiter(1000)
+    assert limiter.claim('a') == 1000
+
+
+def test_later_claim_waits_until_the_first_shrinks(app):
+    limiter = app.BandwidthLimiter(1000)
+    limiter.claim('a')
+    with pytest.raises(app.DownloadCancelled):
+        limiter.claim('b', cancel=cancelled())      # nothing left yet: waits, here cancelled
+
+    thread, granted = claim_in_thread(limiter, 'b')
+    wait_until(lambda: limiter.rebalance_due('a'))  # b counts as soon as it waits
+    assert limiter.claim('a') == 500                # a takes its new share...
+    thread.join(5)
+    assert granted == [500]                         # ...and b gets the rest
+    assert limiter.settings()['claimed'] == 1000
+
+
+def test_finished_download_lets_the_others_grow(app):
+    limiter = app.BandwidthLimiter(1000)
+    limiter.claim('a')
+    thread, _ = claim_in_thread(limiter, 'b')
+    wait_until(lambda: limiter.rebalance_due('a'))
+    limiter.claim('a')
+    thread.join(5)
+
+    assert not limiter.rebalance_due('a')
+    limiter.release('b')
+    assert limiter.rebalance_due('a')
+    assert limiter.claim('a') == 1000
+
+
+def test_small_growth_does_not_restart(app):
+    limiter = app.BandwidthLimiter(1000)
+    limiter.claims.update({'a': 200, 'b': 200, 'c': 200, 'd': 200, 'e': 200})
+    limiter.release('e')                            # 250 each now: only 25% more
+    assert limiter.rebalance_due('a')
+    limiter.claims.update({'a': 240})
+    assert not limiter.rebalance_due('a')
+
+
+def test_lowered_limit_shrinks_running_claims(app):
+    limiter = app.BandwidthLimiter(1000)
+    limiter.claim('a')
+    limiter.configure(400)
+    assert limiter.rebalance_due('a')
+    assert limiter.claim('a') == 400
+
+
+def test_time_window_switches_claims_on_and_off(app):
+    limiter = app.BandwidthLimiter(1000)
+    assert limiter.claim('a') == 1000
+
+    later = datetime.now() + timedelta(hours=2)
+    limiter.configure(1000, later.strftime('%H:%M'), (later + timedelta(hours=1)).strftime('%H:%M'))
+    assert limiter.rebalance_due('a')               # outside the window: run unlimited
+    assert limiter.claim('a') == 0
+
+    limiter.configure(1000)
+    assert limiter.rebalance_due('a')               # limit back on
+    assert limiter.claim('a') == 1000
+
+
+def test_claim_leaves_a_share_for_running_streams(app):
+    limiter = app.BandwidthLimiter(1000)
+    with limiter.streaming():
+        assert limiter.claim('a') == 500
+    assert limiter.rebalance_due('a')
+
+
+def test_bucket_runs_at_the_unclaimed_rate(app, clock, sleeps):
+    limiter = app.BandwidthLimiter(1000, clock=clock)
+    with limiter.streaming():
+        limiter.claim('a')                  # 500 claimed, 500 left for the bucket
+        limiter.throttle(1500)
+    assert sleeps == [3.0]
+
+
+def test_fully_claimed_bucket_waits_or_cancels(app):
+    limiter = app.BandwidthLimiter(1000)
+    limiter.claim('a')
+    with pytest.raises(app.DownloadCancelled):
+        limiter.throttle(100, cancelled())
+
+
+def test_no_limit_means_no_claims(app, sleeps):
+    limiter = app.BandwidthLimiter(0)
+    assert limiter.claim('a') == 0
+    assert not limiter.rebalance_due('a')
+    limiter.throttle(10 ** 9)
+    assert sleeps == [] and limiter.settings()['claimed'] == 0
@@ -0,0 +1,99 @@
+"""DownloadArchive: a copy is only reused when it is at least the quality asked for."""
+import json
+import sqlite3
+
+import pytest
+
+KEY = ('youtube', 'abc123')
+INFO = {'extractor_key': 'Youtube', 'id': 'abc123', 'duration': 60, 'formats': [
+    {'format_id': '18', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'height': 360, 'ext': 'mp4'},
+    {'format_id': '136', 'vcodec': 'avc1.4d401f', 'acodec': 'none', 'height': 720, 'ext': 'mp4'},
+    {'format_id': '137', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080, 'ext': 'mp4'},
+    {'format_id': '140', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128, 'ext': 'm4a'},
+]}
+
+
+@pytest.fixture
+def archive(app, tmp_path):
+    return app.DownloadArchive(str(tmp_path / 'archive.db'))
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'x' * 100)
+    return str(path)
+
+
+def test_lookup_reports_the_archived_height(app, archive, video):
+    archive.record(KEY, 'mp4', 'https://youtu.be/abc123', 'Video', video, 360)
+    [copy] = archive.lookup(KEY, 'mp4')
+    assert copy['height'] == 360 and copy['path'] == video and copy['size'] == 100
+
+
+@pytest.mark.parametrize('quality, wanted', [
+    ('best', 1080),
+    ('720', 720),
+    ('h:480', 360),         # the best this video has at or below 480p
+    ('id:137:1080', 1080),
+])
+def test_wanted_height(app, quality, wanted):
+    assert app.archive_wanted_height(INFO, 'mp4', quality, 'standard') == wanted
+
+
+def test_audio_and_unknown_requests(app):
+    assert app.archive_wanted_height(INFO, 'mp3', 'best', 'standard') == 0
+    assert app.archive_wanted_height(None, 'mp4', '720', 'standard') == 720
+    assert app.archive_wanted_height(None, 'mp4', 'best', 'standard') is None
+
+
+def test_lower_quality_copy_is_not_reused(app, archive, video):
+    archive.record(KEY, 'mp4', 'https://youtu.be/abc123', 'Video', video, 360)
+    copies = archive.lookup(KEY, 'mp4')
+    assert app.archive_match(copies, 1080) is None
+    assert app.archive_match(copies, 360) == copies[0]
+    assert app.archive_match(copies, None) == copies[0]
+
+
+def test_copy_of_unknown_height_only_does_for_unknown_requests(app, archive, video):
+    archive.record(KEY, 'mp4', 'https://youtu.be/abc123', 'Video', video)
+    copies = archive.lookup(KEY, 'mp4')
+    assert app.archive_match(copies, 720) is None
+    assert app.archive_match(copies, None) == copies[0]
+
+
+def test_rebuild_keeps_heights(app, archive, video, tmp_path):
+    archive.record(KEY, 'mp4', 'https://youtu.be/abc123', 'Video', video, 720)
+    manifest = tmp_path / app.ARCHIVE_MANIFEST
+    assert json.loads(manifest.read_text().splitlines()[-1])['height'] == 720
+
+    archive.conn.execute('DELETE FROM downloads')
+    assert archive.rebuild(str(tmp_path)) == 1
+    assert archive.lookup(KEY)[0]['height'] == 720
+
+
+def test_archive_from_before_heights_is_upgraded(app, tmp_path, video):
+    path = str(tmp_path / 'old.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute("""
+            CREATE TABLE downloads (
+                extractor TEXT NOT NULL, video_id TEXT NOT NULL, format TEXT NOT NULL,
+                url TEXT, title TEXT, output_path TEXT, size INTEGER, downloaded REAL,
+                PRIMARY KEY (extractor, video_id, format)
+            ) WITHOUT ROWID""")
+        conn.execute("INSERT INTO downloads VALUES (?,?,?,?,?,?,?,?)",
+                     KEY + ('mp4', 'https://youtu.be/abc123', 'Video', video, 100, 1.0))
+    conn.close()
+
+    archive = app.DownloadArchive(path)
+    assert archive.lookup(KEY)[0]['height'] is None
+    archive.record(KEY, 'mp4', 'https://youtu.be/abc123', 'Video', video, 1080)
+    assert archive.lookup(KEY)[0]['height'] == 1080
+
+
+def test_archive_is_only_created_on_first_use(app, tmp_path, video):
+    path = tmp_path / 'lazy.db'
+    archive = app.DownloadArchive(str(path))
+    assert archive.created and not path.exists()
+    archive.record(KEY, 'mp4', 'https://youtu.be/abc123', 'Video', video, 360)
+    assert path.exists()
@@ -0,0 +1,68 @@
+"""ExtractorPool: superseded previews neither wait for nor disturb a warm worker."""
+import threading
+import time
+
+import pytest
+
+
+class FakeWorker:
+    name = '#0'
+
+    def __init__(self):
+        self.proc = object()
+        self.starts = 0
+        self.requests = []
+
+    def alive(self):
+        return True
+
+    def start(self):
+        self.starts += 1
+
+    def request(self, payload, timeout):
+        self.requests.append(payload)
+        return {'ok': True, 'info': {'id': payload.get('url')}}
+
+
+@pytest.fixture
+def pool(app):
+    pool = app.ExtractorPool(1)
+    pool.started = True         # workers are handed in by the tests
+    return pool
+
+
+def test_replaced_preview_stops_waiting_for_a_worker(app, pool):
+    ticket = app.PreviewTicket()
+    threading.Timer(0.3, ticket.cancel).start()
+    started = time.monotonic()
+    with pytest.raises(app.PreviewCancelled):
+        pool.extract('https://example.com/v', ticket=ticket)    # every worker busy
+    assert time.monotonic() - started < 2
+
+
+def test_replaced_preview_returns_the_worker_untouched(app, pool):
+    worker = FakeWorker()
+    pool.idle.put(worker)
+    ticket = app.PreviewTicket()
+    ticket.cancel()
+
+    with pytest.raises(app.PreviewCancelled):
+        pool.extract('https://example.com/v', ticket=ticket)
+    assert pool.idle.get_nowait() is worker
+    assert worker.starts == 0 and worker.requests == []
+
+
+def test_live_preview_gets_its_answer(app, pool):
+    worker = FakeWorker()
+    pool.idle.put(worker)
+    assert pool.extract('https://example.com/v', ticket=app.PreviewTicket()) == {'id': 'https://example.com/v'}
+    assert pool.idle.get_nowait() is worker
+
+
+def test_cancelled_job_stops_waiting_for_a_worker(app, pool, tmp_path):
+    job = app.DownloadJob('https://example.com/v', 'mp4', 'best', 'standard', str(tmp_path))
+    threading.Timer(0.3, job.cancel).start()
+    started = time.monotonic()
+    with pytest.raises(app.PreviewCancelled):
+        pool.extract('https://example.com/v', ticket=job)
+    assert time.monotonic() - started < 2
@@ -0,0 +1,56 @@
+"""FormatPolicy: only pairs the output container can hold, or an honest switch to MKV."""
+import pytest
+
+# A typical YouTube format list (video-only DASH, audio-only, one muxed)
+FORMATS = [
+    {'format_id': '18', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'height': 360, 'tbr': 500},
+    {'format_id': '134', 'vcodec': 'avc1.4d401e', 'acodec': 'none', 'height': 360, 'tbr': 300},
+    {'format_id': '136', 'vcodec': 'avc1.4d401f', 'acodec': 'none', 'height': 720, 'tbr': 1500},
+    {'format_id': '137', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080, 'tbr': 3000},
+    {'format_id': '244', 'vcodec': 'vp09.00.30.08', 'acodec': 'none', 'height': 480, 'tbr': 500},
+    {'format_id': '248', 'vcodec': 'vp09.00.40.08', 'acodec': 'none', 'height': 1080, 'tbr': 2500},
+    {'format_id': '140', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128},
+    {'format_id': '251', 'vcodec': 'none', 'acodec': 'opus', 'abr': 160},
+]
+
+
+@pytest.fixture
+def policy(app):
+    return app.FormatPolicy()
+
+
+def info(*drop):
+    return {'duration': 60, 'formats': [f for f in FORMATS if f['format_id'] not in drop]}
+
+
+def test_mp4_gets_h264_and_aac(policy):
+    plan = policy.select(info(), '720', 'mp4')
+    assert plan['selector'] == '136+140' and plan['container'] == 'mp4'
+
+
+def test_webm_never_pairs_h264(policy):
+    # No VP9 at 720: a lower VP9 beats a 720p H.264 WebM can't hold
+    plan = policy.select(info(), '720', 'webm')
+    assert plan['selector'] == '244+251'
+    assert (plan['vcodec'], plan['acodec'], plan['container']) == ('vp9', 'opus', 'webm')
+
+
+def test_webm_best_takes_the_top_vp9(policy):
+    assert policy.select(info(), 'best', 'webm')['selector'] == '248+251'
+
+
+def test_no_fitting_pair_is_merged_into_mkv(policy):
+    plan = policy.select(info('244', '248', '251'), '720', 'webm')
+    assert plan['selector'] == '136+140'
+    assert plan['container'] == 'mkv'
+
+
+def test_format_plan_reports_the_container(app, policy, monkeypatch):
+    url = 'https://www.youtube.com/watch?v=abc'
+    monkeypatch.setattr(app, 'format_policy', policy)
+    monkeypatch.setattr(app.info_cache, 'get', lambda key: info('244', '248') if key == url else None)
+    monkeypatch.setattr(app, 'disk_warning', lambda *args: None)
+
+    resp = app.app.test_client().post('/format_plan', json={'url': url, 'format': 'webm', 'quality': '720'})
+    plan = resp.get_json()['plan']
+    assert plan['container'] == 'mkv' and plan['selector'] == '136+251'
@@ -0,0 +1,202 @@
+"""parse_hls_playlist and HlsDownloader against a synthetic playlist served over local HTTP."""
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+
+class PlaylistHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split('?', 1)[0]
+        with server.lock:
+            server.requests.append(path)
+        if path not in server.files:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body, delay = server.files[path]
+        time.sleep(delay)
+        status = 200
+        if self.headers.get('Range'):
+            first, _, last = self.headers['Range'][len('bytes='):].partition('-')
+            body = body[int(first):int(last) + 1]
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), PlaylistHandler)
+    httpd.files = {}        # path -> (body, seconds to wait before answering)
+    httpd.requests = []
+    httpd.lock = threading.Lock()
+    httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}'
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def serve(server, path, body, delay=0.0):
+    server.files[path] = (body.encode() if isinstance(body, str) else body, delay)
+    return server.url + path
+
+
+def segment(i, size=1000):
+    return bytes([i]) * size
+
+
+def media_playlist(entries, header=''):
+    return '#EXTM3U\n#EXT-X-TARGETDURATION:4\n' + header + ''.join(entries) + '#EXT-X-ENDLIST\n'
+
+
+@pytest.fixture
+def downloader(app):
+    def make(**kwargs):
+        kwargs.setdefault('concurrency', 4)
+        return app.HlsDownloader(requests.Session(), **kwargs)
+    return make
+
+
+def test_segments_are_written_in_playlist_order(app, server, downloader, tmp_path):
+    # Early segments answer last, so they finish out of order
+    entries = []
+    for i in range(8):
+        serve(server, f'/v/seg{i}.ts', segment(i), delay=0.05 * (8 - i))
+        entries.append(f'#EXTINF:4.0,\nseg{i}.ts\n')
+    url = serve(server, '/v/index.m3u8', media_playlist(entries))
+
+    d = downloader(concurrency=8)
+    [(name, playlist)] = d.load(url)
+    out = tmp_path / 'video.ts'
+    d.download(playlist, str(out))
+
+    assert name == 'video'
+    assert out.read_bytes() == b''.join(segment(i) for i in range(8))
+    assert d.done_segments == d.total_segments == 8
+
+
+def test_master_playlist_picks_variant_and_audio(app, server, downloader):
+    serve(server, '/v/seg0.ts', segment(0))
+    serve(server, '/a/seg0.aac', segment(9))
+    serve(server, '/v/index.m3u8', media_playlist(['#EXTINF:4,\nseg0.ts\n']))
+    serve(server, '/a/index.m3u8', media_playlist(['#EXTINF:4,\nseg0.aac\n']))
+    url = serve(server, '/master.m3u8', (
+        '#EXTM3U\n'
+        '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="en",DEFAULT=YES,URI="a/index.m3u8"\n'
+        '#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.4d401e,ec-3",AUDIO="aud"\n'
+        'v/index.m3u8\n'
+        '#EXT-X-STREAM-INF:BANDWIDTH=3000000,RESOLUTION=1920x1080,AUDIO="aud"\n'
+        'missing.m3u8\n'
+    ))
+
+    d = downloader()
+    media = d.load(url, max_height=720)
+    assert [name for name, _ in media] == ['video', 'audio']
+    assert d.codecs == 'avc1.4d401e,ec-3'
+    assert app.hls_audio_is_aac(d.codecs) is False
+
+
+def test_aes128_segments_are_decrypted(app, server, downloader, tmp_path):
+    pytest.importorskip('cryptography')
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    key = os.urandom(16)
+    serve(server, '/enc/key.bin', key)
+    entries = []
+    for i in range(3):
+        iv = i.to_bytes(16, 'big')      # no IV attribute: the media sequence number
+        padder = padding.PKCS7(128).padder()
+        plain = padder.update(segment(i, 1001)) + padder.finalize()
+        encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+        serve(server, f'/enc/seg{i}.ts', encryptor.update(plain) + encryptor.finalize())
+        entries.append(f'#EXTINF:4,\nseg{i}.ts\n')
+    url = serve(server, '/enc/index.m3u8', media_playlist(
+        entries, '#EXT-X-KEY:METHOD=AES-128,URI="key.bin"\n'))
+
+    d = downloader()
+    [(_, playlist)] = d.load(url)
+    out = tmp_path / 'video.ts'
+    d.download(playlist, str(out))
+
+    assert out.read_bytes() == b''.join(segment(i, 1001) for i in range(3))
+    assert server.requests.count('/enc/key.bin') == 1
+
+
+def test_byterange_segments_come_from_one_file(app, server, downloader, tmp_path):
+    blob = b''.join(segment(i, 500) for i in range(4))
+    serve(server, '/br/all.ts', blob)
+    url = serve(server, '/br/index.m3u8', media_playlist([
+        '#EXTINF:4,\n#EXT-X-BYTERANGE:500@0\nall.ts\n',
+        '#EXTINF:4,\n#EXT-X-BYTERANGE:500\nall.ts\n',      # continues at 500
+        '#EXTINF:4,\n#EXT-X-BYTERANGE:500\nall.ts\n',
+        '#EXTINF:4,\n#EXT-X-BYTERANGE:500@1500\nall.ts\n',
+    ]))
+
+    d = downloader()
+    [(_, playlist)] = d.load(url)
+    assert [s['byterange'] for s in playlist['segments']] == [(500, 0), (500, 500), (500, 1000), (500, 1500)]
+    assert app.hls_playlist_size(playlist) == 2000
+
+    out = tmp_path / 'video.ts'
+    d.download(playlist, str(out))
+    assert out.read_bytes() == blob
+
+
+def test_resume_from_checkpoint(app, server, downloader, tmp_path):
+    entries = []
+    for i in range(6):
+        serve(server, f'/r/seg{i}.ts', segment(i))
+        entries.append(f'#EXTINF:4,\nseg{i}.ts\n')
+    url = serve(server, '/r/index.m3u8', media_playlist(entries))
+    expected = b''.join(segment(i) for i in range(6))
+
+    checkpoints = []
+    d = downloader()
+    [(_, playlist)] = d.load(url)
+    out = tmp_path / 'video.ts'
+    d.download(playlist, str(out), checkpoint=lambda n, pos: checkpoints.append((n, pos)))
+    assert checkpoints[-1] == (6, len(expected))
+
+    # As if the app stopped while segment 3 was half written
+    count, offset = checkpoints[2]
+    with open(out, 'r+b') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        f.write(b'half a segment')
+    server.requests.clear()
+
+    d = downloader()
+    [(_, playlist)] = d.load(url)
+    d.download(playlist, str(out), start_index=count, start_offset=offset)
+
+    assert out.read_bytes() == expected
+    assert sorted(p for p in server.requests if p.endswith('.ts')) == [f'/r/seg{i}.ts' for i in range(3, 6)]
+    assert d.resumed_bytes == offset
+
+
+@pytest.mark.parametrize('codecs, aac', [
+    ('avc1.64001f,mp4a.40.2', True),
+    ('avc1.64001f,ac-3', False),
+    ('hvc1.1.6.L93.B0,ec-3', False),
+    ('avc1.64001f,mp4a.69', False),     # MP3
+    ('avc1.64001f', None),
+    (None, None),
+])
+def test_hls_audio_is_aac(app, codecs, aac):
+    assert app.hls_audio_is_aac(codecs) is aac
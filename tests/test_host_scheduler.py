@@ -0,0 +1,89 @@
+"""HostScheduler policy, driven through poll() with fake jobs and a simulated clock."""
+import pytest
+
+
+class FakeJob:
+    def __init__(self, name, host):
+        self.name = name
+        self.host = host
+
+    def __repr__(self):
+        return self.name
+
+
+def add(scheduler, *names):
+    jobs = [FakeJob(name, name[0]) for name in names]     # host = first letter
+    for job in jobs:
+        scheduler.add(job)
+    return jobs
+
+
+def names(scheduler, count):
+    started = []
+    for _ in range(count):
+        job, wait = scheduler.poll()
+        assert job is not None, f'nothing started, wait={wait}'
+        started.append(job.name)
+    return started
+
+
+def test_per_host_cap(app, clock):
+    scheduler = app.HostScheduler(max_per_host=2, spacing=0, clock=clock)
+    a1, a2, a3 = add(scheduler, 'a1', 'a2', 'a3')
+
+    assert names(scheduler, 2) == ['a1', 'a2']
+    assert scheduler.poll() == (None, None)     # only a finishing job frees a slot
+    assert scheduler.running_by_host() == {'a': 2}
+
+    scheduler.done(a1)
+    assert scheduler.poll() == (a3, None)
+    assert scheduler.waiting() == 0
+
+
+def test_spacing_wait(app, clock):
+    scheduler = app.HostScheduler(max_per_host=3, spacing=5, clock=clock)
+    add(scheduler, 'a1', 'a2')
+
+    assert names(scheduler, 1) == ['a1']
+    assert scheduler.poll() == (None, 5)
+    clock.advance(3)
+    assert scheduler.poll() == (None, 2)
+    clock.advance(2)
+    assert names(scheduler, 1) == ['a2']
+
+
+def test_spacing_does_not_hold_up_other_hosts(app, clock):
+    scheduler = app.HostScheduler(max_per_host=3, spacing=5, clock=clock)
+    add(scheduler, 'a1', 'a2', 'b1')
+
+    assert names(scheduler, 2) == ['a1', 'b1']
+    job, wait = scheduler.poll()
+    assert job is None and wait == 5
+
+
+def test_round_robin(app, clock):
+    scheduler = app.HostScheduler(max_per_host=10, spacing=0, clock=clock)
+    add(scheduler, 'a1', 'a2', 'a3', 'b1', 'b2', 'c1')
+
+    assert names(scheduler, 6) == ['a1', 'b1', 'c1', 'a2', 'b2', 'a3']
+    assert scheduler.poll() == (None, None)
+
+
+def test_per_host_limits_override_defaults(app, clock):
+    scheduler = app.HostScheduler(max_per_host=2, spacing=0, limits={'b': (1, 0)}, clock=clock)
+    add(scheduler, 'a1', 'a2', 'b1', 'b2')
+
+    assert names(scheduler, 3) == ['a1', 'b1', 'a2']
+    assert scheduler.poll() == (None, None)
+    assert scheduler.running_by_host() == {'a': 2, 'b': 1}
+
+
+def test_remove_withdraws_waiting_job(app, clock):
+    scheduler = app.HostScheduler(max_per_host=1, spacing=0, clock=clock)
+    a1, a2 = add(scheduler, 'a1', 'a2')
+
+    assert scheduler.poll() == (a1, None)
+    assert scheduler.remove(a1) is False        # already running
+    assert scheduler.remove(a2) is True
+    scheduler.done(a1)
+    assert scheduler.poll() == (None, None)
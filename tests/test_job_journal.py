@@ -0,0 +1,47 @@
+"""JobJournal: unfinished jobs come back after a restart; old finished ones are pruned."""
+import pytest
+
+
+@pytest.fixture
+def journal(app, tmp_path):
+    return app.JobJournal(str(tmp_path / 'jobs.db'))
+
+
+def job(app, status, created):
+    job = app.DownloadJob(f'https://example.com/{status}/{created}', 'mp4', 'best', 'standard',
+                          '/downloads', created=created)
+    job.progress['status'] = status
+    job.resume = {'created': created}
+    return job
+
+
+def test_unfinished_lists_only_jobs_that_did_not_finish(app, journal):
+    for created, status in enumerate(['downloading', 'completed', 'queued', 'error', 'cancelled'], 1):
+        journal.save(job(app, status, created))
+
+    rows = journal.unfinished()
+    assert [row[1] for row in rows] == ['https://example.com/downloading/1', 'https://example.com/queued/3']
+    assert rows[0][7] == '{"created": 1}'
+
+
+def test_unfinished_survives_reopening(app, journal):
+    journal.save(job(app, 'downloading', 1))
+    reopened = app.JobJournal(journal.path)
+    assert len(reopened.unfinished()) == 1
+
+
+def test_prune_keeps_the_latest_finished_jobs(app, journal):
+    for created in range(1, 6):
+        journal.save(job(app, 'completed', created))
+    journal.save(job(app, 'downloading', 9))
+
+    journal.prune(2)
+
+    statuses = journal.conn.execute('SELECT status FROM jobs ORDER BY created').fetchall()
+    assert statuses == [('completed',), ('completed',), ('downloading',)]
+
+
+def test_manager_without_journal_writes_nothing(app):
+    # Importing app leaves the journal to start-up, so tests and tools don't get a jobs.db
+    assert app.job_manager.journal is None
+    assert app.JobManager(1).resume_unfinished() == []
@@ -0,0 +1,55 @@
+"""/preview/batch: request validation and the streamed NDJSON lines."""
+import io
+import json
+
+import pytest
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+@pytest.fixture
+def extract(app, monkeypatch):
+    def fake_extract(url, wait=True, **kwargs):
+        if 'broken' in url:
+            return None, 'Extraction failed'
+        return {'title': url.rsplit('/', 1)[-1]}, None
+    monkeypatch.setattr(app, 'extract_info', fake_extract)
+    monkeypatch.setattr(app, 'preview_fields', lambda info: {'title': info['title']})
+
+
+def test_batch_urls_dedupes_and_keeps_order(app):
+    text = 'https://a.test/1, https://a.test/2\nnot a url\nhttps://a.test/1 ftp://a.test/3'
+    assert app.batch_urls(text) == ['https://a.test/1', 'https://a.test/2']
+
+
+def test_results_stream_as_ndjson(client, extract):
+    resp = client.post('/preview/batch', json={'urls': ['https://a.test/one', 'https://a.test/broken']})
+    assert resp.mimetype == 'application/x-ndjson'
+
+    lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    results = sorted(lines[:-1], key=lambda r: r['index'])
+    assert results[0] == {'index': 0, 'url': 'https://a.test/one', 'title': 'one'}
+    assert results[1]['error'] == 'Extraction failed'
+    assert lines[-1] == {'done': 2, 'failed': 1}
+
+
+def test_uploaded_file(client, extract):
+    data = {'file': (io.BytesIO(b'https://a.test/one\nhttps://a.test/two\n'), 'links.txt')}
+    resp = client.post('/preview/batch', data=data, content_type='multipart/form-data')
+    lines = resp.get_data(as_text=True).splitlines()
+    assert json.loads(lines[-1]) == {'done': 2, 'failed': 0}
+
+
+@pytest.mark.parametrize('body', [
+    {'urls': ['https://a.test/one', 42]},
+    {'urls': [None]},
+    {'urls': 'https://a.test/one'},
+    {'text': ['https://a.test/one']},
+])
+def test_invalid_entries_are_rejected(client, extract, body):
+    resp = client.post('/preview/batch', json=body)
+    assert resp.status_code == 400
+    assert 'error' in resp.get_json()
@@ -0,0 +1,61 @@
+"""YtdlpProgressParser and FfmpegProgressParser: fields produced from recorded output."""
+
+
+def ytdlp_line(app, downloaded='NA', total='1000', speed='NA', status='downloading',
+               vcodec='avc1', acodec='none'):
+    return app.YtdlpProgressParser.PREFIX + ' '.join(
+        ['137', vcodec, acodec, status, downloaded, total, 'NA', speed, 'NA', 'NA', 'NA'])
+
+
+def test_format_speed_keeps_byte_precision(app):
+    assert app.format_speed(0) == '0B/s'
+    assert app.format_speed(512) == '512B/s'
+    assert app.format_speed(2048) == '2KB/s'
+    assert app.format_speed(None) is None
+
+
+def test_slow_ytdlp_speed_is_not_rounded_to_zero(app):
+    parser = app.YtdlpProgressParser()
+    fields = parser.feed(ytdlp_line(app, downloaded='100', speed='300.5'))
+    assert fields['speed'] == '300B/s'
+    assert fields['speed_bps'] == 300.5
+
+
+def test_ytdlp_unknown_byte_count_keeps_the_last_one(app):
+    parser = app.YtdlpProgressParser()
+    parser.feed(ytdlp_line(app, downloaded='400'))
+    fields = parser.feed(ytdlp_line(app, downloaded='NA'))
+    assert 'downloaded_bytes' not in fields
+    assert 'downloaded' not in fields
+    assert 'percent' not in fields
+
+
+def test_ytdlp_video_then_audio_phases(app):
+    parser = app.YtdlpProgressParser()
+    assert parser.feed(ytdlp_line(app, downloaded='500'))['percent'] == 37
+    fields = parser.feed(ytdlp_line(app, downloaded='500', vcodec='none', acodec='mp4a'))
+    assert fields['stage'] == 'audio'
+    assert fields['percent'] == 75 + 8
+
+
+def feed_block(parser, **values):
+    for key, value in values.items():
+        assert parser.feed(f'{key}={value}') is None
+    return parser.feed('progress=continue')
+
+
+def test_ffmpeg_block_fields(app):
+    parser = app.FfmpegProgressParser(duration=10)
+    fields = feed_block(parser, out_time_us='5000000', total_size='2048',
+                        bitrate='3.3kbits/s', speed='2.0x')
+    assert fields['percent'] == 50
+    assert fields['downloaded_bytes'] == 2048
+    assert fields['total_bytes'] == 4096
+    assert fields['eta'] == app.format_eta(2.5)
+
+
+def test_ffmpeg_na_block_does_not_reset_progress(app):
+    parser = app.FfmpegProgressParser(duration=10)
+    feed_block(parser, out_time_us='5000000', total_size='2048')
+    fields = feed_block(parser, out_time_us='N/A', total_size='N/A', bitrate='N/A', speed='N/A')
+    assert fields == {'duration_s': 10}
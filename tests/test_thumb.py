@@ -0,0 +1,101 @@
+"""/thumb: only signed, public thumbnail URLs are fetched, and only real images are kept."""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\0' * 64
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/private/admin')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = PNG if self.path == '/thumb.png' else b'<html>not an image</html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')     # wrong on purpose for both
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def cache(app, tmp_path, monkeypatch):
+    cache = app.ThumbCache(str(tmp_path / 'thumbs'), 1024 * 1024)
+    monkeypatch.setattr(app, 'thumb_cache', cache)
+    # The test server is on loopback, which the real check refuses
+    monkeypatch.setattr(app, 'public_http_url', lambda url: '/private/' not in url)
+    return cache
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize('url, public', [
+    ('http://127.0.0.1/x.jpg', False),
+    ('http://localhost:8080/x.jpg', False),
+    ('http://10.0.0.5/x.jpg', False),
+    ('http://192.168.1.1/x.jpg', False),
+    ('http://169.254.169.254/latest/meta-data', False),
+    ('http://[::1]/x.jpg', False),
+    ('ftp://8.8.8.8/x.jpg', False),
+    ('https://8.8.8.8/x.jpg', True),
+])
+def test_public_http_url(app, url, public):
+    assert app.public_http_url(url) is public
+
+
+def test_unsigned_urls_are_refused(app, client):
+    assert client.get('/thumb?url=http://10.0.0.5/x.jpg').status_code == 403
+    assert client.get('/thumb?url=http://10.0.0.5/x.jpg&sig=0000').status_code == 403
+
+
+def test_signed_private_url_is_still_not_fetched(app, client):
+    resp = client.get(app.thumb_path('http://127.0.0.1:9/x.jpg'))
+    assert resp.status_code == 502
+
+
+def test_signed_image_is_cached_with_its_real_type(app, client, cache, server):
+    resp = client.get(app.thumb_path(server + '/thumb.png'))
+    assert resp.status_code == 200
+    assert resp.mimetype == 'image/png'
+    assert resp.data == PNG
+    assert [name.endswith('.orig.png') for name in cache.files] == [True]
+
+
+def test_non_image_body_is_not_cached(app, client, cache, server):
+    resp = client.get(app.thumb_path(server + '/page.html'))
+    assert resp.status_code == 502
+    assert not cache.files
+
+
+def test_redirect_to_private_address_is_refused(app, cache, server):
+    with pytest.raises(ValueError):
+        cache.get(server + '/redirect')
+    assert not cache.files
+
+
+def test_previews_hand_out_signed_paths(app):
+    path = app.thumb_path('https://i.ytimg.com/vi/abc/hq.jpg')
+    assert path.startswith('/thumb?url=https%3A%2F%2Fi.ytimg.com')
+    assert app.thumb_path(None) is None
+    assert app.playlist_entry({'url': 'https://a.test/v', 'thumbnail': 'https://a.test/t.jpg'}, 1)['thumb'] \
+        == app.thumb_path('https://a.test/t.jpg')